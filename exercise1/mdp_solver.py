@@ -4,6 +4,7 @@ from typing import List, Tuple, Dict, Optional, Hashable
 
 from rl2022.constants import EX1_CONSTANTS as CONSTANTS
 from rl2022.exercise1.mdp import MDP, Transition, State, Action
+from rl2022.profiling import NULL_PROFILER, make_profiler
 
 
 class MDPSolver(ABC):
@@ -13,20 +14,42 @@ class MDPSolver(ABC):
     :attr gamma (float): discount factor gamma to use
     :attr action_dim (int): number of actions in the MDP
     :attr state_dim (int): number of states in the MDP
+    :attr profile (Dict, optional): window of sweeps to profile (see profiling.py)
+    :attr sweeps (int): number of sweeps updating the values of all states completed by the last
+        call to solve (value iteration sweeps or policy evaluation sweeps, but not policy
+        improvement steps)
     """
 
-    def __init__(self, mdp: MDP, gamma: float):
+    def __init__(self, mdp: MDP, gamma: float, profile: Optional[Dict] = None):
         """Constructor of MDPSolver
         Initialises some variables from the MDP, namely the state and action dimension variables
         :param mdp (MDP): MDP to solve
         :param gamma (float): discount factor (gamma)
+        :param profile (Dict, optional): window of sweeps (see sweeps) to profile, e.g.
+            {"start": 100, "stop": 200} (None profiles only if the environment variable
+            RL2022_PROFILE is set)
         """
         self.mdp: MDP = mdp
         self.gamma: float = gamma
+        self.profile = profile
+        self.profiler = NULL_PROFILER
+        self.sweeps = 0
 
         self.action_dim: int = len(self.mdp.actions)
         self.state_dim: int = len(self.mdp.states)
 
+    def _start_profiler(self):
+        """Creates the profiler of a call to solve and resets the sweep counter
+        """
+        self.sweeps = 0
+        self.profiler = make_profiler(self.profile, type(self).__name__)
+
+    def _sweep_done(self):
+        """Counts a completed sweep over the states and reports it to the profiler
+        """
+        self.sweeps += 1
+        self.profiler.step(self.sweeps)
+
     def decode_policy(self, policy: Dict[int, np.ndarray]) -> Dict[State, Action]:
         """Generates greedy, deterministic policy dict
         Given a stochastic policy from state indeces to distribution over actions, the greedy,
@@ -82,6 +105,7 @@ class ValueIteration(MDPSolver):
                 V[curr_state] = max(current_action_vals)
                 if delta < curr_v - V[curr_state]:
                     delta = curr_v - V[curr_state]
+            self._sweep_done()
         return V
         
     def _calc_policy(self, V: np.ndarray) -> np.ndarray:
@@ -119,8 +143,10 @@ class ValueIteration(MDPSolver):
             Tuple of calculated policy and value function
         """
         self.mdp.ensure_compiled()
+        self._start_profiler()
         V = self._calc_value_func(theta)
         policy = self._calc_policy(V)
+        self.profiler.close(self.sweeps)
 
         return policy, V
 
@@ -152,7 +178,8 @@ class PolicyIteration(MDPSolver):
                 action = np.argmax(policy[curr_state, :])
                 curr_vs = V[curr_state]
                 V[curr_state] = np.sum([self.mdp.P[curr_state,action,future_state]*(self.mdp.R[curr_state,action,future_state] + self.gamma*V[future_state]) for future_state in range(self.state_dim)])
-                
+            self._sweep_done()
+
             if np.abs(V[curr_state] - curr_vs) > solver.theta:
                 break
 
@@ -209,7 +236,10 @@ class PolicyIteration(MDPSolver):
         """
         self.mdp.ensure_compiled()
         self.theta = theta
-        return self._policy_improvement()
+        self._start_profiler()
+        policy, V = self._policy_improvement()
+        self.profiler.close(self.sweeps)
+        return policy, V
 
 
 if __name__ == "__main__":
@@ -1,10 +1,21 @@
 from abc import ABC, abstractmethod
-from collections import defaultdict
-import random
-from typing import List, Dict, DefaultDict
+from typing import List, Dict, Optional, Union
+import numpy as np
 from gym.spaces import Space
 from gym.spaces.utils import flatdim
 
+from rl2022.exercise2.encoders import ObservationEncoder
+from rl2022.exercise2.tables import PagedQTable, make_table
+from rl2022.rng import RandomStream, default_stream
+from rl2022.schedules import Schedule, make_schedule
+
+# piecewise-linear form of min(0.7 - 0.95 * min(0.7, t / (0.5 T)), 1 - min(1, t / (0.75 T))),
+# created for every agent since schedules cache their values
+EPSILON_SCHEDULE_SPEC = {
+    "type": "piecewise",
+    "points": [(0.0, 0.7), (0.35, 0.035), (0.72375, 0.035), (0.75, 0.0), (1.0, 0.0)],
+}
+
 
 class Agent(ABC):
     """Base class for Q-Learning agent
@@ -17,6 +28,10 @@ class Agent(ABC):
         obs_space: Space,
         gamma: float,
         epsilon: float,
+        paging: Optional[Dict] = None,
+        rng: Optional[RandomStream] = None,
+        epsilon_schedule: Union[Schedule, Dict, None] = None,
+        q_table: Union[np.ndarray, PagedQTable, None] = None,
         **kwargs
     ):
         """Constructor of base agent for Q-Learning
@@ -26,19 +41,36 @@ class Agent(ABC):
         :param obs_space (int): observation space of the environment
         :param gamma (float): discount factor (gamma)
         :param epsilon (float): epsilon for epsilon-greedy action selection
+        :param paging (Dict, optional): keyword arguments of PagedQTable to store Q-values in pages
+            allocated on first touch (dense table if None)
+        :param rng (RandomStream, optional): stream of random numbers for action selection
+            (shared default stream if None)
+        :param epsilon_schedule (Union[Schedule, Dict], optional): schedule (or its configuration)
+            of epsilon over training (EPSILON_SCHEDULE_SPEC if None)
+        :param q_table (Union[np.ndarray, PagedQTable], optional): existing table for Q-values to
+            act with, e.g. the table of a trained agent for evaluation (zero-initialised if None)
         :attr n_acts (int): number of actions
-        :attr q_table (DefaultDict): table for Q-values mapping (OBS, ACT) pairs of observations
-            and actions to respective Q-values
+        :attr obs_encoder (ObservationEncoder): encoder mapping observations to dense state indices
+        :attr q_table (Union[np.ndarray, PagedQTable]): table for Q-values indexed by [STATE, ACT]
+            pairs of encoded observations and actions
         """
 
         self.action_space = action_space
         self.obs_space = obs_space
         self.n_acts = flatdim(action_space)
+        self.obs_encoder = ObservationEncoder(obs_space)
 
         self.epsilon: float = epsilon
         self.gamma: float = gamma
+        self.rng = rng if rng is not None else default_stream()
+        self.epsilon_schedule = make_schedule(
+            EPSILON_SCHEDULE_SPEC if epsilon_schedule is None else epsilon_schedule
+        )
 
-        self.q_table: DefaultDict = defaultdict(lambda: 0)
+        self.paging = paging
+        if q_table is None:
+            q_table = make_table(self.obs_encoder.n, self.n_acts, paging=paging)
+        self.q_table: Union[np.ndarray, PagedQTable] = q_table
 
     def act(self, obs: int) -> int:
         """Implement the epsilon-greedy action selection here
@@ -47,18 +79,13 @@ class Agent(ABC):
         :return (int): index of selected action
         """
         ### PUT YOUR CODE HERE ###
-        act_vals = []
-        for action in range(self.n_acts):
-            act_vals.append(self.q_table[obs, action])
-        max_val = max(act_vals)
-        max_acts = []
-        for idx, act_val in enumerate(act_vals):
-            if act_val == max_val:
-                max_acts = max_acts.append(idx)
-        if random.random() < self.epsilon:
-            return random.randint(0, self.n_acts - 1)
-
-        return random.choice(max_acts)
+        if self.rng.uniform() < self.epsilon:
+            return self.rng.integer(self.n_acts)
+
+        # copied, since other processes may update a shared table between the comparisons
+        act_vals = self.q_table[self.obs_encoder.encode(obs)].copy()
+        max_acts = np.flatnonzero(act_vals == act_vals.max())
+        return int(self.rng.choice(max_acts))
 
     @abstractmethod
     def schedule_hyperparameters(self, timestep: int, max_timestep: int):
@@ -103,13 +130,14 @@ class QLearningAgent(Agent):
         :param done (bool): flag indicating whether a terminal state has been reached
         :return (float): updated Q-value for current observation-action pair
         """
-        q_old = self.q_table[obs, action]
+        state = self.obs_encoder.encode(obs)
+        q_old = self.q_table[state, action]
         if not done:
-            q_next = max([self.q_table[n_obs, a] for a in range(self.n_acts)])
+            q_next = self.q_table[self.obs_encoder.encode(n_obs)].max()
         else:
             q_next = 0
-        self.q_table[obs, action] = q_old + self.alpha * (reward + self.gamma * q_next - q_old)
-        return self.q_table[(obs, action)]
+        self.q_table[state, action] = q_old + self.alpha * (reward + self.gamma * q_next - q_old)
+        return self.q_table[state, action]
 
     def schedule_hyperparameters(self, timestep: int, max_timestep: int):
         """Updates the hyperparameters
@@ -119,9 +147,7 @@ class QLearningAgent(Agent):
         :param timestep (int): current timestep at the beginning of the episode
         :param max_timestep (int): maximum timesteps that the training loop will run for
         """
-        max_deduct, decay = 0.95, 0.5
-        self.epsilon = 0.7 - (min(0.7, timestep / (decay * max_timestep))) * max_deduct
-        self.epsilon = min(self.epsilon, 1 - min(1, timestep/(0.75*max_timestep)))
+        self.epsilon = self.epsilon_schedule(timestep, max_timestep)
 
 class MonteCarloAgent(Agent):
     """
@@ -132,11 +158,27 @@ class MonteCarloAgent(Agent):
     def __init__(self, **kwargs):
         """Constructor of MonteCarloAgent
         Initializes some variables of the Monte-Carlo agent, namely epsilon,
-        discount rate and an empty observation-action pair dictionary.
-        :attr sa_counts (Dict[(Obs, Act), int]): dictionary to count occurrences observation-action pairs
+        discount rate and an empty table of state-action pair counts.
+        :attr sa_counts (Union[np.ndarray, PagedQTable]): table counting occurrences of [STATE, ACT]
+            pairs
         """
         super().__init__(**kwargs)
-        self.sa_counts = {}
+        self.sa_counts = make_table(
+            self.obs_encoder.n, self.n_acts, dtype=np.int64, paging=self.paging
+        )
+
+    def _obs_key(self, obs, state: int):
+        """Gives the observation itself if it is hashable and its component values otherwise
+
+        :param obs: observation from the observation space
+        :param state (int): encoded observation
+        :return: hashable key of the observation
+        """
+        try:
+            hash(obs)
+        except TypeError:
+            return self.obs_encoder.decode(state)
+        return obs
 
     def learn(
         self, obses: List[int], actions: List[int], rewards: List[float]
@@ -150,23 +192,24 @@ class MonteCarloAgent(Agent):
         :param rewards (List[float]): list of received rewards during trajectory (in the order
             they were received)
         :return (Dict): A dictionary containing the updated Q-value of all the updated state-action pairs
-            indexed by the state action pair.
+            indexed by the state action pair (observations which are not hashable, e.g. of
+            MultiDiscrete or Dict spaces, are given as the tuple of their component values).
         """
         updated_values = {}
-        state_actions = list(zip(obses, actions))
+        state_actions = [(self.obs_encoder.encode(obs), act) for obs, act in zip(obses, actions)]
+        first_visits = {}
+        for t, pair in enumerate(state_actions):
+            first_visits.setdefault(pair, t)
         G = 0 
         states = len(obses) - 1
         for t in range(states, -1, -1): 
             G = self.gamma * G + rewards[t] 
             pair = state_actions[t] 
             
-            if pair in self.sa_counts:
-                self.sa_counts[pair] += 1
-            else:
-                self.sa_counts[pair] = 1
+            self.sa_counts[pair] += 1
             
-            if pair not in state_actions[:t]:
-                updated_values[pair] = G 
+            if first_visits[pair] == t:
+                updated_values[(self._obs_key(obses[t], pair[0]), pair[1])] = G 
                 self.q_table[pair] = (self.q_table[pair] * (self.sa_counts[pair] - 1) + G)/self.sa_counts[pair]
 
         return updated_values
@@ -179,6 +222,4 @@ class MonteCarloAgent(Agent):
         :param timestep (int): current timestep at the beginning of the episode
         :param max_timestep (int): maximum timesteps that the training loop will run for
         """
-        max_deduct, decay = 0.95, 0.5
-        self.epsilon = 0.7 - (min(0.7, timestep / (decay * max_timestep))) * max_deduct
-        self.epsilon = min(self.epsilon, 1 - min(1, timestep/(0.75*max_timestep)))
\ No newline at end of file
+        self.epsilon = self.epsilon_schedule(timestep, max_timestep)
\ No newline at end of file
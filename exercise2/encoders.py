@@ -0,0 +1,98 @@
+"""
+Encoders mapping discrete observations to dense integer indices
+"""
+import math
+from typing import Callable, List, Tuple
+
+import numpy as np
+from gym.spaces import Dict, Discrete, MultiBinary, MultiDiscrete, Space, Tuple as TupleSpace
+from gym.spaces.utils import flatdim
+
+
+def _leaf_radices(space: Space) -> List[int]:
+    """Collects the number of values of every discrete component of a (composite) space
+
+    :param space (gym.Space): discrete or composite discrete observation space
+    :return (List[int]): number of values of each component in flattening order
+    """
+    if isinstance(space, Discrete):
+        return [space.n]
+    if isinstance(space, MultiDiscrete):
+        return [int(n) for n in np.asarray(space.nvec).flatten()]
+    if isinstance(space, MultiBinary):
+        return [2] * flatdim(space)
+    if isinstance(space, TupleSpace):
+        return [n for s in space.spaces for n in _leaf_radices(s)]
+    if isinstance(space, Dict):
+        return [n for s in space.spaces.values() for n in _leaf_radices(s)]
+    raise ValueError(f"Observation space {space} is not discrete and can not be encoded")
+
+
+def _leaf_flattener(space: Space) -> Callable:
+    """Creates a function flattening observations of a (composite) space into their components
+
+    :param space (gym.Space): discrete or composite discrete observation space
+    :return (Callable): function mapping an observation to a list of component values
+    """
+    if isinstance(space, Discrete):
+        start = getattr(space, "start", 0)
+        return lambda obs: [int(obs) - start]
+    if isinstance(space, (MultiDiscrete, MultiBinary)):
+        return lambda obs: np.asarray(obs).flatten().tolist()
+    if isinstance(space, TupleSpace):
+        if all(isinstance(s, Discrete) and getattr(s, "start", 0) == 0 for s in space.spaces):
+            return list
+        flatteners = [_leaf_flattener(s) for s in space.spaces]
+        return lambda obs: [v for f, o in zip(flatteners, obs) for v in f(o)]
+    if isinstance(space, Dict):
+        keys = list(space.spaces.keys())
+        flatteners = [_leaf_flattener(space.spaces[k]) for k in keys]
+        return lambda obs: [v for f, k in zip(flatteners, keys) for v in f(obs[k])]
+    raise ValueError(f"Observation space {space} is not discrete and can not be encoded")
+
+
+class ObservationEncoder:
+    """Maps observations of discrete (composite) spaces to dense integer indices
+
+    Composite observations (Tuple, Dict, MultiDiscrete or MultiBinary spaces of discrete
+    components) are encoded with mixed-radix arithmetic, so every observation of the space maps to
+    a unique index in [0, n).
+
+    :attr n (int): number of distinct observations (size of the index range)
+    :attr radices (Tuple[int]): number of values of each discrete component
+    """
+
+    def __init__(self, obs_space: Space):
+        """Constructor of ObservationEncoder
+
+        :param obs_space (gym.Space): discrete or composite discrete observation space
+        """
+        self.radices: Tuple[int] = tuple(_leaf_radices(obs_space))
+        # Python ints, since the number of observations of composite spaces can exceed int64
+        self.n = math.prod(self.radices)
+
+        strides = [1] * len(self.radices)
+        for i in range(len(self.radices) - 2, -1, -1):
+            strides[i] = strides[i + 1] * self.radices[i + 1]
+        self._strides = tuple(strides)
+
+        if isinstance(obs_space, Discrete) and getattr(obs_space, "start", 0) == 0:
+            self.encode = int
+        else:
+            self._flatten = _leaf_flattener(obs_space)
+
+    def encode(self, obs) -> int:
+        """Encodes an observation as a dense integer index
+
+        :param obs: observation from the observation space
+        :return (int): index of the observation in [0, n)
+        """
+        return sum(int(v) * s for v, s in zip(self._flatten(obs), self._strides))
+
+    def decode(self, index: int) -> Tuple[int]:
+        """Decodes an index into the values of the discrete components of the observation
+
+        :param index (int): index of an observation in [0, n)
+        :return (Tuple[int]): value of each discrete component in flattening order
+        """
+        return tuple((index // s) % n for s, n in zip(self._strides, self.radices))
@@ -0,0 +1,212 @@
+"""
+Q-table storage for tabular agents
+"""
+from collections import OrderedDict
+from multiprocessing import shared_memory
+import os
+import tempfile
+from typing import Dict, Optional, Union
+import weakref
+
+import numpy as np
+
+# largest dense table make_table allocates, larger tables have to be paged
+MAX_DENSE_BYTES = 2**32
+
+
+class SharedQTable:
+    """Dense Q-table held in a shared memory block so that several processes can update it
+
+    Workers attach to the block by its name and write to it without any locking (Hogwild-style).
+    Tabular Q-learning tolerates the occasional lost update caused by such races.
+
+    :attr n_states (int): number of (discrete) states
+    :attr n_acts (int): number of actions
+    :attr name (str): name of the shared memory block used to attach from other processes
+    :attr table (np.ndarray): array of shape (n_states, n_acts) backed by the shared memory block
+    """
+
+    def __init__(self, n_states: int, n_acts: int, name: Optional[str] = None):
+        """Constructor of SharedQTable creating a new zero-initialised table or attaching to an
+        existing one
+
+        :param n_states (int): number of (discrete) states
+        :param n_acts (int): number of actions
+        :param name (str, optional): name of an existing block to attach to (creates a new block
+            if None)
+        """
+        self.n_states = n_states
+        self.n_acts = n_acts
+        self._owner = name is None
+
+        size = n_states * n_acts * np.dtype(np.float64).itemsize
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size)
+        self.name = self._shm.name
+        self.table = np.ndarray((n_states, n_acts), dtype=np.float64, buffer=self._shm.buf)
+        if self._owner:
+            self.table[:] = 0.0
+
+    def close(self):
+        """Detaches this process from the shared memory block (and frees it if it was created
+        by this process)
+        """
+        self.table = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class PagedQTable:
+    """Q-table for large discrete state spaces which allocates fixed-size pages of states on first
+    write
+
+    Pages are NumPy arrays of shape (page_size, n_acts). Reading states of pages which were never
+    written returns zeros without allocating. Optionally, at most `max_resident_pages` pages are
+    kept in memory and the least recently used pages are spilled to a memory-mapped file on disk,
+    which is created when the first page is spilled.
+
+    The table is indexed like a dense array of shape (n_states, n_acts): `table[state, action]`
+    gives a single Q-value and `table[state]` all Q-values of a state.
+
+    :attr shape (Tuple[int, int]): (number of states, number of actions)
+    :attr page_size (int): number of states per page
+    :attr max_resident_pages (int): maximum number of pages kept in memory (None for no limit)
+    """
+
+    def __init__(
+        self,
+        n_states: int,
+        n_acts: int,
+        page_size: int = 4096,
+        dtype: np.dtype = np.float64,
+        max_resident_pages: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+    ):
+        """Constructor of PagedQTable
+
+        :param n_states (int): number of (discrete) states
+        :param n_acts (int): number of actions
+        :param page_size (int): number of states per page
+        :param dtype (np.dtype): dtype of stored values
+        :param max_resident_pages (int, optional): maximum number of pages kept in memory before
+            least recently used pages are spilled to disk (at least 1, no limit if None)
+        :param spill_dir (str, optional): directory to create the spill file in (system default
+            temporary directory if None)
+        """
+        if max_resident_pages is not None and max_resident_pages < 1:
+            raise ValueError(
+                f"At least one page has to be kept in memory, got max_resident_pages="
+                f"{max_resident_pages}"
+            )
+        self.shape = (n_states, n_acts)
+        self.dtype = np.dtype(dtype)
+        self.page_size = page_size
+        self.max_resident_pages = max_resident_pages
+        self.n_pages = -(-n_states // page_size)
+
+        self._pages: Dict[int, np.ndarray] = OrderedDict()
+        self._zeros = np.zeros((page_size, n_acts), dtype=self.dtype)
+        self._zeros.flags.writeable = False
+
+        self.spill_dir = spill_dir
+        self._spill = None
+        if max_resident_pages is not None:
+            self._spilled = np.zeros(self.n_pages, dtype=bool)
+
+    @property
+    def resident_pages(self) -> int:
+        """Number of pages currently held in memory
+        """
+        return len(self._pages)
+
+    def _create_spill(self):
+        """Creates the memory-mapped spill file, which is removed with the table
+        """
+        fd, path = tempfile.mkstemp(suffix=".qpages", dir=self.spill_dir)
+        os.close(fd)
+        self._spill = np.memmap(
+            path, dtype=self.dtype, mode="w+", shape=(self.n_pages * self.page_size, self.shape[1])
+        )
+        self._finalizer = weakref.finalize(self, os.remove, path)
+
+    def _page(self, page_id: int, write: bool) -> np.ndarray:
+        """Gets a page, loading or allocating it if required
+
+        :param page_id (int): index of the page
+        :param write (bool): flag whether the page will be written to
+        :return (np.ndarray): page of shape (page_size, n_acts)
+        """
+        page = self._pages.get(page_id)
+        if page is not None:
+            if self.max_resident_pages is not None:
+                self._pages.move_to_end(page_id)
+            return page
+
+        if self._spill is not None and self._spilled[page_id]:
+            rows = slice(page_id * self.page_size, (page_id + 1) * self.page_size)
+            page = np.array(self._spill[rows])
+        elif write:
+            page = np.zeros_like(self._zeros)
+        else:
+            return self._zeros
+
+        self._pages[page_id] = page
+        if self.max_resident_pages is not None and len(self._pages) > self.max_resident_pages:
+            if self._spill is None:
+                self._create_spill()
+            evicted_id, evicted = self._pages.popitem(last=False)
+            rows = slice(evicted_id * self.page_size, (evicted_id + 1) * self.page_size)
+            self._spill[rows] = evicted
+            self._spilled[evicted_id] = True
+        return page
+
+    def __getitem__(self, index) -> Union[np.ndarray, float]:
+        if isinstance(index, tuple):
+            state, action = index
+        else:
+            state, action = index, slice(None)
+        page = self._page(state // self.page_size, write=False)
+        return page[state % self.page_size, action]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, tuple):
+            state, action = index
+        else:
+            state, action = index, slice(None)
+        page = self._page(state // self.page_size, write=True)
+        page[state % self.page_size, action] = value
+
+    def to_dense(self) -> np.ndarray:
+        """Gathers all pages into a dense array
+
+        :return (np.ndarray): dense table of shape (n_states, n_acts)
+        """
+        table = np.zeros((self.n_pages * self.page_size, self.shape[1]), dtype=self.dtype)
+        if self._spill is not None:
+            table[:] = self._spill
+        for page_id, page in self._pages.items():
+            table[page_id * self.page_size:(page_id + 1) * self.page_size] = page
+        return table[:self.shape[0]]
+
+
+def make_table(
+    n_states: int, n_acts: int, dtype: np.dtype = np.float64, paging: Optional[Dict] = None
+) -> Union[np.ndarray, PagedQTable]:
+    """Creates a zero-initialised table indexed by [STATE, ACT]
+
+    :param n_states (int): number of (discrete) states
+    :param n_acts (int): number of actions
+    :param dtype (np.dtype): dtype of stored values
+    :param paging (Dict, optional): keyword arguments of PagedQTable to create a paged table
+        (dense array if None, which may take at most MAX_DENSE_BYTES)
+    :return (Union[np.ndarray, PagedQTable]): table of shape (n_states, n_acts)
+    """
+    if paging is None:
+        size = n_states * n_acts * np.dtype(dtype).itemsize
+        if size > MAX_DENSE_BYTES:
+            raise ValueError(
+                f"A dense table of {n_states} states and {n_acts} actions takes {size} bytes "
+                f"(more than {MAX_DENSE_BYTES}), configure paging to store it in pages"
+            )
+        return np.zeros((n_states, n_acts), dtype=dtype)
+    return PagedQTable(n_states, n_acts, dtype=dtype, **paging)
@@ -3,12 +3,16 @@ import gym
 from rl2022.constants import EX2_MC_CONSTANTS as CONSTANTS
 from rl2022.exercise2.agents import MonteCarloAgent
 from rl2022.exercise2.utils import evaluate
+from rl2022.profiling import make_profiler
 from tqdm import tqdm
 
 CONFIG = {
     "eval_episodes": 500,
     "eval_freq": 5000,
     "epsilon": 0.0,
+    "paging": None,  # E.G. {"page_size": 4096, "max_resident_pages": 256} FOR LARGE STATE SPACES
+    "epsilon_schedule": None,  # E.G. {"type": "linear", "start": 1.0, "end": 0.05, "duration": 0.1}
+    "profile": None,  # WINDOW OF TIMESTEPS TO PROFILE, E.G. {"start": 10000, "stop": 11000} (SEE profiling.py)
 }
 CONFIG.update(CONSTANTS)
 
@@ -24,7 +28,7 @@ def monte_carlo_eval(
 
     :param env (gym.Env): environment to execute evaluation on
     :param config (Dict[str, float]): configuration dictionary containing hyperparameters
-    :param q_table (Dict[(Obs, Act), float]): Q-table mapping observation-action to Q-values
+    :param q_table (np.ndarray): Q-table mapping encoded observation-action pairs to Q-values
     :param render (bool): flag whether evaluation runs should be rendered
     :return (float, float): mean and standard deviation of returns received over episodes
     """
@@ -33,8 +37,9 @@ def monte_carlo_eval(
         obs_space=env.observation_space,
         gamma=CONFIG["gamma"],
         epsilon=0.0,
+        paging=config["paging"],
+        q_table=q_table,
     )
-    eval_agent.q_table = q_table
     return evaluate(env, eval_agent, config["eval_eps_max_steps"], config["eval_episodes"], render)
 
 
@@ -44,7 +49,7 @@ def train(env, config):
 
     :param env (gym.Env): environment to execute evaluation on
     :param config (Dict[str, float]): configuration dictionary containing hyperparameters
-    :return (float, List[float], List[float], Dict[(Obs, Act), float]):
+    :return (float, List[float], List[float], np.ndarray):
         returns over all episodes, list of means and standard deviations of evaluation
         returns, final Q-table, final state-action counts
     """
@@ -53,10 +58,13 @@ def train(env, config):
         obs_space=env.observation_space,
         gamma=config["gamma"],
         epsilon=config["epsilon"],
+        paging=config["paging"],
+        epsilon_schedule=config["epsilon_schedule"],
     )
 
     step_counter = 0
     max_steps = config["total_eps"] * config["eps_max_steps"]
+    profiler = make_profiler(config["profile"], f"monte_carlo_{config['env']}")
 
     total_reward = 0
     evaluation_return_means = []
@@ -90,6 +98,7 @@ def train(env, config):
 
         agent.learn(obs_list, act_list, rew_list)
         total_reward += episodic_return
+        profiler.step(step_counter)
 
         if eps_num > 0 and eps_num % config["eval_freq"] == 0:
             mean_return, negative_returns = monte_carlo_eval(env, config, agent.q_table)
@@ -97,6 +106,7 @@ def train(env, config):
             evaluation_return_means.append(mean_return)
             evaluation_negative_returns.append(negative_returns)
 
+    profiler.close(step_counter)
     return total_reward, evaluation_return_means, evaluation_negative_returns, agent.q_table
 
 
@@ -1,15 +1,28 @@
+import multiprocessing as mp
+import random
+import time
+
 import gym
+import numpy as np
 from tqdm import tqdm
 
+from rl2022 import rng
 from rl2022.constants import EX2_QL_CONSTANTS as CONSTANTS
 from rl2022.exercise2.agents import QLearningAgent
+from rl2022.exercise2.encoders import ObservationEncoder
+from rl2022.exercise2.tables import SharedQTable
 from rl2022.exercise2.utils import evaluate
+from rl2022.profiling import make_profiler
 
 CONFIG = {
     "eval_episodes": 500,
     "eval_freq": 1000,
     "alpha": 0.5,
     "epsilon": 0.0,
+    "num_workers": 1,  # > 1 TRAINS WITH LOCK-FREE (HOGWILD) WORKER PROCESSES ON A SHARED Q-TABLE
+    "paging": None,  # E.G. {"page_size": 4096, "max_resident_pages": 256} FOR LARGE STATE SPACES
+    "epsilon_schedule": None,  # E.G. {"type": "linear", "start": 1.0, "end": 0.05, "duration": 0.1}
+    "profile": None,  # WINDOW OF TIMESTEPS TO PROFILE, E.G. {"start": 10000, "stop": 11000} (SEE profiling.py)
 }
 CONFIG.update(CONSTANTS)
 
@@ -25,7 +38,7 @@ def q_learning_eval(
 
     :param env (gym.Env): environment to execute evaluation on
     :param config (Dict[str, float]): configuration dictionary containing hyperparameters
-    :param q_table (Dict[(Obs, Act), float]): Q-table mapping observation-action to Q-values
+    :param q_table (np.ndarray): Q-table mapping encoded observation-action pairs to Q-values
     :param render (bool): flag whether evaluation runs should be rendered
     :param output (bool): flag whether mean evaluation performance should be printed
     :return (float, float): mean and standard deviation of returns received over episodes
@@ -36,8 +49,9 @@ def q_learning_eval(
         gamma=config["gamma"],
         alpha=config["alpha"],
         epsilon=0.0,
+        paging=config["paging"],
+        q_table=q_table,
     )
-    eval_agent.q_table = q_table
     return evaluate(env, eval_agent, config["eval_eps_max_steps"], config["eval_episodes"], render)
 
 
@@ -48,7 +62,7 @@ def train(env, config, output=True):
     :param env (gym.Env): environment to execute evaluation on
     :param config (Dict[str, float]): configuration dictionary containing hyperparameters
     :param output (bool): flag if mean evaluation results should be printed
-    :return (float, List[float], List[float], Dict[(Obs, Act), float]):
+    :return (float, List[float], List[float], np.ndarray):
         total reward over all episodes, list of means and standard deviations of evaluation
         returns, final Q-table
     """
@@ -58,10 +72,13 @@ def train(env, config, output=True):
         gamma=config["gamma"],
         alpha=config["alpha"],
         epsilon=config["epsilon"],
+        paging=config["paging"],
+        epsilon_schedule=config["epsilon_schedule"],
     )
 
     step_counter = 0
     max_steps = config["total_eps"] * config["eps_max_steps"]
+    profiler = make_profiler(config["profile"], f"q_learning_{config['env']}")
 
     total_reward = 0
     evaluation_return_means = []
@@ -88,6 +105,7 @@ def train(env, config, output=True):
             obs = n_obs
 
         total_reward += episodic_return
+        profiler.step(step_counter)
 
         if eps_num > 0 and eps_num % config["eval_freq"] == 0:
             mean_return, negative_returns = q_learning_eval(env, config, agent.q_table)
@@ -95,12 +113,165 @@ def train(env, config, output=True):
             evaluation_return_means.append(mean_return)
             evaluation_negative_returns.append(negative_returns)
 
+    profiler.close(step_counter)
     return total_reward, evaluation_return_means, evaluation_negative_returns, agent.q_table
 
 
+def _hogwild_worker(config, seed, num_eps, table_name, n_states, n_acts, step_counter, eps_counter,
+                    max_steps, returns):
+    """
+    Runs Q-learning episodes in a worker process, updating the shared Q-table without locks
+
+    :param config (Dict[str, float]): configuration dictionary containing hyperparameters
+    :param seed (int): seed of the worker's environment and random number generators
+    :param num_eps (int): number of episodes to run in this worker
+    :param table_name (str): name of the shared memory block holding the Q-table
+    :param n_states (int): number of states of the environment
+    :param n_acts (int): number of actions of the environment
+    :param step_counter (mp.RawValue): global step counter shared by all workers
+    :param eps_counter (mp.RawValue): global episode counter shared by all workers
+    :param max_steps (int): maximum number of timesteps over all workers (for scheduling)
+    :param returns (mp.Queue): queue to report the total reward of this worker on
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    rng.seed(seed)
+    env = gym.make(config["env"])
+    env.seed(seed)
+
+    shared = SharedQTable(n_states, n_acts, name=table_name)
+    agent = QLearningAgent(
+        action_space=env.action_space,
+        obs_space=env.observation_space,
+        gamma=config["gamma"],
+        alpha=config["alpha"],
+        epsilon=config["epsilon"],
+        epsilon_schedule=config["epsilon_schedule"],
+        q_table=shared.table,
+    )
+
+    total_reward = 0
+    for _ in range(num_eps):
+        obs = env.reset()
+        t = 0
+
+        while t < config["eps_max_steps"]:
+            # the global counter is incremented without a lock, so a few increments may get lost
+            agent.schedule_hyperparameters(step_counter.value, max_steps)
+            act = agent.act(obs)
+            n_obs, reward, done, _ = env.step(act)
+            agent.learn(obs, act, reward, n_obs, done)
+
+            t += 1
+            step_counter.value += 1
+            total_reward += reward
+
+            if done:
+                break
+
+            obs = n_obs
+
+        eps_counter.value += 1
+
+    returns.put(total_reward)
+    shared.close()
+    env.close()
+
+
+def _check_workers(workers, shared):
+    """
+    Stops all workers and raises if one of them failed
+
+    :param workers (List[mp.Process]): hogwild worker processes
+    :param shared (SharedQTable): Q-table shared by the workers (released if a worker failed)
+    """
+    for i, worker in enumerate(workers):
+        if worker.exitcode not in (None, 0):
+            for other in workers:
+                other.terminate()
+            shared.close()
+            raise RuntimeError(f"Hogwild worker {i} failed with exit code {worker.exitcode}")
+
+
+def train_hogwild(env, config, output=True):
+    """
+    Train and evaluate Q-Learning with several worker processes sharing one Q-table
+
+    Each worker runs its own environment and applies Q-learning updates to the shared table
+    without locks. The epsilon schedule of all workers follows a shared global step counter.
+    Evaluation runs in this process on a snapshot of the table whenever the workers completed
+    another `eval_freq` episodes.
+
+    :param env (gym.Env): environment to execute evaluation on
+    :param config (Dict[str, float]): configuration dictionary containing hyperparameters
+    :param output (bool): flag if mean evaluation results should be printed
+    :return (float, List[float], List[float], np.ndarray):
+        total reward over all episodes, list of means and standard deviations of evaluation
+        returns, final Q-table
+    """
+    if config["paging"]:
+        raise ValueError("Hogwild training shares a dense Q-table and does not support paging")
+    num_workers = config["num_workers"]
+    n_states = ObservationEncoder(env.observation_space).n
+    n_acts = env.action_space.n
+    max_steps = config["total_eps"] * config["eps_max_steps"]
+
+    shared = SharedQTable(n_states, n_acts)
+    step_counter = mp.RawValue("q", 0)
+    eps_counter = mp.RawValue("q", 0)
+    returns = mp.Queue()
+
+    eps_per_worker = [config["total_eps"] // num_workers] * num_workers
+    for i in range(config["total_eps"] % num_workers):
+        eps_per_worker[i] += 1
+
+    workers = [
+        mp.Process(
+            target=_hogwild_worker,
+            args=(config, i, eps_per_worker[i], shared.name, n_states, n_acts, step_counter,
+                  eps_counter, max_steps, returns),
+            daemon=True,
+        )
+        for i in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    evaluation_return_means = []
+    evaluation_negative_returns = []
+    next_eval = config["eval_freq"]
+
+    with tqdm(total=config["total_eps"]) as pbar:
+        while any(worker.is_alive() for worker in workers) or next_eval <= eps_counter.value:
+            _check_workers(workers, shared)
+            eps_num = eps_counter.value
+            pbar.update(eps_num - pbar.n)
+            if next_eval <= eps_num:
+                mean_return, negative_returns = q_learning_eval(env, config, shared.table.copy())
+                tqdm.write(f"EVALUATION: EP {next_eval} - MEAN RETURN {mean_return}")
+                evaluation_return_means.append(mean_return)
+                evaluation_negative_returns.append(negative_returns)
+                next_eval += config["eval_freq"]
+            else:
+                time.sleep(0.05)
+
+    # all workers exited successfully, so each of them reported its total reward
+    _check_workers(workers, shared)
+    total_reward = sum(returns.get(timeout=60) for _ in workers)
+    for worker in workers:
+        worker.join()
+
+    q_table = shared.table.copy()
+    shared.close()
+    return total_reward, evaluation_return_means, evaluation_negative_returns, q_table
+
+
 if __name__ == "__main__":
     env = gym.make(CONFIG["env"])
-    total_reward, _, _, q_table = train(env, CONFIG)
+    if CONFIG["num_workers"] > 1:
+        total_reward, _, _, q_table = train_hogwild(env, CONFIG)
+    else:
+        total_reward, _, _, q_table = train(env, CONFIG)
     # print()
     # print(f"Total reward over training: {total_reward}\n")
     # print("Q-table:")
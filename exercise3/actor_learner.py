@@ -0,0 +1,309 @@
+"""
+Asynchronous actor-learner training of off-policy agents (DQN and DDPG)
+
+Actors collect experience with their own copy of the network the agent acts with, which they
+refresh whenever the learner publishes new parameters through SharedWeights, and push it to a
+SharedReplayBuffer the learner samples from.
+"""
+import multiprocessing as mp
+import random
+import time
+from typing import List, Optional, Tuple
+
+import gym
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from rl2022 import rng
+from rl2022.exercise3.checkpoint import make_checkpointer
+from rl2022.exercise3.evaluator import make_evaluator
+from rl2022.exercise3.export import export_policy
+from rl2022.exercise3.networks import SharedWeights
+from rl2022.exercise3.off_policy import evaluate, record_evaluations, update_agent
+from rl2022.exercise3.replay import PrefetchSampler, SharedReplayBuffer, Transition
+from rl2022.profiling import make_profiler
+from rl2022.telemetry import make_telemetry
+
+
+def run_actor(
+    agent_cls, network_attr, config, seed, weights_name, buffer_handle, learner_updates, stop
+):
+    """
+    Collects episodes in an actor process until the learner stops training
+
+    :param agent_cls (type): agent class to act with (created from the environment's spaces and
+        the configuration)
+    :param network_attr (str): name of the agent's network used by act() to which the published
+        parameters are loaded
+    :param config: configuration dictionary mapping configuration keys to values
+    :param seed (int): seed of the actor's environment and random number generators
+    :param weights_name (str): name of the shared memory block of the published parameters
+    :param buffer_handle (Dict): handle of the shared replay buffer (see SharedReplayBuffer)
+    :param learner_updates (mp.RawValue): number of updates performed by the learner
+    :param stop (mp.Event): event set by the learner to stop all actors
+    """
+    # one thread per process, since actors only run small forward passes
+    torch.set_num_threads(1)
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    rng.seed(seed)
+    env = gym.make(config["env"])
+    env.seed(seed)
+
+    agent = agent_cls(
+        action_space=env.action_space, observation_space=env.observation_space, **config
+    )
+    network = getattr(agent, network_attr)
+    weights = SharedWeights(network, name=weights_name)
+    replay_buffer = SharedReplayBuffer(**buffer_handle)
+    version = weights.load(network)
+
+    while not stop.is_set() and replay_buffer.writes < config["max_timesteps"]:
+        agent.schedule_hyperparameters(replay_buffer.writes, config["max_timesteps"])
+        obs = env.reset()
+        for _ in range(config["episode_length"]):
+            # collection may only run ahead of the learner by a bounded number of transitions
+            while (
+                replay_buffer.writes - learner_updates.value > config["max_actor_lead"]
+                and not stop.is_set()
+            ):
+                time.sleep(0.0005)
+            version = weights.load(network, version)
+            action = agent.act(obs, explore=True)
+            nobs, reward, done, _ = env.step(action)
+            replay_buffer.push(
+                np.array(obs, dtype=np.float32),
+                np.array(action, dtype=np.float32).reshape(-1),
+                np.array(nobs, dtype=np.float32),
+                np.array([reward], dtype=np.float32),
+                np.array([done], dtype=np.float32),
+            )
+            if done or stop.is_set():
+                break
+            obs = nobs
+
+    replay_buffer.close()
+    weights.close()
+    env.close()
+
+
+def make_shared_replay_buffer(env: gym.Env, config) -> SharedReplayBuffer:
+    """Creates the shared replay buffer of an actor-learner training run
+
+    :param env (gym.Env): environment to take the dimensionalities of transitions from
+    :param config: configuration dictionary mapping configuration keys to values
+    :return (SharedReplayBuffer): created (empty) replay buffer
+    """
+    if config["prioritized_replay"] or config["dedup_observations"] or config["buffer_dir"]:
+        raise ValueError(
+            "Actor-learner training only supports uniform replay buffers held in memory"
+        )
+    obs = np.zeros(env.observation_space.shape[0], dtype=np.float32)
+    if isinstance(env.action_space, gym.spaces.Discrete):
+        action = np.zeros(1, dtype=np.float32)
+    else:
+        action = np.zeros(env.action_space.shape[0], dtype=np.float32)
+    scalar = np.zeros(1, dtype=np.float32)
+    transition = Transition(obs, action, obs, scalar, scalar)
+    return SharedReplayBuffer(
+        config["buffer_capacity"], transition, dtypes=config["buffer_dtypes"]
+    )
+
+
+def start_actors(
+    agent_cls,
+    network_attr,
+    config,
+    weights: SharedWeights,
+    replay_buffer: SharedReplayBuffer,
+    learner_updates,
+) -> Tuple[List[mp.Process], mp.Event]:
+    """Starts config["num_actors"] actor processes
+
+    :param agent_cls (type): agent class to act with
+    :param network_attr (str): name of the agent's network used by act()
+    :param config: configuration dictionary mapping configuration keys to values
+    :param weights (SharedWeights): parameters published by the learner
+    :param replay_buffer (SharedReplayBuffer): buffer the actors push to
+    :param learner_updates (mp.RawValue): number of updates performed by the learner (actors
+        pause while they are more than config["max_actor_lead"] transitions ahead of it)
+    :return (Tuple[List[mp.Process], mp.Event]): started actor processes and the event stopping
+        them (see stop_actors)
+    """
+    if config["max_actor_lead"] < config["batch_size"]:
+        raise ValueError("Actors have to be allowed to collect at least one batch ahead")
+    stop = mp.Event()
+    actors = [
+        mp.Process(
+            target=run_actor,
+            args=(agent_cls, network_attr, config, i, weights.name, replay_buffer.handle,
+                  learner_updates, stop),
+            daemon=True,
+        )
+        for i in range(config["num_actors"])
+    ]
+    for actor in actors:
+        actor.start()
+    return actors, stop
+
+
+def stop_actors(actors: List[mp.Process], stop: mp.Event):
+    """Stops actor processes and waits for them to finish
+
+    :param actors (List[mp.Process]): actor processes
+    :param stop (mp.Event): event stopping the actors
+    """
+    stop.set()
+    for actor in actors:
+        actor.join()
+
+
+def train_actor_learner(
+    env: gym.Env,
+    config,
+    agent_cls,
+    network_attr: str,
+    target_return: Optional[float] = None,
+    output: bool = True,
+) -> Tuple[np.ndarray, np.ndarray, List[float]]:
+    """
+    Execute training with asynchronous actor processes and a learner in this process
+
+    config["num_actors"] actor processes collect experience with their own copy of the network
+    the agent acts with and push it to a replay buffer in shared memory. This process samples from
+    the buffer and updates the agent, publishing the network to the actors every
+    config["weight_publish_freq"] updates. The learner performs at most one update per collected
+    transition, as in synchronous training, and actors pause while they are more than
+    config["max_actor_lead"] transitions ahead of it. If an actor fails, training stops and
+    raises a RuntimeError.
+
+    :param env (gym.Env): environment to evaluate on
+    :param config: configuration dictionary mapping configuration keys to values
+    :param agent_cls (type): agent class to train (DQN or DDPG)
+    :param network_attr (str): name of the agent's network used by act(), which is published to
+        the actors and evaluated
+    :param target_return (float, optional): mean evaluation return at which training stops
+    :param output (bool): flag whether evaluation results should be printed
+    :return (Tuple[np.ndarray, np.ndarray, List[float]]): eval returns during training, times of
+        evaluation and losses of all updates
+    """
+    agent = agent_cls(
+        action_space=env.action_space, observation_space=env.observation_space, **config
+    )
+    network = getattr(agent, network_attr)
+    replay_buffer = make_shared_replay_buffer(env, config)
+    weights = SharedWeights(network)
+    weights.publish(network)
+    sampler = None
+    if config["prefetch_batches"]:
+        sampler = PrefetchSampler(
+            replay_buffer,
+            config["batch_size"],
+            prefetch=config["prefetch_batches"],
+            max_staleness=config["prefetch_staleness"],
+        )
+    learner_updates = mp.RawValue("q", 0)
+    actors, stop = start_actors(
+        agent_cls, network_attr, config, weights, replay_buffer, learner_updates
+    )
+
+    checkpointer = make_checkpointer(config)
+    telemetry = make_telemetry(config)
+    profiler = make_profiler(
+        config["profile"], f"{agent_cls.__name__.lower()}_async_{config['env']}"
+    )
+    evaluator = make_evaluator(agent_cls, network_attr, evaluate, config)
+    eval_returns_all = []
+    eval_times_all = []
+    next_eval = config["eval_freq"]
+    next_checkpoint = config["checkpoint_freq"]
+    telemetry_timesteps = 0
+
+    start_time = time.time()
+    losses_all = []
+    updates = 0
+    timesteps_elapsed = replay_buffer.writes
+    failed = []
+    with tqdm(total=config["max_timesteps"]) as pbar:
+        while any(actor.is_alive() for actor in actors):
+            failed = [i for i, actor in enumerate(actors) if actor.exitcode not in (None, 0)]
+            if failed:
+                break
+            timesteps_elapsed = replay_buffer.writes
+            telemetry.step(timesteps_elapsed, timesteps_elapsed - telemetry_timesteps)
+            profiler.step(timesteps_elapsed)
+            telemetry_timesteps = timesteps_elapsed
+            pbar.update(min(timesteps_elapsed, config["max_timesteps"]) - pbar.n)
+            elapsed_seconds = time.time() - start_time
+            if elapsed_seconds > config["max_time"]:
+                pbar.write(f"Training ended after {elapsed_seconds}s.")
+                break
+
+            if checkpointer is not None and timesteps_elapsed >= next_checkpoint:
+                checkpointer.save(agent, timesteps_elapsed)
+                next_checkpoint += config["checkpoint_freq"]
+
+            eval_results = evaluator.poll() if evaluator is not None else []
+            if timesteps_elapsed >= next_eval:
+                if evaluator is not None:
+                    evaluator.submit(timesteps_elapsed, agent)
+                else:
+                    eval_returns = evaluate(env, agent, replay_buffer, config)
+                    eval_results.append((timesteps_elapsed, eval_returns, time.time()))
+                next_eval += config["eval_freq"]
+            elif len(replay_buffer) < config["batch_size"] or updates >= timesteps_elapsed:
+                # wait for the actors to collect more experience
+                t = telemetry.now()
+                time.sleep(0.001)
+                telemetry.lap("wait", t)
+            else:
+                info, = update_agent(
+                    agent, replay_buffer, config["batch_size"], sampler, telemetry=telemetry
+                )
+                losses_all.append(info["q_loss"])
+                updates += 1
+                learner_updates.value = updates
+                if updates % config["weight_publish_freq"] == 0:
+                    weights.publish(network)
+            record_evaluations(
+                eval_results, eval_returns_all, eval_times_all, start_time, pbar, output
+            )
+            if target_return is not None:
+                # results of asynchronous evaluations stop training whenever they arrive
+                reached = [r for _, r, _ in eval_results if r >= target_return]
+                if reached:
+                    pbar.write(
+                        f"Reached return {reached[0]} >= target return of {target_return}"
+                    )
+                    break
+
+    stop_actors(actors, stop)
+    # actors may also fail after the last check, e.g. while the learner waited for them
+    failed = failed or [i for i, actor in enumerate(actors) if actor.exitcode != 0]
+    if sampler is not None:
+        sampler.close()
+    replay_buffer.close()
+    weights.close()
+
+    if evaluator is not None:
+        record_evaluations(
+            evaluator.close(), eval_returns_all, eval_times_all, start_time, pbar, output
+        )
+
+    if checkpointer is not None:
+        checkpointer.close()
+    telemetry.close(timesteps_elapsed)
+    profiler.close(timesteps_elapsed)
+
+    if failed:
+        raise RuntimeError(f"Actor {failed[0]} failed with exit code {actors[failed[0]].exitcode}")
+
+    if config["save_filename"]:
+        print("Saving to: ", agent.save(config["save_filename"]))
+
+    if config["export_filename"]:
+        print("Exporting policy to: ", export_policy(agent, config["export_filename"]))
+
+    return np.array(eval_returns_all), np.array(eval_times_all), losses_all
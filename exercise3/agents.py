@@ -1,16 +1,20 @@
 from abc import ABC, abstractmethod
 from copy import deepcopy
 import gym
+import inspect
 import numpy as np
 import os.path
 from torch import Tensor
 from torch.distributions.categorical import Categorical
 import torch.nn
 from torch.optim import Adam
-from typing import Dict, Iterable, List
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
+from rl2022.exercise3.checkpoint import load_checkpoint, snapshot, write_checkpoint
 from rl2022.exercise3.networks import FCNetwork
 from rl2022.exercise3.replay import Transition
+from rl2022.rng import RandomStream, default_stream
+from rl2022.schedules import Schedule, make_schedule
 
 
 class Agent(ABC):
@@ -38,22 +42,29 @@ class Agent(ABC):
         """Saves saveable PyTorch models under given path
         The models will be saved in directory found under given path in file "models_{suffix}.pt"
         where suffix is given by the optional parameter (by default empty string "")
+        The state_dicts of the saveables are written atomically (see exercise3/checkpoint.py).
         :param path (str): path to directory where to save models
         :param suffix (str, optional): suffix given to models file
         :return (str): path to file of saved models file
         """
-        torch.save(self.saveables, path)
-        return path
+        return write_checkpoint(snapshot(self.saveables), path)
 
     def restore(self, save_path: str):
         """Restores PyTorch models from models file given by path
+        Relative paths are resolved against the working directory and, if no such file exists,
+        against the directory of the module defining the agent's class.
         :param save_path (str): path to file containing saved models
         """
-        dirname, _ = os.path.split(os.path.abspath(__file__))
-        save_path = os.path.join(dirname, save_path)
-        checkpoint = torch.load(save_path)
+        if not os.path.isabs(save_path) and not os.path.exists(save_path):
+            dirname, _ = os.path.split(os.path.abspath(inspect.getfile(type(self))))
+            save_path = os.path.join(dirname, save_path)
+        checkpoint = load_checkpoint(save_path)
         for k, v in self.saveables.items():
-            v.load_state_dict(checkpoint[k].state_dict())
+            state = checkpoint[k]
+            if hasattr(state, "state_dict"):
+                # files of previous versions pickled the saveables themselves
+                state = state.state_dict()
+            v.load_state_dict(state)
 
     @abstractmethod
     def act(self, obs: np.ndarray):
@@ -86,8 +97,12 @@ class DQN(Agent):
         networks should be updated)
     :attr batch_size (int): size of sampled batches of experience
     :attr gamma (float): discount rate gamma
+    :attr run_state_attributes (Tuple[str]): attributes changing during training, which are
+        restored when a run is resumed (see exercise3/checkpoint.py)
     """
 
+    run_state_attributes = ("epsilon", "update_counter")
+
     def __init__(
         self,
         action_space: gym.Space,
@@ -97,6 +112,8 @@ class DQN(Agent):
         target_update_freq: int,
         batch_size: int,
         gamma: float,
+        rng: Optional[RandomStream] = None,
+        epsilon_schedule: Union[Schedule, Dict, None] = None,
         **kwargs,
     ):
         """The constructor of the DQN agent class
@@ -109,6 +126,10 @@ class DQN(Agent):
             networks should be updated)
         :param batch_size (int): size of sampled batches of experience
         :param gamma (float): discount rate gamma
+        :param rng (RandomStream, optional): stream of random numbers for epsilon-greedy action
+            selection (shared default stream if None)
+        :param epsilon_schedule (Union[Schedule, Dict], optional): schedule (or its configuration)
+            of epsilon over training (decays epsilon by a constant factor every episode if None)
         """
         super().__init__(action_space, observation_space)
 
@@ -136,6 +157,8 @@ class DQN(Agent):
         self.target_update_freq = target_update_freq
         self.batch_size = batch_size
         self.gamma = gamma
+        self.rng = rng if rng is not None else default_stream()
+        self.epsilon_schedule = make_schedule(epsilon_schedule)
 
         self.epsilon = 1
         # ######################################### #
@@ -155,7 +178,10 @@ class DQN(Agent):
         :param timestep (int): current timestep at the beginning of the episode
         :param max_timestep (int): maximum timesteps that the training loop will run for
         """
-        self.epsilon = self.epsilon / 1.007
+        if self.epsilon_schedule is not None:
+            self.epsilon = self.epsilon_schedule(timestep, max_timestep)
+        else:
+            self.epsilon = self.epsilon / 1.007
 
     def act(self, obs: np.ndarray, explore: bool):
         """Returns an action (should be called at every timestep)
@@ -163,29 +189,50 @@ class DQN(Agent):
         When explore is False you should select the best action possible (greedy). However, during
         exploration, you should be implementing an exploration strategy (like e-greedy). Use
         schedule_hyperparameters() for any hyperparameters that you want to change over time.
-        :param obs (np.ndarray): observation vector from the environment
+        A batch of observations (e.g. of vectorised environments) is answered with a batch of
+        actions computed in a single forward pass, exploring independently for each observation.
+
+        :param obs (np.ndarray): observation vector from the environment (or batch of observation
+            vectors)
         :param explore (bool): flag indicating whether we should explore
-        :return (sample from self.action_space): action the agent should perform
+        :return (sample from self.action_space): action the agent should perform (np.ndarray of
+            actions for a batch of observations)
         """
-        state = torch.from_numpy(np.array([obs])).float()
-        q_state = self.critics_net(state).detach().numpy()
-        if explore:
-            uniform_dist = np.random.uniform(low=0.0,high=1.0,size=1)
-            random_action = np.random.choice(q_state.size)
+        obs = np.asarray(obs)
+        if obs.ndim > len(self.observation_space.shape):
+            return self._act_batch(obs, explore)
 
-            if uniform_dist < self.epsilon:
-                return random_action
-        
-        return np.argmax(q_state)
+        if explore and self.rng.uniform() < self.epsilon:
+            return self.rng.integer(self.action_space.n)
+
+        return int(self.critics_net.predict(obs).argmax())
 
-    def update(self, batch: Transition) -> Dict[str, float]:
+    def _act_batch(self, obs: np.ndarray, explore: bool) -> np.ndarray:
+        """Returns epsilon-greedy actions for a batch of observations
+
+        :param obs (np.ndarray): batch of observation vectors
+        :param explore (bool): flag indicating whether we should explore
+        :return (np.ndarray): action for each observation
+        """
+        actions = self.critics_net.predict(obs).argmax(axis=1)
+        if explore:
+            random = self.rng.uniforms(len(actions)) < self.epsilon
+            n_random = int(random.sum())
+            if n_random:
+                actions[random] = (self.rng.uniforms(n_random) * self.action_space.n).astype(int)
+        return actions
+
+    def update(self, batch: Transition, weights: Optional[Tensor] = None) -> Dict[str, float]:
         """Update function for DQN
         **YOU MUST IMPLEMENT THIS FUNCTION FOR Q3**
         This function is called after storing a transition in the replay buffer. This happens
         every timestep. It should update your network, update the target network at the given
         target update frequency, and return the Q-loss in the form of a dictionary.
         :param batch (Transition): batch vector from replay buffer
-        :return (Dict[str, float]): dictionary mapping from loss names to loss values
+        :param weights (torch.Tensor, optional): importance sampling weights of shape (batch size, 1)
+            for batches of a PrioritizedReplayBuffer
+        :return (Dict[str, float]): dictionary mapping from loss names to loss values, and
+            "td_errors" to the absolute TD errors of the batch (np.ndarray of shape (batch size,))
         """
         ### PUT YOUR CODE HERE ###
 
@@ -200,13 +247,50 @@ class DQN(Agent):
         max_qs = self.critics_target(next_states).max(1)[0].detach().unsqueeze(1)
         y = rewards + (1 - done) * self.gamma * max_qs
         target = self.critics_net(states).gather(dim=1, index=actions.long())
-        q_loss = criterion(y, target)
+        if weights is None:
+            q_loss = criterion(y, target)
+        else:
+            q_loss = (weights * (y - target) ** 2).mean()
         q_loss.backward()
         self.critics_optim.step()
         self.update_counter += 1
         if self.update_counter % self.target_update_freq == 0:
             self.critics_target.hard_update(self.critics_net)
-        return {"q_loss": q_loss.detach().numpy()}
+        td_errors = (y - target).detach().abs().squeeze(1).numpy()
+        return {"q_loss": q_loss.detach().numpy(), "td_errors": td_errors}
+
+def discounted_returns(rewards: np.ndarray, gamma: float, chunk_size: int = 256) -> np.ndarray:
+    """Computes the discounted return of every timestep of an episode
+
+    The returns are computed with a vectorised reverse scan over chunks of timesteps. Within a
+    chunk, G_t = sum_k gamma^(k - t) r_k is obtained from a reversed cumulative sum of the rewards
+    scaled by gamma^k, and the return following the chunk is carried over to the previous one.
+    Chunks are kept short enough for the powers of gamma not to underflow.
+
+    :param rewards (np.ndarray): rewards of the episode (from first to last)
+    :param gamma (float): discount rate gamma
+    :param chunk_size (int): maximum number of timesteps per chunk
+    :return (np.ndarray): discounted return of every timestep (float64)
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    if gamma == 0:
+        return rewards.copy()
+    if gamma < 1:
+        chunk_size = int(min(chunk_size, max(1, -30 / np.log10(gamma))))
+
+    powers = gamma ** np.arange(chunk_size + 1, dtype=np.float64)
+    returns = np.empty_like(rewards)
+    following_return = 0.0
+    for end in range(len(rewards), 0, -chunk_size):
+        start = max(0, end - chunk_size)
+        length = end - start
+        scaled = rewards[start:end] * powers[:length]
+        chunk = np.cumsum(scaled[::-1])[::-1] / powers[:length]
+        chunk += powers[length:0:-1] * following_return
+        returns[start:end] = chunk
+        following_return = chunk[0]
+    return returns
+
 
 class Reinforce(Agent):
     """Reinforce agent
@@ -215,8 +299,15 @@ class Reinforce(Agent):
     :attr policy_optim (torch.optim): PyTorch optimiser for policy network
     :attr learning_rate (float): learning rate for DQN optimisation
     :attr gamma (float): discount rate gamma
+    :attr episodes_per_update (int): number of episodes collected for each gradient step
+    :attr normalize_returns (bool): flag whether returns are normalised over the episodes of
+        each gradient step
+    :attr run_state_attributes (Tuple[str]): attributes changing during training, which are
+        restored when a run is resumed (see exercise3/checkpoint.py)
     """
 
+    run_state_attributes = ("learning_rate", "gamma")
+
     def __init__(
         self,
         action_space: gym.Space,
@@ -224,6 +315,8 @@ class Reinforce(Agent):
         learning_rate: float,
         hidden_size: Iterable[int],
         gamma: float,
+        episodes_per_update: int = 1,
+        normalize_returns: bool = False,
         **kwargs,
     ):
         """
@@ -233,6 +326,9 @@ class Reinforce(Agent):
         :param learning_rate (float): learning rate for DQN optimisation
         :param hidden_size (Iterable[int]): list of hidden dimensionalities for fully connected DQNs
         :param gamma (float): discount rate gamma
+        :param episodes_per_update (int): number of episodes collected for each gradient step
+        :param normalize_returns (bool): flag whether returns are normalised to zero mean and unit
+            variance over the episodes of each gradient step
         """
         super().__init__(action_space, observation_space)
         STATE_SIZE = observation_space.shape[0]
@@ -252,10 +348,13 @@ class Reinforce(Agent):
         # ############################################# #
         self.learning_rate = learning_rate
         self.gamma = gamma
+        self.episodes_per_update = episodes_per_update
+        self.normalize_returns = normalize_returns
 
         # ############################### #
         # WRITE ANY AGENT PARAMETERS HERE #
         # ############################### #
+        self.episodes = []
 
         # ###############################################
         self.saveables.update(
@@ -285,7 +384,7 @@ class Reinforce(Agent):
         :param explore (bool): flag indicating whether we should explore
         :return (sample from self.action_space): action the agent should perform
         """
-        self.action_probs = self.policy.forward(torch.from_numpy(obs).float()).detach().numpy()
+        self.action_probs = self.policy.predict(obs)
         
         if explore:
             action = np.random.choice(np.arange(len(self.action_probs)), p = self.action_probs)
@@ -297,6 +396,8 @@ class Reinforce(Agent):
         ) -> Dict[str, float]:
         """Update function for policy gradients
         **YOU MUST IMPLEMENT THIS FUNCTION FOR Q3**
+        Episodes are collected until `episodes_per_update` episodes are available, which are then
+        used for a single gradient step with one forward pass over all their observations.
         :param rewards (List[float]): rewards of episode (from first to last)
         :param observations (List[np.ndarray]): observations of episode (from first to last)
         :param actions (List[int]): applied actions of episode (from first to last)
@@ -304,16 +405,39 @@ class Reinforce(Agent):
             losses
         """
         ### PUT YOUR CODE HERE ###
-        p_loss = 0.0
+        self.episodes.append((rewards, observations, actions))
+        if len(self.episodes) < self.episodes_per_update:
+            return {}
+        episodes, self.episodes = self.episodes, []
+        return self.update_batch(episodes)
+
+    def update_batch(
+        self, episodes: List[Tuple[List[float], List[np.ndarray], List[int]]]
+        ) -> Dict[str, float]:
+        """Performs a single policy gradient step on a batch of episodes
+
+        :param episodes (List[Tuple[List[float], List[np.ndarray], List[int]]]): rewards,
+            observations and applied actions of each episode (from first to last)
+        :return (Dict[str, float]): dictionary mapping from loss names to loss values
+        """
+        returns, weights = [], []
+        for rewards, _, _ in episodes:
+            T = len(rewards)
+            returns.append(discounted_returns(rewards, self.gamma))
+            # the loss is the mean over episodes of the mean over timesteps of each episode
+            weights.append(np.full(T, 1.0 / (T * len(episodes))))
+        returns = np.concatenate(returns)
+        if self.normalize_returns and len(returns) > 1:
+            returns = (returns - returns.mean()) / (returns.std() + 1e-8)
+
+        observations = np.concatenate([np.asarray(o, dtype=np.float32) for _, o, _ in episodes])
+        actions = np.concatenate([np.asarray(a, dtype=np.int64) for _, _, a in episodes])
+
         self.policy.train()
-        G = 0
-        T = len(actions)
-        for t in range(T-1,-1,-1):
-            G = rewards[t] + self.gamma*G
-            action_probs = self.policy.forward(torch.from_numpy(observations[t]).float())
-            p_loss -= G * torch.log(action_probs[t])
-        
-        p_loss = p_loss / T
+        action_probs = self.policy(torch.from_numpy(observations))
+        log_probs = torch.log(action_probs.gather(1, torch.from_numpy(actions).unsqueeze(1)))
+        scale = torch.from_numpy((returns * np.concatenate(weights)).astype(np.float32))
+        p_loss = -(scale * log_probs.squeeze(1)).sum()
 
         self.policy_optim.zero_grad()
         p_loss.backward()
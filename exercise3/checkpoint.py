@@ -0,0 +1,302 @@
+"""
+Checkpointing of agents during training
+
+Checkpoints hold the state_dicts of the saveables of an agent (networks and optimisers). They are
+snapshotted to CPU memory in the training loop and written to disk on a background thread, so
+that training only pauses for the copy. Files are written under a temporary name and atomically
+renamed, so a crash while writing never leaves a truncated checkpoint behind.
+
+Run states additionally hold everything needed to resume an interrupted training run: the
+attributes of the agent changing during training (its `run_state_attributes`, e.g. epsilon and
+update counters), the replay buffer, the states of all random number generators and the progress
+of the training loop. Configured hyperparameters are not restored, they are taken from the
+configuration of the resumed run.
+"""
+import os
+import queue
+import random
+import re
+import shutil
+import threading
+from typing import Dict, List, Optional
+
+import gym
+import numpy as np
+import torch
+
+from rl2022 import rng
+
+
+def snapshot(saveables: Dict) -> Dict:
+    """Copies the state_dicts of saveables (modules and optimisers) to CPU memory
+
+    :param saveables (Dict): mapping from names to objects with a state_dict() method
+    :return (Dict): mapping from names to copies of their state_dicts
+    """
+    return {name: _copy_to_cpu(obj.state_dict()) for name, obj in saveables.items()}
+
+
+def _copy_to_cpu(state):
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return type(state)((k, _copy_to_cpu(v)) for k, v in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(_copy_to_cpu(v) for v in state)
+    return state
+
+
+def write_checkpoint(state: Dict, path: str) -> str:
+    """Writes a checkpoint atomically
+
+    The checkpoint is written to a temporary file next to the path, flushed to disk and renamed to
+    the path, replacing any previous file.
+
+    :param state (Dict): checkpoint to write (e.g. as returned by snapshot)
+    :param path (str): path of the checkpoint file
+    :return (str): path of the written checkpoint
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_checkpoint(path: str) -> Dict:
+    """Loads a checkpoint to CPU memory
+
+    :param path (str): path of the checkpoint file
+    :return (Dict): mapping from names to state_dicts (or, for files saved before checkpoints
+        held state_dicts, to the saved modules and optimisers)
+    """
+    # files of previous versions pickled the saveables themselves
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+
+class Checkpointer:
+    """Periodic checkpointing of an agent on a background thread with rotation of old files
+
+    Checkpoints are named "{prefix}_{timestep}.pt" and only the keep_last most recent ones are kept.
+
+    :attr directory (str): directory the checkpoints are written to
+    :attr keep_last (int): number of most recent checkpoints to keep (None keeps all)
+    :attr prefix (str): prefix of checkpoint file names
+    """
+
+    def __init__(self, directory: str, keep_last: Optional[int] = 3, prefix: str = "checkpoint"):
+        """
+        :param directory (str): directory to write checkpoints to (created if it does not exist)
+        :param keep_last (int, optional): number of most recent checkpoints to keep
+        :param prefix (str): prefix of checkpoint file names
+        """
+        self.directory = os.path.abspath(directory)
+        self.keep_last = keep_last
+        self.prefix = prefix
+        os.makedirs(self.directory, exist_ok=True)
+        self._pattern = re.compile(rf"^{re.escape(prefix)}_(\d+)\.pt$")
+        # at most one snapshot waits while another one is written
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = None
+
+    def checkpoints(self) -> List[str]:
+        """Returns the paths of all checkpoints in the directory
+
+        :return (List[str]): absolute paths of the checkpoints ordered by timestep
+        """
+        found = []
+        for name in os.listdir(self.directory):
+            match = self._pattern.match(name)
+            if match:
+                found.append((int(match.group(1)), os.path.join(self.directory, name)))
+        return [path for _, path in sorted(found)]
+
+    def latest(self) -> Optional[str]:
+        """Returns the path of the most recent checkpoint
+
+        :return (str, optional): absolute path of the checkpoint (None if there is none yet)
+        """
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def save(self, agent, timestep: int) -> str:
+        """Snapshots the saveables of an agent and writes them in the background
+
+        :param agent (Agent): agent to checkpoint
+        :param timestep (int): timestep of training the checkpoint is named by
+        :return (str): absolute path the checkpoint is going to be written to
+        """
+        self._raise_error()
+        path = os.path.join(self.directory, f"{self.prefix}_{timestep}.pt")
+        state = snapshot(agent.saveables)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
+        self._queue.put((state, path))
+        return path
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                state, path = item
+                write_checkpoint(state, path)
+                self._rotate()
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _rotate(self):
+        if self.keep_last is None:
+            return
+        for path in self.checkpoints()[:-self.keep_last]:
+            os.remove(path)
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing a checkpoint failed") from error
+
+    def wait(self):
+        """Waits until all pending checkpoints are written
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Writes all pending checkpoints and stops the background thread
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+
+def _agent_attributes(agent) -> Dict:
+    """Gives the attributes of an agent which change during training (scheduled hyperparameters
+    and counters), as listed by its `run_state_attributes`
+    """
+    return {
+        name: getattr(agent, name)
+        for name in getattr(agent, "run_state_attributes", ())
+        if hasattr(agent, name)
+    }
+
+
+def save_run_state(directory: str, agent, replay_buffer, env: gym.Env, progress: Dict):
+    """Saves the state of a training run to resume it with load_run_state
+
+    The state is written to a temporary directory which then replaces the directory, so a crash
+    while saving keeps the previous state.
+
+    :param directory (str): directory to save the run state to
+    :param agent (Agent): trained agent
+    :param replay_buffer (ReplayBuffer): replay buffer of the agent (None if it has none)
+    :param env (gym.Env): environment the agent is trained on
+    :param progress (Dict): progress of the training loop (e.g. timesteps elapsed and evaluation
+        returns)
+    """
+    directory = os.path.abspath(directory)
+    tmp_dir = f"{directory}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    agent_rng = getattr(agent, "rng", None)
+    torch.save(
+        {
+            "saveables": snapshot(agent.saveables),
+            "attributes": _agent_attributes(agent),
+            "rng": agent_rng.get_state() if agent_rng is not None else None,
+        },
+        os.path.join(tmp_dir, "agent.pt"),
+    )
+    if replay_buffer is not None:
+        replay_buffer.save_state(os.path.join(tmp_dir, "replay"))
+    torch.save(
+        {
+            "progress": progress,
+            "random": random.getstate(),
+            "numpy": np.random.get_state(),
+            "torch": torch.get_rng_state(),
+            "stream": rng.default_stream().get_state(),
+            "env": env.unwrapped.np_random.bit_generator.state,
+        },
+        os.path.join(tmp_dir, "run.pt"),
+    )
+
+    old_dir = f"{directory}.old"
+    if os.path.exists(directory):
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.replace(directory, old_dir)
+    os.replace(tmp_dir, directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _run_state_dir(directory: str) -> Optional[str]:
+    """Gives the directory holding the latest complete run state saved to a directory
+    """
+    directory = os.path.abspath(directory)
+    # a crash between the renames of save_run_state leaves only the previous state
+    for candidate in (directory, f"{directory}.old"):
+        if os.path.exists(os.path.join(candidate, "run.pt")):
+            return candidate
+    return None
+
+
+def has_run_state(directory: Optional[str]) -> bool:
+    """Checks whether a directory holds a run state saved by save_run_state
+
+    :param directory (str, optional): directory to check
+    :return (bool): flag whether a run state can be loaded from the directory
+    """
+    return bool(directory) and _run_state_dir(directory) is not None
+
+
+def load_run_state(directory: str, agent, replay_buffer, env: gym.Env) -> Dict:
+    """Restores the state of a training run saved by save_run_state
+
+    The arrays of the replay buffer are mapped from their files (see ReplayBuffer.load_state).
+
+    :param directory (str): directory the run state was saved to
+    :param agent (Agent): agent to restore (created with the configuration of the saved run)
+    :param replay_buffer (ReplayBuffer): replay buffer to restore (None if the agent has none)
+    :param env (gym.Env): environment to restore the random number generator of
+    :return (Dict): progress of the training loop given to save_run_state
+    """
+    directory = _run_state_dir(directory)
+    state = torch.load(os.path.join(directory, "agent.pt"), map_location="cpu", weights_only=False)
+    for name, obj in agent.saveables.items():
+        obj.load_state_dict(state["saveables"][name])
+    for name, value in state["attributes"].items():
+        setattr(agent, name, value)
+    if state["rng"] is not None:
+        agent.rng.set_state(state["rng"])
+    if replay_buffer is not None:
+        replay_buffer.load_state(os.path.join(directory, "replay"))
+
+    run = torch.load(os.path.join(directory, "run.pt"), weights_only=False)
+    random.setstate(run["random"])
+    np.random.set_state(run["numpy"])
+    torch.set_rng_state(run["torch"])
+    rng.default_stream().set_state(run["stream"])
+    env.unwrapped.np_random.bit_generator.state = run["env"]
+    return run["progress"]
+
+
+def make_checkpointer(config) -> Optional[Checkpointer]:
+    """Creates the checkpointer of a training run
+
+    :param config: configuration dictionary mapping configuration keys to values
+    :return (Checkpointer, optional): checkpointer writing to config["checkpoint_dir"] (None if
+        checkpointing is disabled)
+    """
+    if not config["checkpoint_dir"]:
+        return None
+    return Checkpointer(config["checkpoint_dir"], keep_last=config["checkpoint_keep"])
@@ -0,0 +1,165 @@
+"""
+Asynchronous evaluation during training
+
+An evaluator process holds its own environment and copy of the agent. The learner submits
+snapshots of the network the agent acts with and keeps training while they are evaluated; the
+results are collected whenever the learner polls for them.
+"""
+import multiprocessing as mp
+import random
+import time
+from typing import Callable, List, Optional, Tuple
+
+import gym
+import numpy as np
+import torch
+
+from rl2022 import rng
+from rl2022.exercise3.checkpoint import snapshot
+
+EvalResult = Tuple[int, float, float]
+
+
+def run_evaluator(agent_cls, network_attr, evaluate_fn, config, seed, conn):
+    """
+    Evaluates submitted snapshots in an evaluator process until it receives None
+
+    For every snapshot (timestep, state_dict) received, the process sends back
+    (timestep, mean return, wallclock time when the evaluation finished).
+
+    :param agent_cls (type): agent class to evaluate (created from the environment's spaces and
+        the configuration)
+    :param network_attr (str): name of the agent's network used by act() to which the snapshots
+        are loaded
+    :param evaluate_fn (Callable): evaluation function of the training script, called as
+        evaluate_fn(env, agent, None, config) and returning the mean return
+    :param config: configuration dictionary mapping configuration keys to values
+    :param seed (int, optional): seed of the evaluation environment and random number generators
+    :param conn (mp.connection.Connection): evaluator's end of the pipe to the learner
+    """
+    torch.set_num_threads(1)
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        rng.seed(seed)
+    env = gym.make(config["env"])
+    env.seed(seed)
+
+    agent = agent_cls(
+        action_space=env.action_space, observation_space=env.observation_space, **config
+    )
+    network = getattr(agent, network_attr)
+
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        timestep, state_dict = request
+        network.load_state_dict(state_dict)
+        mean_return = evaluate_fn(env, agent, None, config)
+        conn.send((timestep, float(mean_return), time.time()))
+
+    conn.close()
+    env.close()
+
+
+class AsyncEvaluator:
+    """Evaluation of snapshots of an agent in a separate process
+
+    Snapshots are evaluated in the order they are submitted, so every submitted evaluation
+    eventually produces a result.
+
+    :attr pending (int): number of submitted snapshots whose results were not collected yet
+    """
+
+    def __init__(
+        self,
+        agent_cls,
+        network_attr: str,
+        evaluate_fn: Callable,
+        config,
+        seed: Optional[int] = None,
+    ):
+        """
+        Starts the evaluator process
+
+        :param agent_cls (type): agent class to evaluate
+        :param network_attr (str): name of the agent's network used by act()
+        :param evaluate_fn (Callable): evaluation function of the training script (see
+            run_evaluator)
+        :param config: configuration dictionary mapping configuration keys to values
+        :param seed (int, optional): seed of the evaluation environment
+        """
+        self.network_attr = network_attr
+        self.pending = 0
+        self._conn, evaluator_conn = mp.Pipe()
+        self._process = mp.Process(
+            target=run_evaluator,
+            args=(agent_cls, network_attr, evaluate_fn, config, seed, evaluator_conn),
+            daemon=True,
+        )
+        self._process.start()
+        evaluator_conn.close()
+
+    def submit(self, timestep: int, agent):
+        """Submits a snapshot of the agent's network for evaluation
+
+        :param timestep (int): timestep of training the snapshot is taken at
+        :param agent (Agent): agent to snapshot
+        """
+        network = getattr(agent, self.network_attr)
+        # tensors sent to other processes are moved to shared memory, so the learner's own
+        # parameters must not be sent
+        state_dict = snapshot({"network": network})["network"]
+        self._conn.send((timestep, state_dict))
+        self.pending += 1
+
+    def poll(self) -> List[EvalResult]:
+        """Collects the results of all finished evaluations without blocking
+
+        :return (List[EvalResult]): timestep, mean return and wallclock time (as given by
+            time.time()) of every finished evaluation in the order of submission
+        """
+        results = []
+        while self.pending and self._conn.poll():
+            results.append(self._conn.recv())
+            self.pending -= 1
+        return results
+
+    def wait(self) -> List[EvalResult]:
+        """Waits for all pending evaluations (e.g. before saving the state of a run)
+
+        :return (List[EvalResult]): results of the evaluations which were still pending
+        """
+        results = []
+        while self.pending:
+            results.append(self._conn.recv())
+            self.pending -= 1
+        return results
+
+    def close(self) -> List[EvalResult]:
+        """Waits for all pending evaluations and stops the evaluator process
+
+        :return (List[EvalResult]): results of the evaluations which were still pending
+        """
+        results = self.wait()
+        self._conn.send(None)
+        self._process.join()
+        self._conn.close()
+        return results
+
+
+def make_evaluator(agent_cls, network_attr: str, evaluate_fn: Callable, config):
+    """Creates the evaluator of a training run
+
+    :param agent_cls (type): agent class to evaluate
+    :param network_attr (str): name of the agent's network used by act()
+    :param evaluate_fn (Callable): evaluation function of the training script
+    :param config: configuration dictionary mapping configuration keys to values
+    :return (AsyncEvaluator, optional): evaluator (None if config["async_eval"] is not set, in
+        which case training evaluates synchronously)
+    """
+    if not config["async_eval"]:
+        return None
+    return AsyncEvaluator(agent_cls, network_attr, evaluate_fn, config)
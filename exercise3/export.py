@@ -0,0 +1,112 @@
+"""
+Export of trained policies as standalone TorchScript modules for deployment
+
+Exported policies contain only the inference graph of the policy network with the action
+selection (argmax or clamping) baked in. They are loaded with ExportedPolicy, which needs neither
+the agent classes nor their optimisers or target networks.
+"""
+import copy
+from typing import Union
+
+import numpy as np
+import torch
+from torch import nn, Tensor
+
+
+class GreedyPolicy(nn.Module):
+    """Policy selecting the action with the highest output of a network (Q-value or probability)
+    """
+
+    def __init__(self, layers: nn.Module):
+        """
+        :param layers (nn.Module): layers computing one output per discrete action
+        """
+        super().__init__()
+        self.layers = layers
+
+    def forward(self, obs: Tensor) -> Tensor:
+        return torch.argmax(self.layers(obs), dim=-1)
+
+
+class ClampedPolicy(nn.Module):
+    """Policy clamping the output of a deterministic policy network to the action bounds
+    """
+
+    def __init__(self, layers: nn.Module, low: float, high: float):
+        """
+        :param layers (nn.Module): layers computing the action
+        :param low (float): lower bound of actions
+        :param high (float): upper bound of actions
+        """
+        super().__init__()
+        self.layers = layers
+        self.low = low
+        self.high = high
+
+    def forward(self, obs: Tensor) -> Tensor:
+        return torch.clamp(self.layers(obs), self.low, self.high)
+
+
+def export_policy(agent, path: str) -> str:
+    """Exports the greedy policy of a trained agent as a TorchScript module
+
+    DQN and Reinforce agents are exported as the argmax over the outputs of their Q-network or
+    policy network, DDPG agents as the output of their target actor (which they act with) clamped
+    to the action bounds.
+
+    :param agent (Agent): trained DQN, Reinforce or DDPG agent
+    :param path (str): path of the file to export the policy to
+    :return (str): path to the exported file
+    """
+    # imported here so that loading exported policies does not require the training code
+    from rl2022.exercise3.agents import DQN, Reinforce
+    from rl2022.exercise4.agents import DDPG
+
+    if isinstance(agent, DQN):
+        policy = GreedyPolicy(copy.deepcopy(agent.critics_net.layers))
+    elif isinstance(agent, Reinforce):
+        policy = GreedyPolicy(copy.deepcopy(agent.policy.layers))
+    elif isinstance(agent, DDPG):
+        policy = ClampedPolicy(
+            copy.deepcopy(agent.actor_target.layers),
+            float(agent.lower_action_bound),
+            float(agent.upper_action_bound),
+        )
+    else:
+        raise ValueError(f"Can not export policies of {type(agent).__name__} agents")
+
+    policy = policy.cpu().eval()
+    for param in policy.parameters():
+        param.requires_grad_(False)
+    scripted = torch.jit.freeze(torch.jit.script(policy))
+    torch.jit.save(scripted, path)
+    return path
+
+
+class ExportedPolicy:
+    """Policy loaded from a TorchScript module created by export_policy
+
+    Provides the act() interface of agents, so it can be evaluated like an agent (without
+    exploration).
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path (str): path of the exported policy file
+        """
+        self.module = torch.jit.load(path, map_location="cpu")
+        self.module.eval()
+
+    def act(self, obs: np.ndarray, explore: bool = False) -> Union[int, np.ndarray]:
+        """Returns the action of the policy for an observation (or batch of observations)
+
+        :param obs (np.ndarray): observation vector from the environment
+        :param explore (bool): ignored, exported policies never explore
+        :return (Union[int, np.ndarray]): action for a single observation of a discrete action
+            space (an array of actions otherwise)
+        """
+        with torch.inference_mode():
+            action = self.module(torch.as_tensor(obs, dtype=torch.float32))
+        if action.ndim == 0:
+            return int(action)
+        return action.numpy()
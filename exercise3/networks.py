@@ -1,5 +1,7 @@
+from multiprocessing import shared_memory
 from torch import nn, Tensor
-from typing import Iterable
+from typing import Iterable, List, Optional, Tuple
+import numpy as np
 import torch
 
 
@@ -22,6 +24,9 @@ class FCNetwork(nn.Module):
         self.input_size = dims[0]
         self.out_size = dims[-1]
         self.layers = self.make_seq(dims, output_activation)
+        self._numpy_layers = None
+        self._numpy_storage = None
+        self._param_list = None
 
     @staticmethod
     def make_seq(dims: Iterable[int], output_activation: nn.Module) -> nn.Module:
@@ -52,13 +57,119 @@ class FCNetwork(nn.Module):
         # Feedforward
         return self.layers(x)
 
+    def _apply(self, fn, *args, **kwargs):
+        # moving or converting parameters may replace their storage
+        self._numpy_layers = None
+        self._param_list = None
+        return super()._apply(fn, *args, **kwargs)
+
+    def _parameters_of(self, network: nn.Module) -> List[Tensor]:
+        """Gives the parameters of a network as a list (cached for this network)
+
+        :param network (nn.Module): this network or another network
+        :return (List[Tensor]): parameters of the network
+        """
+        if network is not self:
+            if isinstance(network, FCNetwork):
+                return network._parameters_of(network)
+            return list(network.parameters())
+        if self._param_list is None:
+            self._param_list = list(self.parameters())
+        return self._param_list
+
+    def _make_numpy_layers(self) -> Optional[List[Tuple]]:
+        """Creates NumPy views of the layers for predict()
+
+        The views share memory with the parameters, so they reflect optimiser steps, target
+        network updates and loaded state dicts without being refreshed. They are recreated
+        whenever the storage of a parameter is replaced (see _numpy_layers_valid).
+
+        :return (Optional[List[Tuple]]): (kind, *arguments) of each layer (None if the parameters
+            are not float32 tensors on the CPU)
+        """
+        for param in self.parameters():
+            if param.device.type != "cpu" or param.dtype != torch.float32:
+                return None
+
+        self._numpy_storage = [(param, param.data_ptr()) for param in self.parameters()]
+        layers = []
+        for module in self.layers:
+            if isinstance(module, nn.Linear):
+                weight = module.weight.detach().numpy().T
+                bias = None if module.bias is None else module.bias.detach().numpy()
+                layers.append(("linear", weight, bias))
+            elif isinstance(module, nn.ReLU):
+                layers.append(("relu",))
+            elif isinstance(module, nn.Tanh):
+                layers.append(("tanh",))
+            elif isinstance(module, nn.Softmax) and module.dim in (None, -1):
+                layers.append(("softmax", module))
+            else:
+                layers.append(("module", module))
+        return layers
+
+    def _numpy_layers_valid(self) -> bool:
+        """Checks whether the NumPy views still share memory with the parameters
+
+        The storage of parameters can be replaced without going through the module, e.g. when
+        they are moved to shared memory as they are sent to another process.
+
+        :return (bool): flag whether the views created by _make_numpy_layers can still be used
+        """
+        if self._numpy_layers is None:
+            return False
+        return all(param.data_ptr() == ptr for param, ptr in self._numpy_storage)
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        """Computes a forward pass without gradients for NumPy inputs
+
+        For the small networks used here, the overhead of PyTorch dominates the cost of a forward
+        pass on single observations, so the forward pass is computed with NumPy directly (falling
+        back to PyTorch for networks on other devices and unsupported layers).
+
+        :param x (np.ndarray): input (or batch of inputs) to feed into the network
+        :return (np.ndarray): output computed by the network
+        """
+        if not self._numpy_layers_valid():
+            self._numpy_layers = self._make_numpy_layers()
+        if self._numpy_layers is None:
+            param = next(self.parameters())
+            with torch.inference_mode():
+                x = torch.as_tensor(x, dtype=param.dtype, device=param.device)
+                return self.layers(x).cpu().numpy()
+
+        x = np.asarray(x, dtype=np.float32)
+        for kind, *args in self._numpy_layers:
+            if kind == "linear":
+                weight, bias = args
+                x = x @ weight
+                if bias is not None:
+                    x += bias
+            elif kind == "relu":
+                np.maximum(x, 0, out=x)
+            elif kind == "tanh":
+                np.tanh(x, out=x)
+            elif kind == "softmax" and x.ndim <= 2:
+                # implicit softmax dimensions of PyTorch are the last dimension for such inputs
+                x = np.exp(x - x.max(axis=-1, keepdims=True))
+                x /= x.sum(axis=-1, keepdims=True)
+            else:
+                with torch.inference_mode():
+                    x = args[0](torch.from_numpy(x)).numpy()
+        return x
+
     def hard_update(self, source: nn.Module):
         """Updates the network parameters by copying the parameters of another network
 
         :param source (nn.Module): network to copy the parameters from
         """
-        for target_param, source_param in zip(self.parameters(), source.parameters()):
-            target_param.data.copy_(source_param.data)
+        targets, sources = self._parameters_of(self), self._parameters_of(source)
+        with torch.no_grad():
+            if hasattr(torch, "_foreach_copy_"):
+                torch._foreach_copy_(targets, sources)
+            else:
+                for target_param, source_param in zip(targets, sources):
+                    target_param.copy_(source_param)
 
     def soft_update(self, source: nn.Module, tau: float):
         """Updates the network parameters with a soft update
@@ -69,7 +180,100 @@ class FCNetwork(nn.Module):
         :param tau (float): stepsize for the soft update
             (tau = 0: no update; tau = 1: copy parameters of source network)
         """
-        for target_param, source_param in zip(self.parameters(), source.parameters()):
-            target_param.data.copy_(
-                (1 - tau) * target_param.data + tau * source_param.data
-            )
+        # lerp computes (1 - tau) * target + tau * source in place for all parameters at once
+        targets, sources = self._parameters_of(self), self._parameters_of(source)
+        with torch.no_grad():
+            if hasattr(torch, "_foreach_lerp_"):
+                torch._foreach_lerp_(targets, sources, tau)
+            else:
+                for target_param, source_param in zip(targets, sources):
+                    target_param.lerp_(source_param, tau)
+
+
+class SharedWeights:
+    """Parameters of a network published through a shared memory block to other processes
+
+    The block holds a version counter followed by all parameters and buffers of the network as
+    float32 values. The counter is odd while parameters are being published, so readers can
+    detect (and skip) copies of partially published parameters. Only a single process may
+    publish.
+
+    :attr name (str): name of the shared memory block used to attach from other processes
+    :attr size (int): number of float32 values of the network
+    """
+
+    def __init__(self, network: nn.Module, name: Optional[str] = None):
+        """Constructor of SharedWeights creating a new block or attaching to an existing one
+
+        :param network (nn.Module): network (or network of the same architecture) to take the
+            layout of the parameters from
+        :param name (str, optional): name of an existing block to attach to (creates a new block
+            if None)
+        """
+        tensors = list(network.state_dict().values())
+        for tensor in tensors:
+            assert tensor.dtype == torch.float32, "Only float32 networks can be shared"
+        self.size = sum(t.numel() for t in tensors)
+        self._owner = name is None
+
+        header = np.dtype(np.int64).itemsize
+        nbytes = header + self.size * np.dtype(np.float32).itemsize
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=nbytes)
+        self.name = self._shm.name
+        self._version = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._params = np.ndarray(
+            (self.size,), dtype=np.float32, buffer=self._shm.buf, offset=header
+        )
+        if self._owner:
+            self._version[0] = 0
+
+    @property
+    def version(self) -> int:
+        """Number of completed publications (0 if the parameters were never published)
+        """
+        return int(self._version[0]) // 2
+
+    def publish(self, network: nn.Module):
+        """Copies the parameters of a network into the shared block
+
+        :param network (nn.Module): network to publish the parameters of
+        """
+        self._version[0] += 1
+        offset = 0
+        for tensor in network.state_dict().values():
+            n = tensor.numel()
+            self._params[offset:offset + n] = tensor.detach().cpu().numpy().reshape(-1)
+            offset += n
+        self._version[0] += 1
+
+    def load(self, network: nn.Module, version: int = -1) -> int:
+        """Copies the published parameters into a network if they are newer than a given version
+
+        :param network (nn.Module): network to load the parameters into
+        :param version (int): version currently held by the network
+        :return (int): version held by the network after loading (the given version if no newer
+            parameters were published or they were being published while copying)
+        """
+        counter = int(self._version[0])
+        if counter % 2 or counter // 2 == version:
+            return version
+        params = self._params.copy()
+        if int(self._version[0]) != counter:
+            return version
+
+        offset = 0
+        with torch.no_grad():
+            for tensor in network.state_dict().values():
+                n = tensor.numel()
+                tensor.copy_(torch.from_numpy(params[offset:offset + n]).view_as(tensor))
+                offset += n
+        return counter // 2
+
+    def close(self):
+        """Detaches this process from the shared memory block (and frees it if it was created
+        by this process)
+        """
+        self._version = self._params = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
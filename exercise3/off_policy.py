@@ -0,0 +1,188 @@
+"""
+Episodes, updates and evaluation of off-policy agents learning from a replay buffer
+
+These helpers are shared by the training loops of DQN and DDPG (synchronous, vectorised and
+actor-learner training), whose agents only differ in the network their actions are selected with.
+"""
+from typing import Dict, List, Tuple
+
+import gym
+import numpy as np
+
+from rl2022.exercise3.replay import PrioritizedReplayBuffer, split_batch
+from rl2022.telemetry import NULL_TELEMETRY
+
+
+def update_agent(
+    agent, replay_buffer, batch_size, sampler=None, gradient_steps=1, telemetry=NULL_TELEMETRY
+) -> List[Dict[str, float]]:
+    """Updates the agent on batches sampled from the replay buffer
+
+    Without a sampler, all gradient_steps batches are drawn in a single sampling call and split
+    into the batches afterwards. Prioritised batches are therefore all sampled with the
+    priorities before the first of the updates.
+
+    :param agent (Agent): agent to update (DQN or DDPG)
+    :param replay_buffer (ReplayBuffer): buffer to sample the batches from
+    :param batch_size (int): size of each sampled batch
+    :param sampler (PrefetchSampler, optional): sampler prefetching batches from the buffer
+    :param gradient_steps (int): number of updates (each on its own batch)
+    :param telemetry (Telemetry): telemetry timing the sampling and the updates
+    :return (List[Dict[str, float]]): update information of the agent for every update
+    """
+    t = telemetry.now()
+    if sampler is not None:
+        samples = [sampler.sample() for _ in range(gradient_steps)]
+    elif isinstance(replay_buffer, PrioritizedReplayBuffer):
+        # batches are gathered into the same preallocated buffer at every update
+        out = replay_buffer.batch_buffer(batch_size * gradient_steps)
+        batch, weights, indices = replay_buffer.sample_weighted(
+            batch_size * gradient_steps, out=out
+        )
+        samples = [
+            (split, weights[i::gradient_steps], indices[i::gradient_steps])
+            for i, split in enumerate(split_batch(batch, gradient_steps))
+        ]
+    else:
+        out = replay_buffer.batch_buffer(batch_size * gradient_steps)
+        batch = replay_buffer.sample(batch_size * gradient_steps, out=out)
+        samples = [(split, None, None) for split in split_batch(batch, gradient_steps)]
+
+    t = telemetry.lap("sample", t)
+
+    infos = []
+    for batch, weights, indices in samples:
+        info = agent.update(batch, weights)
+        if indices is not None:
+            replay_buffer.update_priorities(indices, info["td_errors"])
+        infos.append(info)
+        t = telemetry.lap("update", t)
+    return infos
+
+
+def play_episode(
+    env,
+    agent,
+    replay_buffer,
+    train=True,
+    explore=True,
+    render=False,
+    max_steps=200,
+    batch_size=64,
+    sampler=None,
+    train_freq=1,
+    gradient_steps=1,
+    telemetry=NULL_TELEMETRY,
+):
+    """
+    Plays one episode, pushing its transitions to the replay buffer and updating the agent
+
+    :param env (gym.Env): environment to play on
+    :param agent (Agent): agent selecting the actions (DQN or DDPG)
+    :param replay_buffer (ReplayBuffer): buffer to push the transitions to
+    :param train (bool): flag whether transitions are pushed and the agent is updated
+    :param explore (bool): flag whether exploration is used
+    :param render (bool): flag whether environment should be visualised
+    :param max_steps (int): max number of timesteps for the episode
+    :param batch_size (int): size of each batch sampled for an update
+    :param sampler (PrefetchSampler, optional): sampler prefetching batches from the buffer
+    :param train_freq (int): number of pushed transitions between update phases
+    :param gradient_steps (int): number of updates per update phase
+    :param telemetry (Telemetry): telemetry timing the phases of every timestep
+    :return (Tuple[int, float, List[float]]): number of timesteps, return and losses of the
+        updates of the episode
+    """
+    obs = env.reset()
+    done = False
+    losses = []
+    if render:
+        env.render()
+
+    episode_timesteps = 0
+    episode_return = 0
+
+    while not done:
+        t = telemetry.now()
+        action = agent.act(obs, explore=explore)
+        t = telemetry.lap("act", t)
+        nobs, reward, done, _ = env.step(action)
+        t = telemetry.lap("env", t)
+        if train:
+            replay_buffer.push(
+                np.array(obs, dtype=np.float32),
+                np.array(action, dtype=np.float32).reshape(-1),
+                np.array(nobs, dtype=np.float32),
+                np.array([reward], dtype=np.float32),
+                np.array([done], dtype=np.float32),
+            )
+            telemetry.lap("push", t)
+            if len(replay_buffer) >= batch_size and replay_buffer.writes % train_freq == 0:
+                infos = update_agent(
+                    agent, replay_buffer, batch_size, sampler, gradient_steps, telemetry
+                )
+                losses += [info["q_loss"] for info in infos]
+
+        episode_timesteps += 1
+        episode_return += reward
+
+        if render:
+            env.render()
+
+        if max_steps == episode_timesteps:
+            break
+        obs = nobs
+
+    return episode_timesteps, episode_return, losses
+
+
+def evaluate(env: gym.Env, agent, replay_buffer, config, render: bool = False) -> float:
+    """Evaluates the policy of the agent without exploration
+
+    :param env (gym.Env): environment to evaluate on
+    :param agent (Agent): agent to evaluate (DQN or DDPG)
+    :param replay_buffer (ReplayBuffer): replay buffer of the agent (not modified)
+    :param config: configuration dictionary mapping configuration keys to values
+    :param render (bool): flag whether evaluation episodes should be visualised
+    :return (float): mean return over config["eval_episodes"] episodes
+    """
+    eval_returns = 0
+    for _ in range(config["eval_episodes"]):
+        _, episode_return, _ = play_episode(
+            env,
+            agent,
+            replay_buffer,
+            train=False,
+            explore=False,
+            render=render,
+            max_steps=config["episode_length"],
+            batch_size=config["batch_size"],
+        )
+        eval_returns += episode_return / config["eval_episodes"]
+    return eval_returns
+
+
+def record_evaluations(
+    eval_results: List[Tuple[int, float, float]],
+    eval_returns_all: List[float],
+    eval_times_all: List[float],
+    start_time: float,
+    pbar,
+    output: bool,
+):
+    """Records the results of evaluations (see evaluate and exercise3/evaluator.py)
+
+    :param eval_results (List[Tuple[int, float, float]]): timestep, mean return and wallclock
+        time of every evaluation
+    :param eval_returns_all (List[float]): mean returns of all previous evaluations (extended)
+    :param eval_times_all (List[float]): times of all previous evaluations (extended)
+    :param start_time (float): wallclock time at which training started
+    :param pbar (tqdm): progress bar of training
+    :param output (bool): flag whether evaluation results should be printed
+    """
+    for timestep, eval_returns, eval_time in eval_results:
+        if output:
+            pbar.write(
+                f"Evaluation at timestep {timestep} returned a mean returns of {eval_returns}"
+            )
+        eval_returns_all.append(eval_returns)
+        eval_times_all.append(eval_time - start_time)
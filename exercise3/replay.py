@@ -2,6 +2,14 @@
 Experience replay implementations
 """
 from collections import namedtuple
+import functools
+import json
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import os
+import queue
+import threading
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 import torch
 
@@ -11,24 +19,199 @@ Transition = namedtuple(
 )
 
 
+def split_batch(batch: Transition, num_batches: int) -> List[Transition]:
+    """Splits a batch of experiences into smaller batches (as views of the batch)
+
+    Batch i consists of experiences i, i + num_batches, i + 2 * num_batches, ..., so that every
+    batch spans the whole range of a stratified (prioritised) sample.
+
+    :param batch (Transition): batch of experiences with a size divisible by num_batches
+    :param num_batches (int): number of batches to split into
+    :return (List[Transition]): batches of experiences
+    """
+    return [Transition(*(field[i::num_batches] for field in batch)) for i in range(num_batches)]
+
+
+def _locked(method):
+    """Decorates a method of a replay buffer to hold the lock of the buffer (if any) while it runs
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.lock is None:
+            return method(self, *args, **kwargs)
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class BatchBuffer:
+    """Preallocated arrays and tensors that sampled batches are gathered into
+
+    Every transition component is gathered into a NumPy array of its storage dtype. Components
+    stored in their pushed dtype are returned as tensors sharing memory with these arrays, while
+    compactly stored components are copied into preallocated float32 tensors. Host tensors are
+    pinned when batches are moved to a GPU, so the transfer can be asynchronous.
+
+    Note:
+        batches sampled into a BatchBuffer share its memory and are overwritten by the next
+        sample into the same BatchBuffer
+
+    :attr batch_size (int): number of transitions per batch
+    :attr arrays (List[np.ndarray]): gather targets of each component in its storage dtype
+    :attr tensors (List[torch.Tensor]): host tensors returned for each component
+    """
+
+    def __init__(
+        self, layout: List[Tuple[int, np.dtype, bool]], batch_size: int, pin_memory: bool = False
+    ):
+        """Constructor of BatchBuffer
+
+        :param layout (List[Tuple[int, np.dtype, bool]]): dimensionality, storage dtype and upcast
+            flag of each component of the transition tuple
+        :param batch_size (int): number of transitions per batch
+        :param pin_memory (bool): flag whether host tensors are allocated in pinned memory
+        """
+        self.batch_size = batch_size
+        self.arrays = []
+        self.tensors = []
+        self._upcast = []
+        for dim, dtype, upcast in layout:
+            if upcast:
+                array = np.empty((batch_size, dim), dtype=dtype)
+                tensor = torch.empty((batch_size, dim), dtype=torch.float32, pin_memory=pin_memory)
+            else:
+                tensor = torch.from_numpy(np.empty((batch_size, dim), dtype=dtype))
+                if pin_memory:
+                    tensor = tensor.pin_memory()
+                array = tensor.numpy()
+            self.arrays.append(array)
+            self.tensors.append(tensor)
+            self._upcast.append(upcast)
+
+    def batch(self, device: str = "cpu") -> Transition:
+        """Gives the batch currently held in the buffer
+
+        :param device (str): PyTorch device to cast to (for potential GPU support)
+        :return (Transition): batch of experiences
+        """
+        for array, tensor, upcast in zip(self.arrays, self.tensors, self._upcast):
+            if upcast:
+                np.copyto(tensor.numpy(), array, casting="unsafe")
+        if device == "cpu":
+            return Transition(*self.tensors)
+        return Transition(*[t.to(device, non_blocking=True) for t in self.tensors])
+
+
 class ReplayBuffer:
     """Replay buffer to sample experience/ transition tuples from
 
     :attr capacity (int): total capacity of the replay buffer
     :attr memory (Transition):
         Each component of the transition tuple is represented by a zero-initialised np.ndarray of
-        floats with dimensionality (total buffer capacity, component dimensionality)
+        floats with dimensionality (allocated rows, component dimensionality). Arrays held in RAM
+        start with `initial_size` rows and grow geometrically up to the capacity as transitions
+        are added
     :attr writes (int): number of experiences/ transitions already added to the buffer
+    :attr storage_dir (str): directory holding memory-mapped files of the memory (None if the
+        memory is held in RAM)
+    :attr dtypes (Dict[str, str]): storage dtypes of transition components (components not listed
+        keep the dtype they are pushed with)
+    :attr max_bytes (int): memory budget of the stored transitions (None for no budget)
+    :attr initial_size (int): number of rows allocated when the memory is initialised
+    :attr lock (threading.RLock): lock held while the buffer is modified or sampled from (None if
+        the buffer is only used by a single thread, see PrefetchSampler)
     """
 
-    def __init__(self, capacity: int):
+    growth_factor: int = 2
+
+    def __init__(
+        self,
+        capacity: int,
+        storage_dir: Optional[str] = None,
+        dtypes: Optional[Dict[str, str]] = None,
+        max_bytes: Optional[int] = None,
+        initial_size: int = 1024,
+    ):
         """Constructor for a ReplayBuffer initialising an empty buffer (without memory
         
         :param capacity (int): total capacity of the replay buffer
+        :param storage_dir (str, optional): directory to store each component of the memory in as
+            a np.memmap file instead of RAM (see ReplayBuffer.open to reopen it later)
+        :param dtypes (Dict[str, str], optional): mapping from names of transition components to
+            compact dtypes to store them as (e.g. {"actions": "int16", "done": "uint8",
+            "states": "float16"}). Components stored with such a dtype are returned as float32
+            tensors by sample()
+        :param max_bytes (int, optional): memory budget of the stored transitions. If given, the
+            capacity is reduced to the number of transitions fitting into the budget once their
+            size is known (on the first push)
+        :param initial_size (int): number of rows allocated when the memory is initialised
+            (memory-mapped buffers are always allocated to full capacity, since their files are
+            sparse)
         """
         self.capacity = int(capacity)
         self.memory = None
         self.writes = 0
+        self.storage_dir = storage_dir
+        self.max_bytes = max_bytes
+        self.initial_size = int(initial_size)
+        self.dtypes = dict(dtypes) if dtypes else {}
+        for name in self.dtypes:
+            assert name in Transition._fields, f"Unknown transition component {name}"
+        self._writes_file = None
+        self._batch_buffers = {}
+        self.lock = None
+
+    def _storage_dtypes(self, transition: Transition) -> List[np.dtype]:
+        """Gives the dtypes to store each component of the transition tuple as
+
+        :param transition (Transition): transition(s) to take the pushed dtypes from
+        :return (List[np.dtype]): storage dtype of each component
+        """
+        return [
+            np.dtype(self.dtypes.get(name, t.dtype))
+            for name, t in zip(Transition._fields, transition)
+        ]
+
+    def _to_tensor(self, name: str, data: np.ndarray, device: str) -> torch.Tensor:
+        """Converts sampled data of a transition component to a tensor
+
+        :param name (str): name of the transition component
+        :param data (np.ndarray): sampled data of the component
+        :param device (str): PyTorch device to cast to
+        :return (torch.Tensor): tensor of the data (upcast to float32 for compactly stored
+            components)
+        """
+        tensor = torch.from_numpy(data)
+        if name in self.dtypes:
+            return tensor.to(device=device, dtype=torch.float32)
+        return tensor.to(device)
+
+    def _apply_byte_budget(self, transition_bytes: int):
+        """Reduces the capacity to the number of transitions fitting into the memory budget
+
+        :param transition_bytes (int): number of bytes needed to store a single transition
+        """
+        if self.max_bytes is not None:
+            self.capacity = max(1, min(self.capacity, self.max_bytes // transition_bytes))
+
+    def _reserve(self, size: int):
+        """Grows the arrays of the memory geometrically so that they hold at least `size` rows
+
+        :param size (int): number of rows required (at most the capacity)
+        """
+        rows = len(self.memory.states)
+        if size <= rows:
+            return
+        new_rows = min(self.capacity, max(size, self.growth_factor * rows))
+        grown = []
+        for d in self.memory:
+            if d is None:
+                grown.append(None)
+                continue
+            new = np.zeros([new_rows, d.shape[1]], dtype=d.dtype)
+            new[:rows] = d
+            grown.append(new)
+        self.memory = Transition(*grown)
 
     def init_memory(self, transition: Transition):
         """Initialises the memory with zero-entries
@@ -38,10 +221,132 @@ class ReplayBuffer:
         for t in transition:
             assert t.ndim == 1  # sanity check
 
+        dtypes = self._storage_dtypes(transition)
+        self._apply_byte_budget(
+            sum(t.size * dtype.itemsize for t, dtype in zip(transition, dtypes))
+        )
+        if self.storage_dir is None:
+            rows = min(self.capacity, self.initial_size)
+            self.memory = Transition(
+                *[np.zeros([rows, t.size], dtype=dtype) for t, dtype in zip(transition, dtypes)]
+            )
+            return
+
+        os.makedirs(self.storage_dir, exist_ok=True)
+        fields = {
+            name: {"dtype": dtype.str, "dim": t.size}
+            for name, t, dtype in zip(Transition._fields, transition, dtypes)
+        }
+        with open(os.path.join(self.storage_dir, "meta.json"), "w") as f:
+            json.dump({"capacity": self.capacity, "fields": fields, "dtypes": self.dtypes}, f)
+        self._map_memory(fields, "w+")
+
+    def _map_memory(self, fields: dict, mode: str):
+        """Maps the memory and the write counter to their files in the storage directory
+
+        :param fields (dict): dtype and dimensionality of each component of the transition tuple
+        :param mode (str): mode to open the np.memmap files with
+        """
         self.memory = Transition(
-            *[np.zeros([self.capacity, t.size], dtype=t.dtype) for t in transition]
+            *[
+                np.memmap(
+                    os.path.join(self.storage_dir, f"{name}.dat"),
+                    dtype=np.dtype(field["dtype"]),
+                    mode=mode,
+                    shape=(self.capacity, field["dim"]),
+                )
+                for name, field in fields.items()
+            ]
+        )
+        self._writes_file = np.memmap(
+            os.path.join(self.storage_dir, "writes.dat"),
+            dtype=np.int64,
+            mode=mode,
+            shape=(1,),
         )
 
+    @classmethod
+    def open(cls, storage_dir: str, mode: str = "r+", **kwargs) -> "ReplayBuffer":
+        """Reopens a buffer stored in memory-mapped files (e.g. for inspection or to resume
+        training)
+
+        :param storage_dir (str): directory the buffer was stored in
+        :param mode (str): mode to open the files with ("r" for read-only access)
+        :param **kwargs: further arguments of the buffer class constructor
+        :return (ReplayBuffer): buffer holding the stored transitions
+        """
+        with open(os.path.join(storage_dir, "meta.json")) as f:
+            meta = json.load(f)
+        buffer = cls(meta["capacity"], storage_dir=storage_dir, dtypes=meta["dtypes"], **kwargs)
+        buffer._map_memory(meta["fields"], mode)
+        buffer.writes = int(buffer._writes_file[0])
+        return buffer
+
+    def flush(self):
+        """Writes pending changes of a memory-mapped buffer to disk
+        """
+        if self._writes_file is not None:
+            for d in self.memory:
+                d.flush()
+            self._writes_file.flush()
+
+    def save_state(self, directory: str):
+        """Saves the stored transitions and the write counter to a directory (e.g. to resume a
+        training run)
+
+        Every component of the memory is written as a raw .npy file, so that load_state can map
+        the files instead of reading them.
+
+        :param directory (str): directory to save the state to (created if it does not exist)
+        """
+        os.makedirs(directory, exist_ok=True)
+        fields = {}
+        if self.memory is not None and len(self) > 0:
+            for name, d in zip(Transition._fields, self.memory):
+                if d is None:
+                    continue
+                np.save(os.path.join(directory, f"{name}.npy"), d[:len(self)])
+                fields[name] = {"dtype": d.dtype.str, "dim": d.shape[1]}
+        with open(os.path.join(directory, "buffer.json"), "w") as f:
+            json.dump({"capacity": self.capacity, "writes": self.writes, "fields": fields}, f)
+
+    def load_state(self, directory: str):
+        """Restores the transitions and the write counter saved by save_state
+
+        Buffers held in RAM map the saved files copy-on-write, so resuming does not read the
+        whole memory upfront. Memory-mapped buffers copy the saved transitions into their files.
+
+        :param directory (str): directory the state was saved to
+        """
+        with open(os.path.join(directory, "buffer.json")) as f:
+            meta = json.load(f)
+        self.capacity = meta["capacity"]
+        self.writes = meta["writes"]
+        self._batch_buffers = {}
+        if not meta["fields"]:
+            self.memory = None
+            return
+
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="c")
+            for name in meta["fields"]
+        }
+        if self.storage_dir is None:
+            self.memory = Transition(*[arrays.get(name) for name in Transition._fields])
+            return
+
+        os.makedirs(self.storage_dir, exist_ok=True)
+        with open(os.path.join(self.storage_dir, "meta.json"), "w") as f:
+            json.dump(
+                {"capacity": self.capacity, "fields": meta["fields"], "dtypes": self.dtypes}, f
+            )
+        self._map_memory(meta["fields"], "w+")
+        for name, d in arrays.items():
+            getattr(self.memory, name)[:len(d)] = d
+        self._writes_file[0] = self.writes
+        self.flush()
+
+    @_locked
     def push(self, *args):
         """Adds transitions to the memory
 
@@ -54,29 +359,826 @@ class ReplayBuffer:
             self.init_memory(Transition(*args))
 
         position = (self.writes) % self.capacity
+        self._reserve(position + 1)
         for i, data in enumerate(args):
             self.memory[i][position, :] = data
 
         self.writes = self.writes + 1
+        if self._writes_file is not None:
+            self._writes_file[0] = self.writes
+
+    @_locked
+    def push_batch(self, *args) -> np.ndarray:
+        """Adds a batch of transitions to the memory
+
+        Note:
+            if more transitions than the capacity are pushed at once, only the latest ones are
+            stored
+
+        :param *args: arguments to create transitions from, each component of shape
+            (number of transitions, component dimensionality)
+        :return (np.ndarray): positions the transitions were written to
+        """
+        n = len(args[0])
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        batch = Transition(*[np.asarray(a).reshape(n, -1) for a in args])
+        if not self.memory:
+            self.init_memory(Transition(*[a[0] for a in batch]))
+
+        self._reserve(min(self.capacity, self.writes + n))
+        skipped = max(0, n - self.capacity)
+        positions = (self.writes + skipped + np.arange(n - skipped)) % self.capacity
+        start = positions[0]
+        # the written slots are contiguous apart from a single split at the end of the ring
+        first = min(n - skipped, self.capacity - start)
+        for d, data in zip(self.memory, batch):
+            data = data[skipped:]
+            d[start:start + first] = data[:first]
+            d[:len(data) - first] = data[first:]
 
-    def sample(self, batch_size: int, device: str = "cpu") -> Transition:
+        self.writes = self.writes + n
+        if self._writes_file is not None:
+            self._writes_file[0] = self.writes
+        return positions
+
+    def _layout(self) -> List[Tuple[int, np.dtype, bool]]:
+        """Gives the dimensionality, storage dtype and upcast flag of each transition component
+
+        :return (List[Tuple[int, np.dtype, bool]]): layout of each component (see BatchBuffer)
+        """
+        return [
+            (d.shape[1], d.dtype, name in self.dtypes)
+            for name, d in zip(Transition._fields, self.memory)
+        ]
+
+    def batch_buffer(self, batch_size: int, device: str = "cpu") -> BatchBuffer:
+        """Gives a BatchBuffer to sample batches of the given size into (see sample)
+
+        The BatchBuffer is created on first use and reused by later calls with the same arguments.
+
+        :param batch_size (int): number of transitions per batch
+        :param device (str): PyTorch device the batches will be cast to
+        :return (BatchBuffer): preallocated buffer for batches
+        """
+        key = (batch_size, device)
+        if key not in self._batch_buffers:
+            pin_memory = device != "cpu" and torch.cuda.is_available()
+            self._batch_buffers[key] = BatchBuffer(self._layout(), batch_size, pin_memory)
+        return self._batch_buffers[key]
+
+    def _gather(
+        self, samples: np.ndarray, device: str, out: Optional[BatchBuffer] = None
+    ) -> Transition:
+        """Gathers the transitions at given indices of the memory into a batch
+
+        :param samples (np.ndarray): indices of the transitions to gather
+        :param device (str): PyTorch device to cast to (for potential GPU support)
+        :param out (BatchBuffer, optional): preallocated buffer to gather into
+        :return (Transition): batch of experiences
+        """
+        if out is None:
+            return Transition(
+                *[
+                    self._to_tensor(name, np.take(d, samples, axis=0), device)
+                    for name, d in zip(Transition._fields, self.memory)
+                ]
+            )
+        for d, array in zip(self.memory, out.arrays):
+            np.take(d, samples, axis=0, out=array)
+        return out.batch(device)
+
+    @_locked
+    def sample(
+        self,
+        batch_size: int,
+        device: str = "cpu",
+        out: Optional[BatchBuffer] = None,
+        random_state: Optional[np.random.RandomState] = None,
+    ) -> Transition:
         """Samples batch of experiences from the replay buffer
 
         :param batch_size (int): size of the batch to be sampled and returned
         :param device (str): PyTorch device to cast to (for potential GPU support)
+        :param out (BatchBuffer, optional): preallocated buffer to gather the batch into to avoid
+            allocating new arrays and tensors (see batch_buffer). The returned batch shares its
+            memory and is overwritten by the next sample into it
+        :param random_state (np.random.RandomState, optional): generator to draw the samples from
+            (global np.random generator if None)
         :return (Transition): batch of experiences of given batch size
         """
-        samples = np.random.randint(0, high=len(self), size=batch_size)
+        random_state = np.random if random_state is None else random_state
+        samples = random_state.randint(0, high=len(self), size=batch_size)
+        return self._gather(samples, device, out)
+
+    def __len__(self):
+        """Gives the length of the buffer
+        """
+        return min(self.writes, self.capacity)
+
+
+class SegmentTree:
+    """Array-based binary tree in which every node holds the reduction (e.g. sum or minimum) of
+    its two children
+
+    Leaves are stored at indices [size, 2 * size) of the array and the root at index 1, where size
+    is the capacity rounded up to the next power of two.
+
+    :attr size (int): number of leaves
+    :attr tree (np.ndarray): array holding all nodes of the tree
+    """
+
+    def __init__(self, capacity: int, op: np.ufunc, neutral: float):
+        """Constructor of SegmentTree
+
+        :param capacity (int): number of values to store
+        :param op (np.ufunc): binary reduction applied to the children of each node
+        :param neutral (float): neutral element of the reduction (value of empty leaves)
+        """
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.op = op
+        self.tree = np.full(2 * self.size, neutral, dtype=np.float64)
+
+    def update(self, indices: np.ndarray, values: np.ndarray):
+        """Sets the values of a batch of leaves and updates all their ancestors
+
+        :param indices (np.ndarray): indices of the leaves to set
+        :param values (np.ndarray): new values of the leaves
+        """
+        nodes = np.asarray(indices) + self.size
+        self.tree[nodes] = values
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.op(self.tree[2 * nodes], self.tree[2 * nodes + 1])
+            nodes = np.unique(nodes // 2)
+
+    def reduce(self) -> float:
+        """Gives the reduction over all leaves
+
+        :return (float): value of the root node
+        """
+        return self.tree[1]
+
+    def __getitem__(self, indices: np.ndarray) -> np.ndarray:
+        return self.tree[np.asarray(indices) + self.size]
+
+
+class SumTree(SegmentTree):
+    """Segment tree of sums supporting sampling of leaves proportional to their values
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity, np.add, 0.0)
+
+    def find_prefixsum(self, prefixsums: np.ndarray) -> np.ndarray:
+        """Finds for a batch of prefix sums the leaves in which the cumulative sum of leaves
+        exceeds them
+
+        :param prefixsums (np.ndarray): prefix sums in [0, total sum)
+        :return (np.ndarray): indices of the found leaves
+        """
+        prefixsums = np.array(prefixsums, dtype=np.float64)
+        nodes = np.ones(len(prefixsums), dtype=np.int64)
+        while nodes[0] < self.size:
+            left = 2 * nodes
+            left_sums = self.tree[left]
+            go_right = prefixsums >= left_sums
+            prefixsums -= left_sums * go_right
+            nodes = left + go_right
+        return nodes - self.size
+
+
+class MinTree(SegmentTree):
+    """Segment tree of minimums
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity, np.minimum, np.inf)
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """Replay buffer sampling transitions proportionally to their priority (Schaul et al., 2016)
+
+    Priorities are stored as p^alpha in a sum-tree to sample batches in O(log N) and in a min-tree
+    to normalise importance sampling weights. New transitions get the maximum priority seen so far.
+
+    :attr alpha (float): exponent determining how much prioritisation is used (0: uniform)
+    :attr beta (float): exponent of the importance sampling correction (1: full correction)
+    :attr eps (float): constant added to all priorities so no transition has zero probability
+    """
+
+    def __init__(
+        self, capacity: int, alpha: float = 0.6, beta: float = 0.4, eps: float = 1e-6, **kwargs
+    ):
+        """Constructor for a PrioritizedReplayBuffer initialising an empty buffer
+
+        Note:
+            priorities are only held in RAM, so a reopened memory-mapped buffer starts with
+            equal priorities for all stored transitions
+
+        :param capacity (int): total capacity of the replay buffer
+        :param alpha (float): exponent determining how much prioritisation is used (0: uniform)
+        :param beta (float): initial exponent of the importance sampling correction
+        :param eps (float): constant added to all priorities
+        :param **kwargs: further arguments of ReplayBuffer (e.g. storage_dir)
+        """
+        super().__init__(capacity, **kwargs)
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self.max_priority = 1.0
+        self.sum_tree = SumTree(self.capacity)
+        self.min_tree = MinTree(self.capacity)
+
+    @classmethod
+    def open(cls, storage_dir: str, mode: str = "r+", **kwargs) -> "PrioritizedReplayBuffer":
+        buffer = super().open(storage_dir, mode, **kwargs)
+        if len(buffer) > 0:
+            indices = np.arange(len(buffer))
+            priorities = np.full(len(buffer), buffer.max_priority ** buffer.alpha)
+            buffer.sum_tree.update(indices, priorities)
+            buffer.min_tree.update(indices, priorities)
+        return buffer
+
+    def save_state(self, directory: str):
+        super().save_state(directory)
+        np.save(os.path.join(directory, "sum_tree.npy"), self.sum_tree.tree)
+        np.save(os.path.join(directory, "min_tree.npy"), self.min_tree.tree)
+        with open(os.path.join(directory, "priorities.json"), "w") as f:
+            json.dump({"max_priority": self.max_priority, "beta": self.beta}, f)
+
+    def load_state(self, directory: str):
+        super().load_state(directory)
+        for tree, name in ((self.sum_tree, "sum_tree"), (self.min_tree, "min_tree")):
+            tree.tree = np.load(os.path.join(directory, f"{name}.npy"))
+            tree.size = len(tree.tree) // 2
+        with open(os.path.join(directory, "priorities.json")) as f:
+            meta = json.load(f)
+        self.max_priority = meta["max_priority"]
+        self.beta = meta["beta"]
+
+    @_locked
+    def push(self, *args):
+        """Adds transitions to the memory with maximum priority
+
+        :param *args: arguments to create transition from
+        """
+        position = self.writes % self.capacity
+        super().push(*args)
+        priority = self.max_priority ** self.alpha
+        self.sum_tree.update([position], [priority])
+        self.min_tree.update([position], [priority])
+
+    @_locked
+    def push_batch(self, *args) -> np.ndarray:
+        """Adds a batch of transitions to the memory with maximum priority
+
+        :param *args: arguments to create transitions from (see ReplayBuffer.push_batch)
+        :return (np.ndarray): positions the transitions were written to
+        """
+        positions = super().push_batch(*args)
+        priorities = np.full(len(positions), self.max_priority ** self.alpha)
+        if len(positions):
+            self.sum_tree.update(positions, priorities)
+            self.min_tree.update(positions, priorities)
+        return positions
+
+    def sample_indices(
+        self, batch_size: int, random_state: Optional[np.random.RandomState] = None
+    ) -> np.ndarray:
+        """Samples indices of transitions proportionally to their priorities
+
+        The total priority is split into batch_size equal segments and one index is sampled
+        from each segment.
+
+        :param batch_size (int): number of indices to sample
+        :param random_state (np.random.RandomState, optional): generator to draw the samples from
+            (global np.random generator if None)
+        :return (np.ndarray): sampled indices
+        """
+        random_state = np.random if random_state is None else random_state
+        total = self.sum_tree.reduce()
+        segments = np.arange(batch_size) + random_state.uniform(size=batch_size)
+        prefixsums = segments * (total / batch_size)
+        indices = self.sum_tree.find_prefixsum(prefixsums)
+        return np.minimum(indices, len(self) - 1)
+
+    @_locked
+    def sample_weighted(
+        self,
+        batch_size: int,
+        device: str = "cpu",
+        out: Optional[BatchBuffer] = None,
+        random_state: Optional[np.random.RandomState] = None,
+    ) -> Tuple[Transition, torch.Tensor, np.ndarray]:
+        """Samples a prioritised batch of experiences with importance sampling weights
+
+        :param batch_size (int): size of the batch to be sampled and returned
+        :param device (str): PyTorch device to cast to (for potential GPU support)
+        :param out (BatchBuffer, optional): preallocated buffer to gather the batch into (see
+            ReplayBuffer.sample)
+        :param random_state (np.random.RandomState, optional): generator to draw the samples from
+            (global np.random generator if None)
+        :return (Tuple[Transition, torch.Tensor, np.ndarray]): batch of experiences, importance
+            sampling weights of shape (batch_size, 1) and indices of the sampled transitions
+            (to update their priorities with)
+        """
+        indices = self.sample_indices(batch_size, random_state)
+        batch = self._gather(indices, device, out)
+
+        total = self.sum_tree.reduce()
+        max_weight = (len(self) * self.min_tree.reduce() / total) ** (-self.beta)
+        weights = (len(self) * self.sum_tree[indices] / total) ** (-self.beta) / max_weight
+        weights = torch.from_numpy(weights.astype(np.float32)).unsqueeze(1).to(device)
+        return batch, weights, indices
+
+    @_locked
+    def sample(
+        self,
+        batch_size: int,
+        device: str = "cpu",
+        out: Optional[BatchBuffer] = None,
+        random_state: Optional[np.random.RandomState] = None,
+    ) -> Transition:
+        """Samples a prioritised batch of experiences (without importance sampling weights)
+
+        :param batch_size (int): size of the batch to be sampled and returned
+        :param device (str): PyTorch device to cast to (for potential GPU support)
+        :param out (BatchBuffer, optional): preallocated buffer to gather the batch into (see
+            ReplayBuffer.sample)
+        :param random_state (np.random.RandomState, optional): generator to draw the samples from
+            (global np.random generator if None)
+        :return (Transition): batch of experiences of given batch size
+        """
+        return self.sample_weighted(batch_size, device, out, random_state)[0]
+
+    @_locked
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray):
+        """Updates the priorities of sampled transitions
+
+        :param indices (np.ndarray): indices of the transitions as returned by sample_weighted
+        :param td_errors (np.ndarray): absolute TD errors of the transitions
+        """
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)).reshape(-1) + self.eps
+        # duplicates in a batch keep the last priority given to them
+        indices, last = np.unique(np.asarray(indices)[::-1], return_index=True)
+        priorities = priorities[::-1][last]
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.sum_tree.update(indices, priorities ** self.alpha)
+        self.min_tree.update(indices, priorities ** self.alpha)
+
+
+class DedupReplayBuffer(ReplayBuffer):
+    """Replay buffer storing every observation only once
+
+    Within an episode, the next state of a transition is the state of the following transition.
+    This buffer therefore stores observations in a single ring and rebuilds next states at sample
+    time from the following slot. Transitions whose next state is not the state of the following
+    transition (e.g. at the end of episodes) are flagged as episode boundaries, and only their
+    next states are stored separately.
+
+    A pushed transition continues the previous one if its state equals the previous next state.
+
+    :attr memory (Transition): as for ReplayBuffer, but without next states (None)
+    :attr boundaries (np.ndarray): flags of transitions whose next state is stored separately
+    """
+
+    def __init__(self, capacity: int, dtypes: Optional[Dict[str, str]] = None, **kwargs):
+        """Constructor for a DedupReplayBuffer initialising an empty buffer
+
+        :param capacity (int): total capacity of the replay buffer
+        :param dtypes (Dict[str, str], optional): compact storage dtypes of transition components
+            (see ReplayBuffer). Next states are stored with the dtype of states
+        :param **kwargs: further arguments of ReplayBuffer (max_bytes, initial_size)
+        """
+        super().__init__(capacity, dtypes=dtypes, **kwargs)
+        self.boundaries = None
+        self._boundary_next_states = {}
+        self._pending_next_state = None
+
+    def init_memory(self, transition: Transition):
+        """Initialises the memory with zero-entries
+
+        :param transition (Transition): transition(s) to take the dimensionalities from
+        """
+        for t in transition:
+            assert t.ndim == 1  # sanity check
+
+        dtypes = self._storage_dtypes(transition)
+        self._apply_byte_budget(
+            sum(
+                t.size * dtype.itemsize
+                for name, t, dtype in zip(Transition._fields, transition, dtypes)
+                if name != "next_states"
+            )
+        )
+        rows = min(self.capacity, self.initial_size)
+        self.memory = Transition(
+            *[
+                None if name == "next_states" else np.zeros([rows, t.size], dtype=dtype)
+                for name, t, dtype in zip(Transition._fields, transition, dtypes)
+            ]
+        )
+        self.boundaries = np.zeros(self.capacity, dtype=bool)
+
+    def save_state(self, directory: str):
+        super().save_state(directory)
+        if self.boundaries is None:
+            return
+        np.save(os.path.join(directory, "boundaries.npy"), self.boundaries)
+        positions = np.array(sorted(self._boundary_next_states), dtype=np.int64)
+        next_states = np.array(
+            [self._boundary_next_states[i] for i in positions], dtype=self.memory.states.dtype
+        ).reshape(len(positions), self.memory.states.shape[1])
+        np.save(os.path.join(directory, "boundary_positions.npy"), positions)
+        np.save(os.path.join(directory, "boundary_next_states.npy"), next_states)
+        # no file if no transition is waiting for its next state yet
+        pending_path = os.path.join(directory, "pending_next_state.npy")
+        if self._pending_next_state is not None:
+            np.save(pending_path, self._pending_next_state)
+        elif os.path.exists(pending_path):
+            os.remove(pending_path)
+
+    def load_state(self, directory: str):
+        super().load_state(directory)
+        if self.memory is None:
+            self.boundaries = None
+            self._boundary_next_states = {}
+            self._pending_next_state = None
+            return
+        self.boundaries = np.load(os.path.join(directory, "boundaries.npy"))
+        positions = np.load(os.path.join(directory, "boundary_positions.npy"))
+        next_states = np.load(os.path.join(directory, "boundary_next_states.npy"))
+        self._boundary_next_states = dict(zip(positions.tolist(), next_states))
+        pending_path = os.path.join(directory, "pending_next_state.npy")
+        self._pending_next_state = np.load(pending_path) if os.path.exists(pending_path) else None
+
+    @_locked
+    def push(self, *args):
+        """Adds transitions to the memory
+
+        Note:
+            overwrites first transitions stored once the capacity limit is reached
+
+        :param *args: arguments to create transition from
+        """
+        transition = Transition(*args)
+        if not self.memory:
+            self.init_memory(transition)
+
+        position = self.writes % self.capacity
+        if self.writes > 0:
+            previous = (self.writes - 1) % self.capacity
+            state = np.asarray(transition.states, dtype=self.memory.states.dtype)
+            if np.array_equal(state, self._pending_next_state):
+                self.boundaries[previous] = False
+            else:
+                self._boundary_next_states[previous] = self._pending_next_state
+
+        self._reserve(position + 1)
+        self._boundary_next_states.pop(position, None)
+        for i, data in enumerate(transition):
+            if data is not None and self.memory[i] is not None:
+                self.memory[i][position, :] = data
+        # the next state of the latest transition is only known to be stored once the next
+        # transition is pushed
+        self.boundaries[position] = True
+        self._pending_next_state = np.array(transition.next_states, dtype=self.memory.states.dtype)
+
+        self.writes = self.writes + 1
+
+    @_locked
+    def push_batch(self, *args) -> np.ndarray:
+        """Adds a batch of transitions to the memory
+
+        Transitions are pushed one by one, since each of them has to be checked for whether it
+        continues the previous one.
+
+        :param *args: arguments to create transitions from (see ReplayBuffer.push_batch)
+        :return (np.ndarray): positions the transitions were written to
+        """
+        positions = (self.writes + np.arange(len(args[0]))) % self.capacity
+        for transition in zip(*args):
+            self.push(*transition)
+        return positions
+
+    def _layout(self) -> List[Tuple[int, np.dtype, bool]]:
+        states = self.memory.states
+        return [
+            (states.shape[1], states.dtype, "states" in self.dtypes)
+            if d is None
+            else (d.shape[1], d.dtype, name in self.dtypes)
+            for name, d in zip(Transition._fields, self.memory)
+        ]
+
+    @_locked
+    def sample(
+        self,
+        batch_size: int,
+        device: str = "cpu",
+        out: Optional[BatchBuffer] = None,
+        random_state: Optional[np.random.RandomState] = None,
+    ) -> Transition:
+        """Samples batch of experiences from the replay buffer
+
+        :param batch_size (int): size of the batch to be sampled and returned
+        :param device (str): PyTorch device to cast to (for potential GPU support)
+        :param out (BatchBuffer, optional): preallocated buffer to gather the batch into (see
+            ReplayBuffer.sample)
+        :param random_state (np.random.RandomState, optional): generator to draw the samples from
+            (global np.random generator if None)
+        :return (Transition): batch of experiences of given batch size
+        """
+        random_state = np.random if random_state is None else random_state
+        samples = random_state.randint(0, high=len(self), size=batch_size)
+
+        next_index = Transition._fields.index("next_states")
+        next_states = None if out is None else out.arrays[next_index]
+        next_states = np.take(
+            self.memory.states, (samples + 1) % len(self.memory.states), axis=0, out=next_states
+        )
+        latest = (self.writes - 1) % self.capacity
+        for i in np.flatnonzero(self.boundaries[samples]):
+            sample = samples[i]
+            if sample == latest:
+                next_states[i] = self._pending_next_state
+            else:
+                next_states[i] = self._boundary_next_states[sample]
+
+        if out is not None:
+            for d, array in zip(self.memory, out.arrays):
+                if d is not None:
+                    np.take(d, samples, axis=0, out=array)
+            return out.batch(device)
 
         batch = Transition(
             *[
-                torch.from_numpy(np.take(d, samples, axis=0)).to(device)
-                for d in self.memory
+                self._to_tensor("states", next_states, device)
+                if d is None
+                else self._to_tensor(name, np.take(d, samples, axis=0), device)
+                for name, d in zip(Transition._fields, self.memory)
             ]
         )
         return batch
 
-    def __len__(self):
-        """Gives the length of the buffer
+
+class SharedReplayBuffer(ReplayBuffer):
+    """Replay buffer held in shared memory blocks so that several processes can push to and sample
+    from it
+
+    The memory is allocated to full capacity when the buffer is created (shared memory is only
+    backed by physical pages once written), so the dimensionalities of transitions have to be
+    given upfront. The write counter is shared as well and pushes and samples hold a lock shared
+    by all processes, so a batch never mixes fields of a transition and the one overwriting it.
+    Other processes attach to the buffer with `SharedReplayBuffer(**buffer.handle)`.
+
+    :attr handle (Dict): arguments to attach to the buffer from another process
+    """
+
+    _counter = None
+
+    def __init__(
+        self,
+        capacity: int,
+        transition: Transition,
+        dtypes: Optional[Dict[str, str]] = None,
+        names: Optional[List[str]] = None,
+        lock=None,
+    ):
+        """Constructor for a SharedReplayBuffer creating new shared memory blocks or attaching to
+        existing ones
+
+        :param capacity (int): total capacity of the replay buffer
+        :param transition (Transition): transition to take the dimensionalities and dtypes from
+        :param dtypes (Dict[str, str], optional): compact storage dtypes of transition components
+            (see ReplayBuffer)
+        :param names (List[str], optional): names of existing blocks to attach to (creates new
+            blocks if None)
+        :param lock (multiprocessing.RLock, optional): lock shared by all processes pushing to
+            the buffer (created if None)
         """
-        return min(self.writes, self.capacity)
+        super().__init__(capacity, dtypes=dtypes)
+        for t in transition:
+            assert t.ndim == 1  # sanity check
+        self._owner = names is None
+        if names is None:
+            names = [None] * (len(Transition._fields) + 1)
+
+        counter = shared_memory.SharedMemory(
+            name=names[0], create=self._owner, size=np.dtype(np.int64).itemsize
+        )
+        self._shms = [counter]
+        memory = []
+        for t, dtype, name in zip(transition, self._storage_dtypes(transition), names[1:]):
+            shm = shared_memory.SharedMemory(
+                name=name, create=self._owner, size=self.capacity * t.size * dtype.itemsize
+            )
+            self._shms.append(shm)
+            memory.append(np.ndarray((self.capacity, t.size), dtype=dtype, buffer=shm.buf))
+        self.memory = Transition(*memory)
+        self._counter = np.ndarray((1,), dtype=np.int64, buffer=counter.buf)
+        if self._owner:
+            self._counter[0] = 0
+
+        self.lock = lock if lock is not None else mp.RLock()
+        self.handle = {
+            "capacity": self.capacity,
+            "transition": Transition(*[np.zeros_like(t) for t in transition]),
+            "dtypes": self.dtypes,
+            "names": [shm.name for shm in self._shms],
+            "lock": self.lock,
+        }
+
+    @property
+    def writes(self) -> int:
+        """Number of experiences/ transitions already added to the buffer by all processes
+        """
+        return 0 if self._counter is None else int(self._counter[0])
+
+    @writes.setter
+    def writes(self, value: int):
+        if self._counter is not None:
+            self._counter[0] = value
+
+    def close(self):
+        """Detaches this process from the shared memory blocks (and frees them if they were
+        created by this process)
+        """
+        self.memory = self._counter = None
+        for shm in self._shms:
+            shm.close()
+            if self._owner:
+                shm.unlink()
+
+
+class PrefetchSampler:
+    """Samples batches from a replay buffer ahead of time on a background thread
+
+    The thread draws indices and gathers the next `prefetch` batches into their own preallocated
+    BatchBuffers while the learner computes updates on the current batch. NumPy gathers and PyTorch
+    operations release the GIL, so sampling overlaps with the computation of updates. The replay
+    buffer is given a lock, so transitions are never pushed while a batch is gathered.
+
+    Prefetched batches may miss the latest transitions (and priorities). Batches sampled before
+    more than `max_staleness` transitions were pushed are discarded and sampled again.
+
+    The thread draws from its own generator, so the global np.random generator used by the
+    training loop is not advanced by the thread at unpredictable times. Which transitions a batch
+    can contain still depends on how many were pushed when it was sampled.
+
+    Note:
+        a batch returned by sample() is overwritten once the following batch is requested
+
+    :attr replay_buffer (ReplayBuffer): buffer to sample batches from
+    :attr batch_size (int): number of transitions per batch
+    :attr prefetch (int): number of batches sampled ahead
+    :attr max_staleness (int): maximum number of transitions pushed since a returned batch was
+        sampled (None for no limit)
+    """
+
+    def __init__(
+        self,
+        replay_buffer: ReplayBuffer,
+        batch_size: int,
+        prefetch: int = 2,
+        max_staleness: Optional[int] = None,
+        device: str = "cpu",
+        seed: Optional[int] = None,
+    ):
+        """Constructor of PrefetchSampler
+
+        The background thread is started by the first call to sample(), so the sampler can be
+        created before the buffer holds any transitions.
+
+        :param replay_buffer (ReplayBuffer): buffer to sample batches from
+        :param batch_size (int): number of transitions per batch
+        :param prefetch (int): number of batches sampled ahead
+        :param max_staleness (int, optional): maximum number of transitions pushed since a
+            returned batch was sampled (None for no limit)
+        :param device (str): PyTorch device to cast to (for potential GPU support)
+        :param seed (int, optional): seed of the generator batches are sampled with (drawn from
+            np.random if None)
+        """
+        assert prefetch >= 1, "At least one batch has to be sampled ahead"
+        self.replay_buffer = replay_buffer
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.max_staleness = max_staleness
+        self.device = device
+        if seed is None:
+            seed = np.random.randint(2**31 - 1)
+        self._random_state = np.random.RandomState(seed)
+        if replay_buffer.lock is None:
+            replay_buffer.lock = threading.RLock()
+
+        self._free = queue.Queue()
+        self._ready = queue.Queue()
+        self._in_use = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _start(self):
+        """Allocates the BatchBuffers and starts the background thread
+        """
+        pin_memory = self.device != "cpu" and torch.cuda.is_available()
+        layout = self.replay_buffer._layout()
+        # one buffer is held by the learner while the others are filled
+        for _ in range(self.prefetch + 1):
+            self._free.put(BatchBuffer(layout, self.batch_size, pin_memory))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """Fills free BatchBuffers with sampled batches until the sampler is closed
+        """
+        buffer = self.replay_buffer
+        try:
+            while not self._stop.is_set():
+                out = self._free.get()
+                if out is None:
+                    return
+                with buffer.lock:
+                    writes = buffer.writes
+                    if isinstance(buffer, PrioritizedReplayBuffer):
+                        sample = buffer.sample_weighted(
+                            self.batch_size, self.device, out=out, random_state=self._random_state
+                        )
+                    else:
+                        batch = buffer.sample(
+                            self.batch_size, self.device, out=out, random_state=self._random_state
+                        )
+                        sample = (batch, None, None)
+                self._ready.put((writes, out, sample))
+        except Exception as e:
+            self._ready.put((None, None, e))
+
+    def sample(self) -> Tuple[Transition, Optional[torch.Tensor], Optional[np.ndarray]]:
+        """Gives the next prefetched batch
+
+        :return (Tuple[Transition, Optional[torch.Tensor], Optional[np.ndarray]]): batch of
+            experiences, importance sampling weights and indices of the sampled transitions
+            (weights and indices are None unless sampling from a PrioritizedReplayBuffer)
+        """
+        if self._thread is None:
+            self._start()
+        if self._in_use is not None:
+            self._free.put(self._in_use)
+            self._in_use = None
+
+        while True:
+            writes, out, sample = self._ready.get()
+            if out is None:
+                raise RuntimeError("Prefetching replay batches failed") from sample
+            staleness = self.replay_buffer.writes - writes
+            if self.max_staleness is None or staleness <= self.max_staleness:
+                break
+            self._free.put(out)
+        self._in_use = out
+        return sample
+
+    def close(self):
+        """Stops the background thread
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._free.put(None)
+            self._thread.join()
+            self._thread = None
+            self._free, self._ready = queue.Queue(), queue.Queue()
+            self._in_use = None
+            self._stop.clear()
+
+
+def make_replay_buffer(config) -> ReplayBuffer:
+    """Creates the replay buffer configured for a training run
+
+    :param config: configuration dictionary mapping configuration keys to values
+    :return (ReplayBuffer): created (empty) replay buffer
+    """
+    if config["prioritized_replay"] and config["dedup_observations"]:
+        raise ValueError("Observation de-duplication does not support prioritized replay")
+    if config["prioritized_replay"]:
+        return PrioritizedReplayBuffer(
+            config["buffer_capacity"],
+            alpha=config["priority_alpha"],
+            beta=config["priority_beta"],
+            storage_dir=config["buffer_dir"],
+            dtypes=config["buffer_dtypes"],
+            max_bytes=config["buffer_max_bytes"],
+        )
+    if config["dedup_observations"]:
+        if config["buffer_dir"] is not None:
+            raise ValueError("Observation de-duplication does not support memory-mapped buffers")
+        return DedupReplayBuffer(
+            config["buffer_capacity"],
+            dtypes=config["buffer_dtypes"],
+            max_bytes=config["buffer_max_bytes"],
+        )
+    return ReplayBuffer(
+        config["buffer_capacity"],
+        storage_dir=config["buffer_dir"],
+        dtypes=config["buffer_dtypes"],
+        max_bytes=config["buffer_max_bytes"],
+    )
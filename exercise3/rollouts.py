@@ -0,0 +1,182 @@
+"""
+Parallel on-policy episode collection
+
+Rollout workers hold a copy of the policy, which they refresh from SharedWeights before each
+collection, and play episodes on their own environments, seeded from the configured seed. The collected episodes are sent
+back to the learner as compact NumPy arrays, so the learner can use all of them for one batched
+policy gradient step.
+"""
+import multiprocessing as mp
+import random
+from typing import List, Tuple
+
+import gym
+import numpy as np
+import torch
+
+from rl2022 import rng
+from rl2022.exercise3.networks import SharedWeights
+from rl2022.telemetry import NULL_TELEMETRY
+
+Episode = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def collect_episode(
+    env: gym.Env,
+    agent,
+    explore: bool = True,
+    render: bool = False,
+    max_steps: int = 200,
+    telemetry=NULL_TELEMETRY,
+) -> Episode:
+    """
+    Plays one episode and returns its rewards, observations and actions
+
+    :param env (gym.Env): gym environment
+    :param agent (Agent): agent selecting the actions
+    :param explore (bool): flag whether exploration is used
+    :param render (bool): flag whether environment should be visualised
+    :param max_steps (int): max number of timesteps for the episode
+    :param telemetry (Telemetry): telemetry timing action selection and environment steps
+    :return (Episode): rewards (float32), observations (float32) and actions (int64) of the
+        episode (from first to last)
+    """
+    obs = env.reset()
+
+    if render:
+        env.render()
+
+    done = False
+    observations = []
+    actions = []
+    rewards = []
+
+    while not done and len(rewards) < max_steps:
+        t = telemetry.now()
+        action = agent.act(np.array(obs), explore=explore)
+        t = telemetry.lap("act", t)
+        nobs, rew, done, _ = env.step(action)
+        telemetry.lap("env", t)
+
+        observations.append(obs)
+        actions.append(action)
+        rewards.append(rew)
+
+        if render:
+            env.render()
+
+        obs = nobs
+
+    return (
+        np.array(rewards, dtype=np.float32),
+        np.array(observations, dtype=np.float32).reshape(len(rewards), -1),
+        np.array(actions, dtype=np.int64),
+    )
+
+
+def run_worker(agent_cls, network_attr, config, seed, weights_name, conn):
+    """
+    Collects episodes in a worker process whenever the learner requests them
+
+    The learner sends the number of episodes to collect (or None to stop the worker) and
+    receives the list of collected episodes.
+
+    :param agent_cls (type): agent class to act with (created from the environment's spaces and
+        the configuration)
+    :param network_attr (str): name of the agent's network used by act() to which the published
+        parameters are loaded
+    :param config: configuration dictionary mapping configuration keys to values
+    :param seed (int): seed of the worker's environment and random number generators
+    :param weights_name (str): name of the shared memory block of the published parameters
+    :param conn (mp.connection.Connection): worker's end of the pipe to the learner
+    """
+    torch.set_num_threads(1)
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    rng.seed(seed)
+    env = gym.make(config["env"])
+    env.seed(seed)
+
+    agent = agent_cls(
+        action_space=env.action_space, observation_space=env.observation_space, **config
+    )
+    network = getattr(agent, network_attr)
+    weights = SharedWeights(network, name=weights_name)
+    version = -1
+
+    while True:
+        num_episodes = conn.recv()
+        if num_episodes is None:
+            break
+        version = weights.load(network, version)
+        conn.send([
+            collect_episode(env, agent, explore=True, max_steps=config["episode_length"])
+            for _ in range(num_episodes)
+        ])
+
+    conn.close()
+    weights.close()
+    env.close()
+
+
+class RolloutWorkers:
+    """Pool of processes collecting episodes with the latest published policy
+
+    :attr weights (SharedWeights): parameters published by the learner and loaded by the workers
+    :attr episodes_per_worker (int): number of episodes each worker collects per call to collect()
+    """
+
+    def __init__(self, agent_cls, network_attr: str, network: torch.nn.Module, config):
+        """
+        Starts config["num_workers"] rollout worker processes
+
+        Worker i is seeded with config["seed"] + i (with a seed drawn from `np.random` if
+        config["seed"] is None).
+
+        :param agent_cls (type): agent class to act with
+        :param network_attr (str): name of the agent's network used by act()
+        :param network (torch.nn.Module): learner's network whose parameters are published
+        :param config: configuration dictionary mapping configuration keys to values
+        """
+        self.weights = SharedWeights(network)
+        self.episodes_per_worker = config["episodes_per_worker"]
+        self._conns = []
+        self._workers = []
+        seed = config["seed"] if config["seed"] is not None else np.random.randint(2**31 - 1)
+        for i in range(config["num_workers"]):
+            conn, worker_conn = mp.Pipe()
+            worker = mp.Process(
+                target=run_worker,
+                args=(agent_cls, network_attr, config, seed + i, self.weights.name, worker_conn),
+                daemon=True,
+            )
+            worker.start()
+            worker_conn.close()
+            self._conns.append(conn)
+            self._workers.append(worker)
+
+    def collect(self, network: torch.nn.Module) -> List[Episode]:
+        """Publishes the parameters of the network and collects episodes with them on all workers
+
+        :param network (torch.nn.Module): learner's network
+        :return (List[Episode]): episodes collected by all workers (see collect_episode)
+        """
+        self.weights.publish(network)
+        for conn in self._conns:
+            conn.send(self.episodes_per_worker)
+        episodes = []
+        for conn in self._conns:
+            episodes.extend(conn.recv())
+        return episodes
+
+    def close(self):
+        """Stops all workers and releases the shared parameters
+        """
+        for conn in self._conns:
+            conn.send(None)
+        for worker in self._workers:
+            worker.join()
+        for conn in self._conns:
+            conn.close()
+        self.weights.close()
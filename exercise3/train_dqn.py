@@ -1,3 +1,4 @@
+import functools
 import gym
 import numpy as np
 import time
@@ -7,8 +8,18 @@ import matplotlib.pyplot as plt
 
 from rl2022.constants import EX3_DQN_CARTPOLE_CONSTANTS as CARTPOLE_CONSTANTS
 from rl2022.constants import EX3_LUNARLANDER_CONSTANTS as LUNARLANDER_CONSTANTS
+from rl2022.exercise3.actor_learner import train_actor_learner
 from rl2022.exercise3.agents import DQN
-from rl2022.exercise3.replay import ReplayBuffer
+from rl2022.exercise3.checkpoint import (
+    has_run_state, load_run_state, make_checkpointer, save_run_state
+)
+from rl2022.exercise3.evaluator import make_evaluator
+from rl2022.exercise3.export import export_policy
+from rl2022.exercise3.off_policy import evaluate, play_episode, record_evaluations, update_agent
+from rl2022.exercise3.replay import PrefetchSampler, make_replay_buffer
+from rl2022.schedules import LinearSchedule
+from rl2022.profiling import make_profiler
+from rl2022.telemetry import make_telemetry
 
 RENDER = False # FALSE FOR FASTER TRAINING / TRUE TO VISUALIZE ENVIRONMENT DURING EVALUATION
 
@@ -21,6 +32,33 @@ LUNARLANDER_CONFIG = {
     "batch_size": 16,
     "buffer_capacity": int(1e6),
     "plot_loss": False,
+    "epsilon_schedule": None, # NONE DECAYS EPSILON BY A CONSTANT FACTOR EVERY EPISODE
+    "prioritized_replay": False,
+    "priority_alpha": 0.6,
+    "priority_beta": 0.4,
+    "buffer_dir": None, # DIRECTORY TO MEMORY-MAP THE REPLAY BUFFER TO (NONE KEEPS IT IN RAM)
+    "dedup_observations": False, # STORE EACH OBSERVATION ONCE INSTEAD OF AS STATE AND NEXT STATE
+    "buffer_dtypes": {"actions": "int16", "done": "uint8"}, # ADD "states"/"next_states": "float16" TO HALVE OBSERVATION MEMORY
+    "buffer_max_bytes": None, # MEMORY BUDGET OF THE REPLAY BUFFER IN BYTES (REDUCES THE CAPACITY TO FIT)
+    "prefetch_batches": 0, # NUMBER OF BATCHES SAMPLED AHEAD ON A BACKGROUND THREAD (0 DISABLES PREFETCHING)
+    "prefetch_staleness": None, # MAXIMUM NUMBER OF TRANSITIONS PUSHED SINCE A PREFETCHED BATCH WAS SAMPLED (NONE FOR NO LIMIT)
+    "train_freq": 1, # NUMBER OF COLLECTED TRANSITIONS BETWEEN UPDATE PHASES
+    "gradient_steps": 1, # NUMBER OF UPDATES PER UPDATE PHASE (THEIR BATCHES ARE SAMPLED IN ONE CALL)
+    "num_envs": 1, # NUMBER OF VECTORISED ENVIRONMENTS TO COLLECT EXPERIENCE FROM (SEE train_vectorized)
+    "async_envs": False, # STEP VECTORISED ENVIRONMENTS IN SUBPROCESSES INSTEAD OF SEQUENTIALLY
+    "num_actors": 0, # NUMBER OF ACTOR PROCESSES FEEDING A LEARNER PROCESS (SEE train_async, 0 DISABLES)
+    "weight_publish_freq": 100, # NUMBER OF LEARNER UPDATES BETWEEN PUBLISHING PARAMETERS TO THE ACTORS
+    "max_actor_lead": 1000, # MAXIMUM NUMBER OF TRANSITIONS THE ACTORS MAY COLLECT AHEAD OF LEARNER UPDATES
+    "export_filename": None, # FILE TO EXPORT THE GREEDY POLICY TO AS TORCHSCRIPT (SEE exercise3/export.py)
+    "async_eval": False, # EVALUATE IN A SEPARATE PROCESS WHILE TRAINING CONTINUES (RESULTS ARRIVE LATER)
+    "telemetry_file": None, # JSONL FILE TO APPEND TIMINGS OF THE TRAINING LOOP TO (NONE DISABLES TELEMETRY)
+    "telemetry_window": 10000, # NUMBER OF TIMESTEPS AGGREGATED INTO EACH TELEMETRY RECORD
+    "profile": None, # WINDOW OF TIMESTEPS TO PROFILE, E.G. {"start": 10000, "stop": 11000, "backend": "cprofile"} (SEE profiling.py)
+    "checkpoint_dir": None, # DIRECTORY TO WRITE PERIODIC CHECKPOINTS TO (NONE DISABLES CHECKPOINTING)
+    "checkpoint_freq": 50000, # NUMBER OF TIMESTEPS BETWEEN CHECKPOINTS
+    "checkpoint_keep": 3, # NUMBER OF MOST RECENT CHECKPOINTS TO KEEP
+    "run_state_dir": None, # DIRECTORY TO SAVE THE RESUMABLE RUN STATE TO (TRAINING RESUMES FROM A STATE FOUND THERE)
+    "run_state_freq": 100000, # NUMBER OF TIMESTEPS BETWEEN SAVING THE RUN STATE
 }
 LUNARLANDER_CONFIG.update(LUNARLANDER_CONSTANTS)
 
@@ -33,6 +71,33 @@ CARTPOLE_CONFIG = {
     "batch_size": 16,
     "buffer_capacity": int(1e6),
     "plot_loss": True, # SET TRUE FOR 3.3 (Understanding the Loss)
+    "epsilon_schedule": None,
+    "prioritized_replay": False,
+    "priority_alpha": 0.6,
+    "priority_beta": 0.4,
+    "buffer_dir": None,
+    "dedup_observations": False,
+    "buffer_dtypes": {"actions": "int16", "done": "uint8"},
+    "buffer_max_bytes": None,
+    "prefetch_batches": 0,
+    "prefetch_staleness": None,
+    "train_freq": 1,
+    "gradient_steps": 1,
+    "num_envs": 1,
+    "async_envs": False,
+    "num_actors": 0,
+    "weight_publish_freq": 100,
+    "max_actor_lead": 1000,
+    "export_filename": None,
+    "async_eval": False,
+    "telemetry_file": None,
+    "telemetry_window": 10000,
+    "profile": None,
+    "checkpoint_dir": None,
+    "checkpoint_freq": 50000,
+    "checkpoint_keep": 3,
+    "run_state_dir": None,
+    "run_state_freq": 100000,
 }
 CARTPOLE_CONFIG.update(CARTPOLE_CONSTANTS)
 
@@ -41,52 +106,22 @@ CARTPOLE_CONFIG.update(CARTPOLE_CONSTANTS)
 CONFIG = LUNARLANDER_CONFIG
 
 
-def play_episode(
-    env,
-    agent,
-    replay_buffer,
-    train=True,
-    explore=True,
-    render=False,
-    max_steps=200,
-    batch_size=64,
-):
-    obs = env.reset()
-    done = False
-    losses = []
-    if render:
-        env.render()
-
-    episode_timesteps = 0
-    episode_return = 0
-
-    while not done:
-        action = agent.act(obs, explore=explore)
-        nobs, reward, done, _ = env.step(action)
-        if train:
-            replay_buffer.push(
-                np.array(obs, dtype=np.float32),
-                np.array([action], dtype=np.float32),
-                np.array(nobs, dtype=np.float32),
-                np.array([reward], dtype=np.float32),
-                np.array([done], dtype=np.float32),
-            )
-            if len(replay_buffer) >= batch_size:
-                batch = replay_buffer.sample(batch_size)
-                loss = agent.update(batch)["q_loss"]
-                losses.append(loss)
-
-        episode_timesteps += 1
-        episode_return += reward
-
-        if render:
-            env.render()
+def plot_loss(losses_all: List[float], config):
+    """Plots the DQN loss of every update during training
 
-        if max_steps == episode_timesteps:
-            break
-        obs = nobs
+    :param losses_all (List[float]): loss of every update
+    :param config: configuration dictionary mapping configuration keys to values
+    """
+    losses = np.array(losses_all)
+    x_values = config["batch_size"] + np.arange(len(losses))
+    plt.plot(x_values, losses, "-", alpha=0.7)
+    plt.xlabel("Timesteps", fontsize=30)
+    plt.ylabel("DQN Loss", fontsize=30)
+    plt.xticks(fontsize=25)
+    plt.yticks(fontsize=25)
+    plt.tight_layout(pad=0.3)
 
-    return episode_timesteps, episode_return, losses
+    plt.show()
 
 
 def train(env: gym.Env, config, output: bool = True) -> Tuple[List[float], List[float]]:
@@ -103,20 +138,46 @@ def train(env: gym.Env, config, output: bool = True) -> Tuple[List[float], List[
     agent = DQN(
         action_space=env.action_space, observation_space=env.observation_space, **config
     )
-    replay_buffer = ReplayBuffer(config["buffer_capacity"])
+    replay_buffer = make_replay_buffer(config)
+    # anneal the importance sampling correction to full correction at the end of training
+    beta_schedule = LinearSchedule(config["priority_beta"], 1.0, 1.0)
 
     eval_returns_all = []
     eval_times_all = []
-
-    start_time = time.time()
     losses_all = []
-    with tqdm(total=config["max_timesteps"]) as pbar:
+    elapsed_seconds = 0.0
+    if has_run_state(config["run_state_dir"]):
+        progress = load_run_state(config["run_state_dir"], agent, replay_buffer, env)
+        timesteps_elapsed = progress["timesteps_elapsed"]
+        eval_returns_all = progress["eval_returns"]
+        eval_times_all = progress["eval_times"]
+        losses_all = progress["losses"].tolist()
+        elapsed_seconds = progress["elapsed_seconds"]
+        print(f"Resuming training at timestep {timesteps_elapsed}")
+
+    sampler = None
+    if config["prefetch_batches"]:
+        sampler = PrefetchSampler(
+            replay_buffer,
+            config["batch_size"],
+            prefetch=config["prefetch_batches"],
+            max_staleness=config["prefetch_staleness"],
+        )
+    checkpointer = make_checkpointer(config)
+    telemetry = make_telemetry(config)
+    profiler = make_profiler(config["profile"], f"dqn_{config['env']}", timesteps_elapsed)
+    evaluator = make_evaluator(DQN, "critics_net", evaluate, config)
+
+    start_time = time.time() - elapsed_seconds
+    with tqdm(total=config["max_timesteps"], initial=timesteps_elapsed) as pbar:
         while timesteps_elapsed < config["max_timesteps"]:
             elapsed_seconds = time.time() - start_time
             if elapsed_seconds > config["max_time"]:
                 pbar.write(f"Training ended after {elapsed_seconds}s.")
                 break
             agent.schedule_hyperparameters(timesteps_elapsed, config["max_timesteps"])
+            if config["prioritized_replay"]:
+                replay_buffer.beta = beta_schedule(timesteps_elapsed, config["max_timesteps"])
             episode_timesteps, _, losses = play_episode(
                 env,
                 agent,
@@ -126,60 +187,283 @@ def train(env: gym.Env, config, output: bool = True) -> Tuple[List[float], List[
                 render=False,
                 max_steps=config["episode_length"],
                 batch_size=config["batch_size"],
+                sampler=sampler,
+                train_freq=config["train_freq"],
+                gradient_steps=config["gradient_steps"],
+                telemetry=telemetry,
             )
             timesteps_elapsed += episode_timesteps
             pbar.update(episode_timesteps)
             losses_all += losses
+            telemetry.step(timesteps_elapsed, episode_timesteps)
+            profiler.step(timesteps_elapsed)
+
+            if (
+                checkpointer is not None
+                and timesteps_elapsed % config["checkpoint_freq"] < episode_timesteps
+            ):
+                checkpointer.save(agent, timesteps_elapsed)
 
+            save_state = (
+                config["run_state_dir"]
+                and timesteps_elapsed % config["run_state_freq"] < episode_timesteps
+            )
+            eval_results = evaluator.poll() if evaluator is not None else []
             if timesteps_elapsed % config["eval_freq"] < episode_timesteps:
-                eval_returns = 0
-                if config["env"] == "CartPole-v1":
-                    max_steps = config["episode_length"]
-                elif config["env"] == "LunarLander-v2":
-                    max_steps = config["episode_length"]
+                if evaluator is not None:
+                    evaluator.submit(timesteps_elapsed, agent)
                 else:
-                    raise ValueError(f"Unknown environment {config['env']}")
-
-                for _ in range(config["eval_episodes"]):
-                    _, episode_return, _ = play_episode(
-                        env,
-                        agent,
-                        replay_buffer,
-                        train=False,
-                        explore=False,
-                        render=RENDER,
-                        max_steps=max_steps,
-                        batch_size=config["batch_size"],
-                    )
-                    eval_returns += episode_return / config["eval_episodes"]
+                    eval_returns = evaluate(env, agent, replay_buffer, config, render=RENDER)
+                    eval_results.append((timesteps_elapsed, eval_returns, time.time()))
                 if output:
-                    pbar.write(
-                        f"Evaluation at timestep {timesteps_elapsed} returned a mean returns of {eval_returns}"
+                    pbar.write(f"Epsilon = {agent.epsilon}")
+            if save_state and evaluator is not None:
+                # results still pending in the evaluator would be lost when resuming
+                eval_results += evaluator.wait()
+            record_evaluations(
+                eval_results, eval_returns_all, eval_times_all, start_time, pbar, output
+            )
+
+            if save_state:
+                save_run_state(
+                    config["run_state_dir"],
+                    agent,
+                    replay_buffer,
+                    env,
+                    {
+                        "timesteps_elapsed": timesteps_elapsed,
+                        "eval_returns": eval_returns_all,
+                        "eval_times": eval_times_all,
+                        "losses": np.array(losses_all, dtype=np.float32),
+                        "elapsed_seconds": time.time() - start_time,
+                    },
+                )
+
+    if sampler is not None:
+        sampler.close()
+
+    if evaluator is not None:
+        record_evaluations(
+            evaluator.close(), eval_returns_all, eval_times_all, start_time, pbar, output
+        )
+
+    if checkpointer is not None:
+        checkpointer.close()
+    telemetry.close(timesteps_elapsed)
+    profiler.close(timesteps_elapsed)
+
+    if config["save_filename"]:
+        print("Saving to: ", agent.save(config["save_filename"]))
+
+    if config["export_filename"]:
+        print("Exporting policy to: ", export_policy(agent, config["export_filename"]))
+
+    if config["plot_loss"]:
+        plot_loss(losses_all, config)
+
+    return np.array(eval_returns_all), np.array(eval_times_all)
+
+
+def make_env(env_name: str, max_steps: int) -> gym.Env:
+    """Creates an environment whose episodes are truncated after a maximum number of steps
+
+    :param env_name (str): name of the gym environment
+    :param max_steps (int): maximum number of steps per episode
+    :return (gym.Env): created environment
+    """
+    return gym.wrappers.TimeLimit(gym.make(env_name), max_episode_steps=max_steps)
+
+
+def make_vector_env(config) -> gym.vector.VectorEnv:
+    """Creates the vectorised environments to collect experience from
+
+    :param config: configuration dictionary mapping configuration keys to values
+    :return (gym.vector.VectorEnv): config["num_envs"] copies of the environment, stepped in
+        subprocesses if config["async_envs"] is set
+    """
+    env_fns = [
+        functools.partial(make_env, config["env"], config["episode_length"])
+    ] * config["num_envs"]
+    if config["async_envs"]:
+        return gym.vector.AsyncVectorEnv(env_fns)
+    return gym.vector.SyncVectorEnv(env_fns)
+
+
+def train_vectorized(
+    env: gym.Env, config, output: bool = True
+) -> Tuple[List[float], List[float]]:
+    """
+    Execute training of DQN on vectorised copies of the environment
+
+    All environments are stepped at once with actions selected in a single forward pass and their
+    transitions are pushed to the replay buffer together. The agent is updated at the same ratio of
+    updates to collected transitions and hyperparameters are scheduled whenever an episode
+    finishes, as in train(). Finished environments are reset automatically. Transitions of
+    episodes truncated by the time limit are stored as non-terminal.
+
+    :param env (gym.Env): environment to evaluate on
+    :param config: configuration dictionary mapping configuration keys to values
+    :param output (bool): flag whether evaluation results should be printed
+    :return (Tuple[List[float], List[float]]): eval returns during training, times of evaluation
+    """
+    timesteps_elapsed = 0
+    num_envs = config["num_envs"]
+    envs = make_vector_env(config)
+
+    agent = DQN(
+        action_space=env.action_space, observation_space=env.observation_space, **config
+    )
+    replay_buffer = make_replay_buffer(config)
+    # anneal the importance sampling correction to full correction at the end of training
+    beta_schedule = LinearSchedule(config["priority_beta"], 1.0, 1.0)
+    sampler = None
+    if config["prefetch_batches"]:
+        sampler = PrefetchSampler(
+            replay_buffer,
+            config["batch_size"],
+            prefetch=config["prefetch_batches"],
+            max_staleness=config["prefetch_staleness"],
+        )
+
+    checkpointer = make_checkpointer(config)
+    telemetry = make_telemetry(config)
+    profiler = make_profiler(config["profile"], f"dqn_vectorized_{config['env']}")
+    evaluator = make_evaluator(DQN, "critics_net", evaluate, config)
+    eval_returns_all = []
+    eval_times_all = []
+
+    start_time = time.time()
+    losses_all = []
+    agent.schedule_hyperparameters(timesteps_elapsed, config["max_timesteps"])
+    obs = envs.reset()
+    with tqdm(total=config["max_timesteps"]) as pbar:
+        while timesteps_elapsed < config["max_timesteps"]:
+            elapsed_seconds = time.time() - start_time
+            if elapsed_seconds > config["max_time"]:
+                pbar.write(f"Training ended after {elapsed_seconds}s.")
+                break
+            if config["prioritized_replay"]:
+                replay_buffer.beta = beta_schedule(timesteps_elapsed, config["max_timesteps"])
+
+            t = telemetry.now()
+            actions = agent.act(obs, explore=True)
+            t = telemetry.lap("act", t)
+            nobs, rewards, dones, infos = envs.step(actions)
+            t = telemetry.lap("env", t)
+            # finished environments are already reset, their last observation is in their info
+            next_states = nobs.copy()
+            terminals = np.asarray(dones, dtype=np.float32)
+            finished = np.flatnonzero(dones)
+            for i in finished:
+                next_states[i] = infos[i]["terminal_observation"]
+                # episodes cut off by the time limit did not terminate, so their values are still
+                # bootstrapped from the last observation
+                if infos[i].get("TimeLimit.truncated", False):
+                    terminals[i] = 0.0
+            replay_buffer.push_batch(
+                np.asarray(obs, dtype=np.float32),
+                np.asarray(actions, dtype=np.float32).reshape(num_envs, 1),
+                np.asarray(next_states, dtype=np.float32),
+                np.asarray(rewards, dtype=np.float32).reshape(num_envs, 1),
+                terminals.reshape(num_envs, 1),
+            )
+            telemetry.lap("push", t)
+            obs = nobs
+
+            previous_timesteps = timesteps_elapsed
+            timesteps_elapsed += num_envs
+            pbar.update(num_envs)
+            telemetry.step(timesteps_elapsed, num_envs)
+            profiler.step(timesteps_elapsed)
+            for _ in finished:
+                agent.schedule_hyperparameters(timesteps_elapsed, config["max_timesteps"])
+
+            if len(replay_buffer) >= config["batch_size"]:
+                # one update phase per config["train_freq"] collected transitions keeps the
+                # update ratio of train()
+                writes = replay_buffer.writes
+                phases = writes // config["train_freq"] - (writes - num_envs) // config["train_freq"]
+                for _ in range(phases):
+                    infos = update_agent(
+                        agent, replay_buffer, config["batch_size"], sampler,
+                        config["gradient_steps"], telemetry,
                     )
+                    losses_all += [info["q_loss"] for info in infos]
+
+            if (
+                checkpointer is not None
+                and timesteps_elapsed // config["checkpoint_freq"]
+                > previous_timesteps // config["checkpoint_freq"]
+            ):
+                checkpointer.save(agent, timesteps_elapsed)
+
+            eval_results = evaluator.poll() if evaluator is not None else []
+            if timesteps_elapsed // config["eval_freq"] > previous_timesteps // config["eval_freq"]:
+                if evaluator is not None:
+                    evaluator.submit(timesteps_elapsed, agent)
+                else:
+                    eval_returns = evaluate(env, agent, replay_buffer, config, render=RENDER)
+                    eval_results.append((timesteps_elapsed, eval_returns, time.time()))
+                if output:
                     pbar.write(f"Epsilon = {agent.epsilon}")
-                eval_returns_all.append(eval_returns)
-                eval_times_all.append(time.time() - start_time)
-        
+            record_evaluations(
+                eval_results, eval_returns_all, eval_times_all, start_time, pbar, output
+            )
+
+    envs.close()
+    if sampler is not None:
+        sampler.close()
+
+    if evaluator is not None:
+        record_evaluations(
+            evaluator.close(), eval_returns_all, eval_times_all, start_time, pbar, output
+        )
+
+    if checkpointer is not None:
+        checkpointer.close()
+    telemetry.close(timesteps_elapsed)
+    profiler.close(timesteps_elapsed)
+
     if config["save_filename"]:
         print("Saving to: ", agent.save(config["save_filename"]))
 
+    if config["export_filename"]:
+        print("Exporting policy to: ", export_policy(agent, config["export_filename"]))
+
     if config["plot_loss"]:
-        print("Plotting DQN loss...")
-        losses = np.array(losses_all)
-        x_values = config["batch_size"] + np.arange(len(losses))
-        plt.plot(x_values, losses, "-", alpha=0.7)
-        plt.xlabel("Timesteps", fontsize=30)
-        plt.ylabel("DQN Loss", fontsize=30)
-        plt.xticks(fontsize=25)
-        plt.yticks(fontsize=25)
-        plt.tight_layout(pad=0.3)
-
-        plt.show()
+        plot_loss(losses_all, config)
 
     return np.array(eval_returns_all), np.array(eval_times_all)
 
 
+def train_async(env: gym.Env, config, output: bool = True) -> Tuple[List[float], List[float]]:
+    """
+    Execute training of DQN with asynchronous actor processes and a learner in this process
+
+    The actors act with their own copy of the Q-network (see train_actor_learner in
+    exercise3/actor_learner.py).
+
+    :param env (gym.Env): environment to evaluate on
+    :param config: configuration dictionary mapping configuration keys to values
+    :param output (bool): flag whether evaluation results should be printed
+    :return (Tuple[List[float], List[float]]): eval returns during training, times of evaluation
+    """
+    eval_returns_all, eval_times_all, losses_all = train_actor_learner(
+        env, config, DQN, "critics_net", output=output
+    )
+
+    if config["plot_loss"]:
+        plot_loss(losses_all, config)
+
+    return eval_returns_all, eval_times_all
+
+
 if __name__ == "__main__":
     env = gym.make(CONFIG["env"])
-    _ = train(env, CONFIG)
+    if CONFIG["num_actors"] > 0:
+        _ = train_async(env, CONFIG)
+    elif CONFIG["num_envs"] > 1:
+        _ = train_vectorized(env, CONFIG)
+    else:
+        _ = train(env, CONFIG)
     env.close()
@@ -6,6 +6,10 @@ from typing import List, Tuple
 
 from rl2022.constants import EX3_REINFORCE_CARTPOLE_CONSTANTS as CARTPOLE_CONSTANTS
 from rl2022.exercise3.agents import Reinforce
+from rl2022.exercise3.export import export_policy
+from rl2022.exercise3.rollouts import RolloutWorkers, collect_episode
+from rl2022.profiling import make_profiler
+from rl2022.telemetry import NULL_TELEMETRY, make_telemetry
 
 RENDER = False # FALSE FOR FASTER TRAINING / TRUE TO VISUALIZE ENVIRONMENT DURING EVALUATION
 
@@ -14,6 +18,15 @@ CARTPOLE_CONFIG = {
     "eval_episodes": 20,
     "hidden_size": (16, 16),
     "learning_rate": 1e-2,
+    "episodes_per_update": 1, # NUMBER OF EPISODES BATCHED INTO EACH GRADIENT STEP (MUST BE 1 WITH ROLLOUT WORKERS)
+    "normalize_returns": False, # NORMALISE RETURNS OVER THE EPISODES OF EACH GRADIENT STEP
+    "num_workers": 0, # ROLLOUT WORKER PROCESSES COLLECTING EPISODES (0 COLLECTS IN THE TRAINING PROCESS)
+    "episodes_per_worker": 1, # EPISODES COLLECTED BY EACH WORKER FOR EVERY GRADIENT STEP
+    "seed": None, # SEED OF THE ROLLOUT WORKERS (WORKER i USES seed + i, DRAWN FROM np.random IF NONE)
+    "telemetry_file": None, # JSONL FILE TO APPEND TIMINGS OF THE TRAINING LOOP TO (NONE DISABLES TELEMETRY)
+    "telemetry_window": 10000, # NUMBER OF TIMESTEPS AGGREGATED INTO EACH TELEMETRY RECORD
+    "profile": None, # WINDOW OF TIMESTEPS TO PROFILE, E.G. {"start": 10000, "stop": 11000, "backend": "cprofile"} (SEE profiling.py)
+    "export_filename": None, # FILE TO EXPORT THE GREEDY POLICY TO AS TORCHSCRIPT (SEE exercise3/export.py)
 }
 CARTPOLE_CONFIG.update(CARTPOLE_CONSTANTS)
 
@@ -28,6 +41,7 @@ def play_episode(
     explore=True,
     render=False,
     max_steps=200,
+    telemetry=NULL_TELEMETRY,
 ) -> Tuple[int, float]:
     """
     Play one episode and train reinforce algorithm
@@ -38,39 +52,19 @@ def play_episode(
     :param explore (bool): flag whether exploration is used
     :param render (bool): flag whether environment should be visualised
     :param max_steps (int): max number of timesteps for the episode
+    :param telemetry (Telemetry): telemetry timing the phases of the episode
     :return (Tuple[int, float]): total number of executed steps and received reward
     """
-    obs = env.reset()
-
-    if render:
-        env.render()
-
-    done = False
-    num_steps = 0
-    episode_return = 0
-
-    observations = []
-    actions = []
-    rewards = []
-
-    while not done and num_steps < max_steps:
-        action = agent.act(np.array(obs), explore=explore)
-        nobs, rew, done, _ = env.step(action)
-
-        observations.append(obs)
-        actions.append(action)
-        rewards.append(rew)
-
-        if render:
-            env.render()
-
-        num_steps += 1
-        episode_return += rew
-
-        obs = nobs
+    rewards, observations, actions = collect_episode(
+        env, agent, explore=explore, render=render, max_steps=max_steps, telemetry=telemetry
+    )
+    num_steps = len(rewards)
+    episode_return = float(rewards.sum(dtype=np.float64))
 
     if train:
+        t = telemetry.now()
         loss = agent.update(rewards, observations, actions)
+        telemetry.lap("update", t)
 
     return num_steps, episode_return
 
@@ -94,53 +88,84 @@ def train(env: gym.Env, config, output: bool = True) -> Tuple[List[float], List[
     eval_returns_all = []
     eval_times_all = []
 
-    start_time = time.time()
-    with tqdm(total=total_steps) as pbar:
-        while timesteps_elapsed < total_steps:
-            elapsed_seconds = time.time() - start_time
-            if elapsed_seconds > config["max_time"]:
-                pbar.write(f"Training ended after {elapsed_seconds}s.")
-                break
-            agent.schedule_hyperparameters(timesteps_elapsed, total_steps)
-            num_steps, _ = play_episode(
-                env,
-                agent,
-                train=True,
-                explore=True,
-                render=False,
-                max_steps=config["episode_length"],
+    telemetry = make_telemetry(config)
+    profiler = make_profiler(config["profile"], f"reinforce_{config['env']}")
+    workers = None
+    if config["num_workers"] > 0:
+        if config["episodes_per_update"] != 1:
+            raise ValueError(
+                "Rollout workers batch num_workers * episodes_per_worker episodes into each "
+                "gradient step, so episodes_per_update must be 1 (configure episodes_per_worker "
+                "instead)"
             )
-            timesteps_elapsed += num_steps
-            pbar.update(num_steps)
+        workers = RolloutWorkers(Reinforce, "policy", agent.policy, config)
 
-            if timesteps_elapsed % config["eval_freq"] < num_steps:
-                eval_return = 0
-                if config["env"] == "CartPole-v1":
-                    max_steps = config["episode_length"]
+    start_time = time.time()
+    try:
+        with tqdm(total=total_steps) as pbar:
+            while timesteps_elapsed < total_steps:
+                elapsed_seconds = time.time() - start_time
+                if elapsed_seconds > config["max_time"]:
+                    pbar.write(f"Training ended after {elapsed_seconds}s.")
+                    break
+                agent.schedule_hyperparameters(timesteps_elapsed, total_steps)
+                if workers is not None:
+                    t = telemetry.now()
+                    episodes = workers.collect(agent.policy)
+                    t = telemetry.lap("collect", t)
+                    agent.update_batch(episodes)
+                    telemetry.lap("update", t)
+                    num_steps = sum(len(rewards) for rewards, _, _ in episodes)
                 else:
-                    raise ValueError(f"Unknown environment {config['env']}")
-
-                for _ in range(config["eval_episodes"]):
-                    _, total_reward = play_episode(
+                    num_steps, _ = play_episode(
                         env,
                         agent,
-                        train=False,
-                        explore=False,
-                        render=RENDER,
-                        max_steps=max_steps,
+                        train=True,
+                        explore=True,
+                        render=False,
+                        max_steps=config["episode_length"],
+                        telemetry=telemetry,
                     )
-                    eval_return += total_reward / (config["eval_episodes"])
-                if output:
-                    pbar.write(
-                        f"Evaluation at timestep {timesteps_elapsed} returned a mean return of {eval_return}"
-                    )
-                eval_returns_all.append(eval_return)
-                eval_times_all.append(time.time() - start_time)
-
+                timesteps_elapsed += num_steps
+                pbar.update(num_steps)
+                telemetry.step(timesteps_elapsed, num_steps)
+                profiler.step(timesteps_elapsed)
+
+                if timesteps_elapsed % config["eval_freq"] < num_steps:
+                    eval_return = 0
+                    if config["env"] == "CartPole-v1":
+                        max_steps = config["episode_length"]
+                    else:
+                        raise ValueError(f"Unknown environment {config['env']}")
+
+                    for _ in range(config["eval_episodes"]):
+                        _, total_reward = play_episode(
+                            env,
+                            agent,
+                            train=False,
+                            explore=False,
+                            render=RENDER,
+                            max_steps=max_steps,
+                        )
+                        eval_return += total_reward / (config["eval_episodes"])
+                    if output:
+                        pbar.write(
+                            f"Evaluation at timestep {timesteps_elapsed} returned a mean return of {eval_return}"
+                        )
+                    eval_returns_all.append(eval_return)
+                    eval_times_all.append(time.time() - start_time)
+    finally:
+        if workers is not None:
+            workers.close()
+    telemetry.close(timesteps_elapsed)
+    profiler.close(timesteps_elapsed)
 
     if config["save_filename"]:
         print("Saving to: ", agent.save(config["save_filename"]))
 
+    if config["export_filename"]:
+        print("Exporting policy to: ", export_policy(agent, config["export_filename"]))
+
     return np.array(eval_returns_all), np.array(eval_times_all)
 
 
@@ -1,8 +1,7 @@
-import os
 import gym
 import numpy as np
 from torch.optim import Adam
-from typing import Dict, Iterable
+from typing import Dict, Iterable, Optional, Union
 import torch
 import torch.nn.functional as F
 from torch.autograd import Variable
@@ -11,6 +10,7 @@ from torch.distributions import Normal
 from rl2022.exercise3.agents import Agent
 from rl2022.exercise3.networks import FCNetwork
 from rl2022.exercise3.replay import Transition
+from rl2022.schedules import LinearSchedule, Schedule, make_schedule
 
 
 class DDPG(Agent):
@@ -21,8 +21,12 @@ class DDPG(Agent):
     :attr policy (FCNetwork): fully connected actor network for policy
     :attr policy_optim (torch.optim): PyTorch optimiser for actor network
     :attr gamma (float): discount rate gamma
+    :attr run_state_attributes (Tuple[str]): attributes changing during training, which are
+        restored when a run is resumed (see exercise3/checkpoint.py)
     """
 
+    run_state_attributes = ("epsilon",)
+
     def __init__(
             self,
             action_space: gym.Space,
@@ -33,6 +37,7 @@ class DDPG(Agent):
             critic_hidden_size: Iterable[int],
             policy_hidden_size: Iterable[int],
             tau: float,
+            epsilon_schedule: Union[Schedule, Dict, None] = None,
             **kwargs,
     ):
         """
@@ -44,6 +49,8 @@ class DDPG(Agent):
         :param critic_hidden_size (Iterable[int]): list of hidden dimensionalities for fully connected critic
         :param policy_hidden_size (Iterable[int]): list of hidden dimensionalities for fully connected policy
         :param tau (float): step for the update of the target networks
+        :param epsilon_schedule (Union[Schedule, Dict], optional): schedule (or its configuration)
+            of epsilon over training (linear decay from 1.0 to 0.05 over 6% of training if None)
         """
         super().__init__(action_space, observation_space)
         STATE_SIZE = observation_space.shape[0]
@@ -86,6 +93,7 @@ class DDPG(Agent):
         self.critic_learning_rate = critic_learning_rate
         self.policy_learning_rate = policy_learning_rate
         self.tau = tau
+        self.epsilon_schedule = make_schedule(epsilon_schedule) or LinearSchedule(1.0, 0.05, 0.06)
 
         # ################################################### #
         # DEFINE A GAUSSIAN THAT WILL BE USED FOR EXPLORATION #
@@ -109,30 +117,6 @@ class DDPG(Agent):
             }
         )
 
-
-    def save(self, path: str, suffix: str = "") -> str:
-        """Saves saveable PyTorch models under given path
-        The models will be saved in directory found under given path in file "models_{suffix}.pt"
-        where suffix is given by the optional parameter (by default empty string "")
-        :param path (str): path to directory where to save models
-        :param suffix (str, optional): suffix given to models file
-        :return (str): path to file of saved models file
-        """
-        torch.save(self.saveables, path)
-        return path
-
-
-    def restore(self, save_path: str):
-        """Restores PyTorch models from models file given by path
-        :param save_path (str): path to file containing saved models
-        """
-        dirname, _ = os.path.split(os.path.abspath(__file__))
-        save_path = os.path.join(dirname, save_path)
-        checkpoint = torch.load(save_path)
-        for k, v in self.saveables.items():
-            v.load_state_dict(checkpoint[k].state_dict())
-
-
     def schedule_hyperparameters(self, timestep: int, max_timesteps: int):
         """Updates the hyperparameters
         **YOU MUST IMPLEMENT THIS FUNCTION FOR Q4**
@@ -141,7 +125,7 @@ class DDPG(Agent):
         :param timestep (int): current timestep at the beginning of the episode
         :param max_timestep (int): maximum timesteps that the training loop will run for
         """
-        self.epsilon = 1.0 - (min(1.0, timestep / (0.06 * max_timesteps))) * 0.95
+        self.epsilon = self.epsilon_schedule(timestep, max_timesteps)
 
     def act(self, obs: np.ndarray, explore: bool):
         """Returns an action (should be called at every timestep)
@@ -155,20 +139,23 @@ class DDPG(Agent):
         :return (sample from self.action_space): action the agent should perform
         """
         ### PUT YOUR CODE HERE ###
-        action = self.actor_target.forward(torch.from_numpy(obs).float())
+        action = self.actor_target.predict(obs)
         if explore:
-            action += self.noise.sample()
+            action += self.noise.sample().numpy()
         return action
         
 
-    def update(self, batch: Transition) -> Dict[str, float]:
+    def update(self, batch: Transition, weights: Optional[torch.Tensor] = None) -> Dict[str, float]:
         """Update function for DQN
         **YOU MUST IMPLEMENT THIS FUNCTION FOR Q4**
         This function is called after storing a transition in the replay buffer. This happens
         every timestep. It should update your critic and actor networks, target networks with soft
         updates, and return the q_loss and the policy_loss in the form of a dictionary.
         :param batch (Transition): batch vector from replay buffer
-        :return (Dict[str, float]): dictionary mapping from loss names to loss values
+        :param weights (torch.Tensor, optional): importance sampling weights of shape (batch size, 1)
+            for batches of a PrioritizedReplayBuffer
+        :return (Dict[str, float]): dictionary mapping from loss names to loss values, and
+            "td_errors" to the absolute TD errors of the batch (np.ndarray of shape (batch size,))
         """
         q_loss = 0.0
         p_loss = 0.0
@@ -186,7 +173,11 @@ class DDPG(Agent):
 
         y = rewards + self.gamma*(1 - done)*q_next
         q = self.critic(torch.cat((actions,states),1))
-        q_loss = criterion(y,q)
+        if weights is None:
+            q_loss = criterion(y,q)
+        else:
+            q_loss = (weights * (y - q) ** 2).mean()
+        td_errors = (y - q).detach().abs().squeeze(1).numpy()
 
         self.critic_optim.zero_grad()
         q_loss.backward()
@@ -201,6 +192,7 @@ class DDPG(Agent):
         self.actor_target.soft_update(self.actor, self.tau)
         
         return {
-            "q_loss": q_loss,
-            "p_loss": p_loss,
+            "q_loss": q_loss.detach().numpy(),
+            "p_loss": p_loss.detach().numpy(),
+            "td_errors": td_errors,
         }
\ No newline at end of file
@@ -1,6 +1,7 @@
 import gym
 from typing import List, Tuple
 
+from rl2022.exercise3.export import ExportedPolicy
 from rl2022.exercise4.agents import DDPG
 from rl2022.exercise4.train_ddpg import PENDULUM_CONFIG, BIPEDAL_CONFIG, play_episode
 
@@ -22,13 +23,17 @@ def evaluate(env: gym.Env, config, output: bool = True) -> Tuple[List[float], Li
     """
     timesteps_elapsed = 0
 
-    agent = DDPG(
-        action_space=env.action_space, observation_space=env.observation_space, **config
-    )
-    try:
-        agent.restore(config['save_filename'])
-    except:
-        raise ValueError(f"Could not find model to load at {config['save_filename']}")
+    if config["export_filename"]:
+        # exported policies act without constructing the agent
+        agent = ExportedPolicy(config["export_filename"])
+    else:
+        agent = DDPG(
+            action_space=env.action_space, observation_space=env.observation_space, **config
+        )
+        try:
+            agent.restore(config['save_filename'])
+        except:
+            raise ValueError(f"Could not find model to load at {config['save_filename']}")
 
     eval_returns_all = []
     eval_times_all = []
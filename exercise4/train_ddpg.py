@@ -7,8 +7,18 @@ import matplotlib.pyplot as plt
 
 from rl2022.constants import EX4_PENDULUM_CONSTANTS as PENDULUM_CONSTANTS
 from rl2022.constants import EX4_BIPEDAL_CONSTANTS as BIPEDAL_CONSTANTS
+from rl2022.exercise3.actor_learner import train_actor_learner
+from rl2022.exercise3.checkpoint import (
+    has_run_state, load_run_state, make_checkpointer, save_run_state
+)
+from rl2022.exercise3.evaluator import make_evaluator
+from rl2022.exercise3.export import export_policy
+from rl2022.exercise3.off_policy import evaluate, play_episode, record_evaluations
 from rl2022.exercise4.agents import DDPG
-from rl2022.exercise3.replay import ReplayBuffer
+from rl2022.exercise3.replay import PrefetchSampler, make_replay_buffer
+from rl2022.schedules import LinearSchedule
+from rl2022.profiling import make_profiler
+from rl2022.telemetry import make_telemetry
 
 RENDER = False
 
@@ -22,6 +32,31 @@ PENDULUM_CONFIG = {
     "tau": 0.01,
     "batch_size": 64,
     "buffer_capacity": int(1e6),
+    "epsilon_schedule": None,
+    "prioritized_replay": False,
+    "priority_alpha": 0.6,
+    "priority_beta": 0.4,
+    "buffer_dir": None, # DIRECTORY TO MEMORY-MAP THE REPLAY BUFFER TO (NONE KEEPS IT IN RAM)
+    "dedup_observations": False, # STORE EACH OBSERVATION ONCE INSTEAD OF AS STATE AND NEXT STATE
+    "buffer_dtypes": {"done": "uint8"}, # ADD "states"/"next_states": "float16" TO HALVE OBSERVATION MEMORY
+    "buffer_max_bytes": None, # MEMORY BUDGET OF THE REPLAY BUFFER IN BYTES (REDUCES THE CAPACITY TO FIT)
+    "prefetch_batches": 0, # NUMBER OF BATCHES SAMPLED AHEAD ON A BACKGROUND THREAD (0 DISABLES PREFETCHING)
+    "prefetch_staleness": None, # MAXIMUM NUMBER OF TRANSITIONS PUSHED SINCE A PREFETCHED BATCH WAS SAMPLED (NONE FOR NO LIMIT)
+    "train_freq": 1, # NUMBER OF COLLECTED TRANSITIONS BETWEEN UPDATE PHASES
+    "gradient_steps": 1, # NUMBER OF UPDATES PER UPDATE PHASE (THEIR BATCHES ARE SAMPLED IN ONE CALL)
+    "num_actors": 0, # NUMBER OF ACTOR PROCESSES FEEDING A LEARNER PROCESS (SEE train_async, 0 DISABLES)
+    "weight_publish_freq": 100, # NUMBER OF LEARNER UPDATES BETWEEN PUBLISHING PARAMETERS TO THE ACTORS
+    "max_actor_lead": 1000, # MAXIMUM NUMBER OF TRANSITIONS THE ACTORS MAY COLLECT AHEAD OF LEARNER UPDATES
+    "export_filename": None, # FILE TO EXPORT THE GREEDY POLICY TO AS TORCHSCRIPT (SEE exercise3/export.py)
+    "async_eval": False, # EVALUATE IN A SEPARATE PROCESS WHILE TRAINING CONTINUES (RESULTS ARRIVE LATER)
+    "telemetry_file": None, # JSONL FILE TO APPEND TIMINGS OF THE TRAINING LOOP TO (NONE DISABLES TELEMETRY)
+    "telemetry_window": 10000, # NUMBER OF TIMESTEPS AGGREGATED INTO EACH TELEMETRY RECORD
+    "profile": None, # WINDOW OF TIMESTEPS TO PROFILE, E.G. {"start": 10000, "stop": 11000, "backend": "cprofile"} (SEE profiling.py)
+    "checkpoint_dir": None, # DIRECTORY TO WRITE PERIODIC CHECKPOINTS TO (NONE DISABLES CHECKPOINTING)
+    "checkpoint_freq": 50000, # NUMBER OF TIMESTEPS BETWEEN CHECKPOINTS
+    "checkpoint_keep": 3, # NUMBER OF MOST RECENT CHECKPOINTS TO KEEP
+    "run_state_dir": None, # DIRECTORY TO SAVE THE RESUMABLE RUN STATE TO (TRAINING RESUMES FROM A STATE FOUND THERE)
+    "run_state_freq": 100000, # NUMBER OF TIMESTEPS BETWEEN SAVING THE RUN STATE
 }
 PENDULUM_CONFIG.update(PENDULUM_CONSTANTS)
 
@@ -35,6 +70,31 @@ BIPEDAL_CONFIG = {
     "tau": 0.05,
     "batch_size": 32,
     "buffer_capacity": int(1e6),
+    "epsilon_schedule": None,
+    "prioritized_replay": False,
+    "priority_alpha": 0.6,
+    "priority_beta": 0.4,
+    "buffer_dir": None,
+    "dedup_observations": False,
+    "buffer_dtypes": {"done": "uint8"},
+    "buffer_max_bytes": None,
+    "prefetch_batches": 0,
+    "prefetch_staleness": None,
+    "train_freq": 1,
+    "gradient_steps": 1,
+    "num_actors": 0,
+    "weight_publish_freq": 100,
+    "max_actor_lead": 1000,
+    "export_filename": None,
+    "async_eval": False,
+    "telemetry_file": None,
+    "telemetry_window": 10000,
+    "profile": None,
+    "checkpoint_dir": None,
+    "checkpoint_freq": 50000,
+    "checkpoint_keep": 3,
+    "run_state_dir": None,
+    "run_state_freq": 100000,
 }
 BIPEDAL_CONFIG.update(BIPEDAL_CONSTANTS)
 
@@ -42,54 +102,6 @@ CONFIG = PENDULUM_CONFIG
 # CONFIG = BIPEDAL_CONFIG
 
 
-def play_episode(
-        env,
-        agent,
-        replay_buffer,
-        train=True,
-        explore=True,
-        render=False,
-        max_steps=200,
-        batch_size=64,
-):
-    obs = env.reset()
-    done = False
-    losses = []
-    if render:
-        env.render()
-
-    episode_timesteps = 0
-    episode_return = 0
-
-    while not done:
-        action = agent.act(obs, explore=explore)
-        nobs, reward, done, _ = env.step(action)
-        if train:
-            replay_buffer.push(
-                np.array(obs, dtype=np.float32),
-                np.array(action, dtype=np.float32),
-                np.array(nobs, dtype=np.float32),
-                np.array([reward], dtype=np.float32),
-                np.array([done], dtype=np.float32),
-            )
-            if len(replay_buffer) >= batch_size:
-                batch = replay_buffer.sample(batch_size)
-                loss = agent.update(batch)["q_loss"]
-                losses.append(loss)
-
-        episode_timesteps += 1
-        episode_return += reward
-
-        if render:
-            env.render()
-
-        if max_steps == episode_timesteps:
-            break
-        obs = nobs
-
-    return episode_timesteps, episode_return, losses
-
-
 def train(env: gym.Env, config, output: bool = True) -> Tuple[List[float], List[float]]:
     """
     Execute training of DDPG on given environment using the provided configuration
@@ -104,20 +116,46 @@ def train(env: gym.Env, config, output: bool = True) -> Tuple[List[float], List[
     agent = DDPG(
         action_space=env.action_space, observation_space=env.observation_space, **config
     )
-    replay_buffer = ReplayBuffer(config["buffer_capacity"])
+    replay_buffer = make_replay_buffer(config)
+    # anneal the importance sampling correction to full correction at the end of training
+    beta_schedule = LinearSchedule(config["priority_beta"], 1.0, 1.0)
 
     eval_returns_all = []
     eval_times_all = []
-
-    start_time = time.time()
     losses_all = []
-    with tqdm(total=config["max_timesteps"]) as pbar:
+    elapsed_seconds = 0.0
+    if has_run_state(config["run_state_dir"]):
+        progress = load_run_state(config["run_state_dir"], agent, replay_buffer, env)
+        timesteps_elapsed = progress["timesteps_elapsed"]
+        eval_returns_all = progress["eval_returns"]
+        eval_times_all = progress["eval_times"]
+        losses_all = progress["losses"].tolist()
+        elapsed_seconds = progress["elapsed_seconds"]
+        print(f"Resuming training at timestep {timesteps_elapsed}")
+
+    sampler = None
+    if config["prefetch_batches"]:
+        sampler = PrefetchSampler(
+            replay_buffer,
+            config["batch_size"],
+            prefetch=config["prefetch_batches"],
+            max_staleness=config["prefetch_staleness"],
+        )
+    checkpointer = make_checkpointer(config)
+    telemetry = make_telemetry(config)
+    profiler = make_profiler(config["profile"], f"ddpg_{config['env']}", timesteps_elapsed)
+    evaluator = make_evaluator(DDPG, "actor_target", evaluate, config)
+
+    start_time = time.time() - elapsed_seconds
+    with tqdm(total=config["max_timesteps"], initial=timesteps_elapsed) as pbar:
         while timesteps_elapsed < config["max_timesteps"]:
             elapsed_seconds = time.time() - start_time
             if elapsed_seconds > config["max_time"]:
                 pbar.write(f"Training ended after {elapsed_seconds}s.")
                 break
             agent.schedule_hyperparameters(timesteps_elapsed, config["max_timesteps"])
+            if config["prioritized_replay"]:
+                replay_buffer.beta = beta_schedule(timesteps_elapsed, config["max_timesteps"])
             episode_timesteps, _, losses = play_episode(
                 env,
                 agent,
@@ -127,45 +165,108 @@ def train(env: gym.Env, config, output: bool = True) -> Tuple[List[float], List[
                 render=False,
                 max_steps=config["episode_length"],
                 batch_size=config["batch_size"],
+                sampler=sampler,
+                train_freq=config["train_freq"],
+                gradient_steps=config["gradient_steps"],
+                telemetry=telemetry,
             )
             timesteps_elapsed += episode_timesteps
             pbar.update(episode_timesteps)
             losses_all += losses
+            telemetry.step(timesteps_elapsed, episode_timesteps)
+            profiler.step(timesteps_elapsed)
 
+            if (
+                checkpointer is not None
+                and timesteps_elapsed % config["checkpoint_freq"] < episode_timesteps
+            ):
+                checkpointer.save(agent, timesteps_elapsed)
+
+            save_state = (
+                config["run_state_dir"]
+                and timesteps_elapsed % config["run_state_freq"] < episode_timesteps
+            )
+            eval_results = evaluator.poll() if evaluator is not None else []
             if timesteps_elapsed % config["eval_freq"] < episode_timesteps:
-                eval_returns = 0
-                for _ in range(config["eval_episodes"]):
-                    _, episode_return, _ = play_episode(
-                        env,
-                        agent,
-                        replay_buffer,
-                        train=False,
-                        explore=False,
-                        render=RENDER,
-                        max_steps=config["episode_length"],
-                        batch_size=config["batch_size"],
-                    )
-                    eval_returns += episode_return / config["eval_episodes"]
-                if output:
-                    pbar.write(
-                        f"Evaluation at timestep {timesteps_elapsed} returned a mean returns of {eval_returns}"
-                    )
-                    # pbar.write(f"Epsilon = {agent.epsilon}")
-                eval_returns_all.append(eval_returns)
-                eval_times_all.append(time.time() - start_time)
-                if eval_returns >= config["target_return"]:
-                    pbar.write(
-                        f"Reached return {eval_returns} >= target return of {config['target_return']}"
-                    )
-                    break
+                if evaluator is not None:
+                    evaluator.submit(timesteps_elapsed, agent)
+                else:
+                    eval_returns = evaluate(env, agent, replay_buffer, config, render=RENDER)
+                    eval_results.append((timesteps_elapsed, eval_returns, time.time()))
+            if save_state and evaluator is not None:
+                # results still pending in the evaluator would be lost when resuming
+                eval_results += evaluator.wait()
+            record_evaluations(
+                eval_results, eval_returns_all, eval_times_all, start_time, pbar, output
+            )
+            # results of asynchronous evaluations stop training whenever they arrive
+            reached = [r for _, r, _ in eval_results if r >= config["target_return"]]
+            if reached:
+                pbar.write(
+                    f"Reached return {reached[0]} >= target return of {config['target_return']}"
+                )
+                break
+
+            if save_state:
+                save_run_state(
+                    config["run_state_dir"],
+                    agent,
+                    replay_buffer,
+                    env,
+                    {
+                        "timesteps_elapsed": timesteps_elapsed,
+                        "eval_returns": eval_returns_all,
+                        "eval_times": eval_times_all,
+                        "losses": np.array(losses_all, dtype=np.float32),
+                        "elapsed_seconds": time.time() - start_time,
+                    },
+                )
+
+    if sampler is not None:
+        sampler.close()
+
+    if evaluator is not None:
+        record_evaluations(
+            evaluator.close(), eval_returns_all, eval_times_all, start_time, pbar, output
+        )
+
+    if checkpointer is not None:
+        checkpointer.close()
+    telemetry.close(timesteps_elapsed)
+    profiler.close(timesteps_elapsed)
 
     if config["save_filename"]:
         print("Saving to: ", agent.save(config["save_filename"]))
 
+    if config["export_filename"]:
+        print("Exporting policy to: ", export_policy(agent, config["export_filename"]))
+
     return np.array(eval_returns_all), np.array(eval_times_all)
 
 
+def train_async(env: gym.Env, config, output: bool = True) -> Tuple[List[float], List[float]]:
+    """
+    Execute training of DDPG with asynchronous actor processes and a learner in this process
+
+    The actors act with their own copy of the target policy, as DDPG.act does (see
+    train_actor_learner in exercise3/actor_learner.py). Training stops once an evaluation reaches
+    config["target_return"].
+
+    :param env (gym.Env): environment to evaluate on
+    :param config: configuration dictionary mapping configuration keys to values
+    :param output (bool): flag whether evaluation results should be printed
+    :return (Tuple[List[float], List[float]]): eval returns during training, times of evaluation
+    """
+    eval_returns_all, eval_times_all, _ = train_actor_learner(
+        env, config, DDPG, "actor_target", target_return=config["target_return"], output=output
+    )
+    return eval_returns_all, eval_times_all
+
+
 if __name__ == "__main__":
     env = gym.make(CONFIG["env"])
-    _ = train(env, CONFIG)
+    if CONFIG["num_actors"] > 0:
+        _ = train_async(env, CONFIG)
+    else:
+        _ = train(env, CONFIG)
     env.close()
@@ -2,12 +2,18 @@ from abc import ABC, abstractmethod
 from collections import defaultdict
 import random
 from copy import deepcopy
-from typing import List, Dict, DefaultDict
+from typing import List, Dict, DefaultDict, Optional, Union
 import numpy as np
 
 from gym.spaces import Space
 from gym.spaces.utils import flatdim
 
+from rl2022.rng import RandomStream, default_stream
+from rl2022.schedules import Schedule, make_schedule
+
+# created for every agent since schedules cache their values
+EPSILON_SCHEDULE_SPEC = {"type": "linear", "start": 1.0, "end": 0.05, "duration": 0.08}
+
 
 class MultiAgent(ABC):
     """Base class for multi-agent reinforcement learning
@@ -19,6 +25,8 @@ class MultiAgent(ABC):
         num_agents: int,
         action_spaces: List[Space],
         gamma: float,
+        rng: Optional[RandomStream] = None,
+        epsilon_schedule: Union[Schedule, Dict, None] = None,
         **kwargs
     ):
         """Constructor of base agent for Q-Learning
@@ -27,6 +35,10 @@ class MultiAgent(ABC):
         :param num_agents (int): number of agents
         :param action_spaces (List[Space]): action spaces of the environment for each agent
         :param gamma (float): discount factor (gamma)
+        :param rng (RandomStream, optional): stream of random numbers for action selection
+            (shared default stream if None)
+        :param epsilon_schedule (Union[Schedule, Dict], optional): schedule (or its configuration)
+            of epsilon over training (EPSILON_SCHEDULE_SPEC if None)
         :attr n_acts (List[int]): number of actions for each agent
         """
 
@@ -35,6 +47,10 @@ class MultiAgent(ABC):
         self.n_acts = [flatdim(action_space) for action_space in action_spaces]
 
         self.gamma: float = gamma
+        self.rng = rng if rng is not None else default_stream()
+        self.epsilon_schedule = make_schedule(
+            EPSILON_SCHEDULE_SPEC if epsilon_schedule is None else epsilon_schedule
+        )
 
     @abstractmethod
     def act(self) -> List[int]:
@@ -88,10 +104,8 @@ class IndependentQLearningAgents(MultiAgent):
         """
         actions = []
         for i in range(self.num_agents):
-            uniform = np.random.uniform(low=0.0, high=1.0, size=1)
-
-            if uniform <= self.epsilon:
-                actions.append(np.random.choice(range(self.n_acts[i])))
+            if self.rng.uniform() <= self.epsilon:
+                actions.append(self.rng.integer(self.n_acts[i]))
                 
             else:
                 act_vals = [self.q_tables[i][action] for action in range(self.n_acts[i])]
@@ -133,7 +147,7 @@ class IndependentQLearningAgents(MultiAgent):
         :param max_timestep (int): maximum timesteps that the training loop will run for
         """
         ### PUT YOUR CODE HERE ###
-        self.epsilon = 1.0 - (min(1.0, timestep/(0.08 * max_timestep))) * 0.95
+        self.epsilon = self.epsilon_schedule(timestep, max_timestep)
 
 
 class JointActionLearning(MultiAgent):
@@ -173,11 +187,8 @@ class JointActionLearning(MultiAgent):
         joint_action = []
         ### PUT YOUR CODE HERE ###
         for i in range(self.num_agents):
-
-            uniform = np.random.uniform(low=0.0, high=1.0, size=1)
-        
-            if uniform < self.epsilon: 
-                joint_action.append(np.random.choice(range(self.n_acts[i])))
+            if self.rng.uniform() < self.epsilon: 
+                joint_action.append(self.rng.integer(self.n_acts[i]))
 
             else:
                 j = (i+1) % 2
@@ -188,7 +199,7 @@ class JointActionLearning(MultiAgent):
                         ev += (self.models[i][actions_opponent]/max(1, sum(self.models[i].values()))) * self.q_tables[i][(actions,actions_opponent)]
                     evs.append(ev)
                 max_acts = [i for i,ev in enumerate(evs) if ev == max(evs)] # argmax EV(a_i)
-                joint_action.append(np.random.choice(max_acts))
+                joint_action.append(self.rng.choice(max_acts))
 
         return joint_action
 
@@ -236,4 +247,4 @@ class JointActionLearning(MultiAgent):
         :param max_timestep (int): maximum timesteps that the training loop will run for
         """
         ### PUT YOUR CODE HERE ###
-        self.epsilon = 1.0 - (min(1.0, timestep / (0.08 * max_timestep))) * 0.95
\ No newline at end of file
+        self.epsilon = self.epsilon_schedule(timestep, max_timestep)
\ No newline at end of file
@@ -2,6 +2,7 @@ import random
 
 import numpy as np
 
+from rl2022 import rng
 from rl2022.exercise5.agents import IndependentQLearningAgents, JointActionLearning
 from rl2022.exercise5.utils import visualise_both_q_convergence
 from rl2022.exercise5.matrix_game import create_penalty_game, create_climbing_game
@@ -21,6 +22,7 @@ SAVEFIG = None # give string to save file with generated plots under given name
 def set_seed(seed):
     np.random.seed(seed)
     random.seed(seed)
+    rng.seed(seed)
 
 if __name__ == "__main__":
     if GAME == "penalty":
@@ -7,12 +7,15 @@ from rl2022.constants import EX5_CLIMBING_CONSTANTS as CLIMBING_CONSTANTS
 from rl2022.exercise5.agents import JointActionLearning
 from rl2022.exercise5.utils import visualise_joint_q_table, evaluate, visualise_joint_q_convergence
 from rl2022.exercise5.matrix_game import create_penalty_game, create_climbing_game
+from rl2022.profiling import make_profiler
 
 
 PEN_CONFIG = {
     "eval_freq": 100,
     "lr": 0.005,
     "epsilon": 0.9,
+    "epsilon_schedule": None,
+    "profile": None,  # WINDOW OF TIMESTEPS TO PROFILE (SEE profiling.py)
 }
 PEN_CONFIG.update(PENALTY_CONSTANTS)
 
@@ -20,6 +23,8 @@ CLIMBING_CONFIG = {
     "eval_freq": 100,
     "lr": 0.05,
     "epsilon": 0.9,
+    "epsilon_schedule": None,
+    "profile": None,
 }
 CLIMBING_CONFIG.update(CLIMBING_CONSTANTS)
 
@@ -71,10 +76,12 @@ def train(env, config, output=True):
             gamma=config["gamma"],
             learning_rate=config["lr"],
             epsilon=config["epsilon"],
+            epsilon_schedule=config["epsilon_schedule"],
         )
 
     step_counter = 0
     max_steps = config["total_eps"] * env.ep_length
+    profiler = make_profiler(config["profile"], f"jal_{config['env']}")
 
     evaluation_return_means = []
     evaluation_return_stds = []
@@ -100,6 +107,7 @@ def train(env, config, output=True):
                 break
 
         # print(episodic_return)
+        profiler.step(step_counter)
 
         if eps_num > 0 and eps_num % config["eval_freq"] == 0:
             mean_return, std_return = jql_eval(
@@ -109,6 +117,7 @@ def train(env, config, output=True):
             evaluation_return_stds.append(std_return)
             evaluation_q_tables.append(copy.deepcopy(agents.q_tables))
 
+    profiler.close(step_counter)
     return evaluation_return_means, evaluation_return_stds, evaluation_q_tables, agents.q_tables
 
 
@@ -0,0 +1,187 @@
+"""
+Opt-in profiling of a window of training steps or solver sweeps
+
+Training loops and solvers report their progress to a profiler after every step (or episode,
+batch of vectorised steps or sweep). The profiler is enabled for the first time the progress
+reaches the start of its window and disabled once it reaches the end, so that startup and warmup
+are excluded from the profile. Profiles are written with cProfile as ".pstats" files (to be read
+with pstats or snakeviz) or with torch.profiler (CPU activities) as Chrome traces (to be opened in
+chrome://tracing or Perfetto), named by run and the range of steps they cover.
+
+A window is given as the "profile" configuration of a run, e.g.
+    {"start": 10000, "stop": 11000, "backend": "cprofile", "dir": "profiles"}
+or, without editing any configuration, by the environment variable RL2022_PROFILE as
+"start:stop[:backend]", e.g. RL2022_PROFILE=10000:11000:torch (the directory is then given by
+RL2022_PROFILE_DIR). Only the calling process is profiled, not worker or evaluator processes.
+"""
+import cProfile
+import os
+import time
+from typing import Dict, Optional
+
+PROFILE_ENV_VAR = "RL2022_PROFILE"
+PROFILE_DIR_ENV_VAR = "RL2022_PROFILE_DIR"
+BACKENDS = ("cprofile", "torch")
+
+
+class Profiler:
+    """Profiling of one window of steps with cProfile or torch.profiler
+
+    :attr directory (str): directory the profile is written to
+    :attr run_name (str): name of the run the profile file is named by
+    :attr start (int): step after which profiling starts
+    :attr stop (int): step at which profiling stops
+    :attr backend (str): profiler to use ("cprofile" or "torch")
+    :attr path (str, optional): path of the written profile (None until it is written)
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        run_name: str,
+        start: int,
+        stop: int,
+        backend: str = "cprofile",
+        step: int = 0,
+    ):
+        """
+        :param directory (str): directory to write the profile to (created if it does not exist)
+        :param run_name (str): name of the run the profile file is named by
+        :param start (int): step after which profiling starts
+        :param stop (int): step at which profiling stops
+        :param backend (str): profiler to use ("cprofile" or "torch")
+        :param step (int): number of steps completed before the run (e.g. when it is resumed);
+            profiling starts right away if it lies in the window
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown profiler backend {backend} (expected one of {BACKENDS})")
+        if stop <= start:
+            raise ValueError(f"Profiling window ends at {stop} before it starts at {start}")
+        self.directory = directory
+        self.run_name = f"{run_name}_{time.strftime('%Y%m%d-%H%M%S')}"
+        self.start = start
+        self.stop = stop
+        self.backend = backend
+        self.path = None
+        self._profile = None
+        self._first_step = None
+        self._done = False
+        self.step(step)
+
+    def step(self, step: int):
+        """Reports progress, starting or stopping profiling at the ends of the window
+
+        Progress may advance by several steps per call, in which case the profiled range is the one
+        between the calls at which the window was entered and left (at least one call apart, so
+        windows shorter than an episode still profile one episode).
+
+        :param step (int): number of steps (or sweeps) completed so far
+        """
+        if self._profile is None:
+            if not self._done and step >= self.start:
+                self._enable(step)
+        elif step >= self.stop:
+            self._disable(step)
+
+    def _enable(self, step: int):
+        if self.backend == "torch":
+            import torch.profiler
+
+            self._profile = torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True
+            )
+            self._profile.start()
+        else:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._first_step = step
+
+    def _disable(self, step: int):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{self.run_name}_steps{self._first_step}-{step}"
+        if self.backend == "torch":
+            self._profile.stop()
+            self.path = os.path.join(self.directory, f"{name}.json")
+            self._profile.export_chrome_trace(self.path)
+        else:
+            self._profile.disable()
+            self.path = os.path.join(self.directory, f"{name}.pstats")
+            self._profile.dump_stats(self.path)
+        self._profile = None
+        self._done = True
+
+    def close(self, step: Optional[int] = None):
+        """Writes the profile if the window was entered but not left yet (e.g. training ended
+        early)
+
+        :param step (int, optional): number of steps completed at the end of the run (the profile
+            is discarded if not given)
+        """
+        if self._profile is None:
+            return
+        if step is not None:
+            self._disable(step)
+        elif self.backend == "torch":
+            self._profile.stop()
+        else:
+            self._profile.disable()
+        self._profile = None
+        self._done = True
+
+
+class NullProfiler:
+    """Profiler which profiles nothing (used when profiling is disabled)
+    """
+
+    def step(self, step: int):
+        pass
+
+    def close(self, step: Optional[int] = None):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def profile_config_from_env() -> Optional[Dict]:
+    """Reads the profiling window from the environment variable RL2022_PROFILE
+
+    :return (Dict, optional): profiling configuration (None if the variable is not set)
+    """
+    value = os.environ.get(PROFILE_ENV_VAR)
+    if not value:
+        return None
+    fields = value.split(":")
+    if len(fields) not in (2, 3):
+        raise ValueError(f"{PROFILE_ENV_VAR} must be start:stop[:backend], got {value}")
+    profile = {"start": int(fields[0]), "stop": int(fields[1])}
+    if len(fields) == 3:
+        profile["backend"] = fields[2]
+    if os.environ.get(PROFILE_DIR_ENV_VAR):
+        profile["dir"] = os.environ[PROFILE_DIR_ENV_VAR]
+    return profile
+
+
+def make_profiler(profile: Optional[Dict], run_name: str, step: int = 0):
+    """Creates the profiler of a run
+
+    The environment variable RL2022_PROFILE takes precedence over the given configuration.
+
+    :param profile (Dict, optional): profiling configuration with keys "start" and "stop" (the
+        window of steps) and optionally "backend" ("cprofile" or "torch"), "dir" (directory to
+        write to, defaults to "profiles") and "name" (overrides run_name)
+    :param run_name (str): name of the run the profile file is named by (e.g. the algorithm)
+    :param step (int): number of steps completed before the run (e.g. when it is resumed)
+    :return (Profiler): profiler of the window (NULL_PROFILER if profiling is disabled)
+    """
+    profile = profile_config_from_env() or profile
+    if not profile:
+        return NULL_PROFILER
+    return Profiler(
+        profile.get("dir", "profiles"),
+        profile.get("name", run_name),
+        profile["start"],
+        profile["stop"],
+        backend=profile.get("backend", "cprofile"),
+        step=step,
+    )
@@ -0,0 +1,132 @@
+"""
+Buffered random number streams for per-step sampling
+"""
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+class RandomStream:
+    """Seedable stream of random numbers serving scalar draws from pre-sampled blocks
+
+    Drawing single scalars from `np.random` costs about a microsecond per call. This stream draws
+    `block_size` uniform samples at once and serves them one by one, so per-step action selection
+    does not pay this overhead. Integer draws are derived from the same uniform samples.
+
+    A stream without a seed is seeded from `np.random` when it is first used, so seeding NumPy's
+    global generator (e.g. with `np.random.seed`) also makes the stream reproducible.
+
+    :attr block_size (int): number of samples drawn from the generator at once
+    """
+
+    def __init__(self, seed: Optional[int] = None, block_size: int = 4096):
+        """Constructor of RandomStream
+
+        :param seed (int, optional): seed of the underlying generator (drawn from `np.random` on
+            first use if None)
+        :param block_size (int): number of samples drawn from the generator at once
+        """
+        self.block_size = block_size
+        self.seed(seed)
+
+    def seed(self, seed: Optional[int] = None):
+        """Reseeds the stream and discards all buffered samples
+
+        :param seed (int, optional): seed of the underlying generator (drawn from `np.random` on
+            first use if None)
+        """
+        self._rng = None if seed is None else np.random.default_rng(seed)
+        self._buffer = []
+        self._pos = 0
+
+    @property
+    def generator(self) -> np.random.Generator:
+        """Underlying generator, seeded from `np.random` on first use if no seed was given
+        """
+        if self._rng is None:
+            self._rng = np.random.default_rng(np.random.randint(2**32, dtype=np.uint64))
+        return self._rng
+
+    def get_state(self) -> dict:
+        """Gives the state of the stream (e.g. to resume a training run)
+
+        :return (dict): state of the underlying generator and the buffered samples
+        """
+        return {
+            "bit_generator": self.generator.bit_generator.state,
+            "buffer": list(self._buffer),
+            "pos": self._pos,
+        }
+
+    def set_state(self, state: dict):
+        """Restores a state of the stream given by get_state
+
+        :param state (dict): state of the stream
+        """
+        self.generator.bit_generator.state = state["bit_generator"]
+        self._buffer = list(state["buffer"])
+        self._pos = state["pos"]
+
+    def _refill(self):
+        """Draws a new block of uniform samples
+        """
+        # Python floats make indexing the buffer much cheaper than indexing a NumPy array
+        self._buffer = self.generator.random(self.block_size).tolist()
+        self._pos = 0
+
+    def uniform(self) -> float:
+        """Draws a sample uniformly from [0, 1)
+
+        :return (float): sampled value
+        """
+        if self._pos == len(self._buffer):
+            self._refill()
+        u = self._buffer[self._pos]
+        self._pos += 1
+        return u
+
+    def integer(self, high: int) -> int:
+        """Draws an integer uniformly from [0, high)
+
+        :param high (int): exclusive upper bound
+        :return (int): sampled integer
+        """
+        return int(self.uniform() * high)
+
+    def uniforms(self, size: int) -> np.ndarray:
+        """Draws an array of samples uniformly from [0, 1)
+
+        Arrays are drawn from the generator directly, bypassing the buffered block.
+
+        :param size (int): number of samples
+        :return (np.ndarray): sampled values
+        """
+        return self.generator.random(size)
+
+    def choice(self, options: Sequence):
+        """Draws an element uniformly from a sequence
+
+        :param options (Sequence): non-empty sequence to choose from
+        :return: chosen element
+        """
+        return options[self.integer(len(options))]
+
+
+_DEFAULT_STREAM = RandomStream()
+
+
+def default_stream() -> RandomStream:
+    """Gives the stream shared by all agents which were not given their own stream
+
+    :return (RandomStream): shared default stream
+    """
+    return _DEFAULT_STREAM
+
+
+def seed(seed: Optional[int] = None):
+    """Reseeds the shared default stream
+
+    :param seed (int, optional): seed of the underlying generator (drawn from `np.random` on
+        first use if None)
+    """
+    _DEFAULT_STREAM.seed(seed)
@@ -0,0 +1,204 @@
+"""
+Hyperparameter schedules shared by the agents of all exercises
+"""
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+
+class Schedule(ABC):
+    """Base class for hyperparameter schedules
+
+    A schedule gives the value of a hyperparameter at a timestep of a training run lasting
+    `max_timestep` timesteps. Durations and breakpoints are given as fractions of `max_timestep`,
+    so the same schedule can be used for runs of any length.
+
+    Values are computed vectorised in chunks of `chunk_size` timesteps which are cached, so
+    calling the schedule at every timestep only costs a list lookup.
+
+    :attr chunk_size (int): number of timesteps computed at once
+    """
+
+    name: str = None
+    chunk_size: int = 65536
+
+    def __init__(self):
+        self._chunk_key = None
+        self._chunk = []
+
+    @abstractmethod
+    def values(self, timesteps: np.ndarray, max_timestep: int) -> np.ndarray:
+        """Computes the values of the schedule at given timesteps
+
+        :param timesteps (np.ndarray): timesteps to compute values for
+        :param max_timestep (int): maximum timesteps that the training loop will run for
+        :return (np.ndarray): values of the schedule at the given timesteps
+        """
+        ...
+
+    @abstractmethod
+    def to_config(self) -> Dict:
+        """Gives a serialisable configuration of the schedule (see make_schedule)
+
+        :return (Dict): configuration dictionary containing the schedule type and its parameters
+        """
+        ...
+
+    def precompute(self, max_timestep: int) -> np.ndarray:
+        """Computes the values of the schedule for all timesteps of a training run
+
+        :param max_timestep (int): maximum timesteps that the training loop will run for
+        :return (np.ndarray): values at timesteps 0, ..., max_timestep
+        """
+        return self.values(np.arange(max_timestep + 1), max_timestep)
+
+    def __call__(self, timestep: int, max_timestep: int) -> float:
+        """Gives the value of the schedule at a timestep
+
+        :param timestep (int): current timestep
+        :param max_timestep (int): maximum timesteps that the training loop will run for
+        :return (float): value of the schedule
+        """
+        start = timestep - timestep % self.chunk_size
+        if self._chunk_key != (start, max_timestep):
+            timesteps = np.arange(start, start + self.chunk_size)
+            self._chunk = self.values(timesteps, max_timestep).tolist()
+            self._chunk_key = (start, max_timestep)
+        return self._chunk[timestep - start]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_chunk_key"], state["_chunk"] = None, []
+        return state
+
+
+class ConstantSchedule(Schedule):
+    """Schedule keeping a constant value
+    """
+
+    name = "constant"
+
+    def __init__(self, value: float):
+        """
+        :param value (float): value of the hyperparameter
+        """
+        super().__init__()
+        self.value = value
+
+    def values(self, timesteps: np.ndarray, max_timestep: int) -> np.ndarray:
+        return np.full(timesteps.shape, self.value, dtype=np.float64)
+
+    def to_config(self) -> Dict:
+        return {"type": self.name, "value": self.value}
+
+
+class LinearSchedule(Schedule):
+    """Schedule interpolating linearly from a start to an end value and staying at the end value
+    afterwards
+    """
+
+    name = "linear"
+
+    def __init__(self, start: float, end: float, duration: float):
+        """
+        :param start (float): value at timestep 0
+        :param end (float): value at the end of the decay
+        :param duration (float): fraction of the maximum timesteps over which the value decays
+            (must be positive)
+        """
+        super().__init__()
+        if duration <= 0:
+            raise ValueError(f"Duration of linear schedules must be positive, got {duration}")
+        self.start = start
+        self.end = end
+        self.duration = duration
+
+    def values(self, timesteps: np.ndarray, max_timestep: int) -> np.ndarray:
+        progress = np.minimum(1.0, timesteps / (self.duration * max_timestep))
+        return self.start + (self.end - self.start) * progress
+
+    def to_config(self) -> Dict:
+        return {"type": self.name, "start": self.start, "end": self.end, "duration": self.duration}
+
+
+class ExponentialSchedule(Schedule):
+    """Schedule interpolating geometrically from a start to an end value and staying at the end
+    value afterwards
+    """
+
+    name = "exponential"
+
+    def __init__(self, start: float, end: float, duration: float):
+        """
+        :param start (float): value at timestep 0 (must be positive)
+        :param end (float): value at the end of the decay (must be positive)
+        :param duration (float): fraction of the maximum timesteps over which the value decays
+            (must be positive)
+        """
+        super().__init__()
+        if start <= 0 or end <= 0:
+            raise ValueError("Exponential schedules require positive start and end values")
+        if duration <= 0:
+            raise ValueError(f"Duration of exponential schedules must be positive, got {duration}")
+        self.start = start
+        self.end = end
+        self.duration = duration
+
+    def values(self, timesteps: np.ndarray, max_timestep: int) -> np.ndarray:
+        progress = np.minimum(1.0, timesteps / (self.duration * max_timestep))
+        return self.start * (self.end / self.start) ** progress
+
+    def to_config(self) -> Dict:
+        return {"type": self.name, "start": self.start, "end": self.end, "duration": self.duration}
+
+
+class PiecewiseSchedule(Schedule):
+    """Schedule interpolating linearly between given breakpoints
+    """
+
+    name = "piecewise"
+
+    def __init__(self, points: Iterable[Tuple[float, float]]):
+        """
+        :param points (Iterable[Tuple[float, float]]): (fraction of maximum timesteps, value)
+            breakpoints in increasing order of fractions. The value of the first (last) breakpoint
+            is kept before (after) it
+        """
+        super().__init__()
+        self.points: List[Tuple[float, float]] = [(float(x), float(y)) for x, y in points]
+        self._fractions = np.array([x for x, _ in self.points])
+        self._values = np.array([y for _, y in self.points])
+        if np.any(np.diff(self._fractions) < 0):
+            raise ValueError("Breakpoints of piecewise schedules must be in increasing order")
+
+    def values(self, timesteps: np.ndarray, max_timestep: int) -> np.ndarray:
+        return np.interp(timesteps / max_timestep, self._fractions, self._values)
+
+    def to_config(self) -> Dict:
+        return {"type": self.name, "points": [list(p) for p in self.points]}
+
+
+SCHEDULES = {
+    cls.name: cls
+    for cls in (ConstantSchedule, LinearSchedule, ExponentialSchedule, PiecewiseSchedule)
+}
+
+
+def make_schedule(config: Union[Schedule, Dict, float, None]) -> Optional[Schedule]:
+    """Creates a schedule from its configuration
+
+    :param config (Union[Schedule, Dict, float, None]): schedule (returned as is), configuration
+        dictionary with the schedule "type" and its parameters (see Schedule.to_config), a
+        constant value or None
+    :return (Optional[Schedule]): created schedule (None if config is None)
+    """
+    if config is None or isinstance(config, Schedule):
+        return config
+    if isinstance(config, (int, float)):
+        return ConstantSchedule(config)
+    params = dict(config)
+    schedule_type = params.pop("type")
+    if schedule_type not in SCHEDULES:
+        raise ValueError(f"Unknown schedule type {schedule_type}")
+    return SCHEDULES[schedule_type](**params)
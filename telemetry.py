@@ -0,0 +1,155 @@
+"""
+Timing telemetry of training loops
+
+Training loops time their phases (e.g. acting, stepping the environment, pushing to and sampling
+from the replay buffer and updating the agent) with a monotonic clock. The durations are
+aggregated over windows of timesteps into steps per second, the share of wallclock time spent in
+every phase and latency percentiles, and every window is written as one JSON line.
+
+Loops take a telemetry object and call `now`/`lap` around their phases unconditionally. When
+telemetry is disabled they are given NULL_TELEMETRY, whose methods do nothing.
+"""
+from collections import defaultdict
+import json
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+
+class Telemetry:
+    """Aggregation of phase durations into windows written to a JSONL file
+
+    Every record holds the timestep at the end of the window, the number of steps and seconds of
+    the window, steps per second and for every phase its number of calls, total seconds, share of
+    the window in percent and latency percentiles in milliseconds. Time not spent in any timed
+    phase is reported as the share "other_percent".
+
+    :attr path (str): path of the JSONL file records are appended to
+    :attr window (int): number of timesteps aggregated into each record
+    :attr percentiles (Sequence[float]): latency percentiles reported for every phase
+    """
+
+    now = staticmethod(time.perf_counter)
+
+    def __init__(self, path: str, window: int = 10000, percentiles: Sequence[float] = (50, 90, 99)):
+        """
+        :param path (str): path of the JSONL file to append records to
+        :param window (int): number of timesteps aggregated into each record
+        :param percentiles (Sequence[float]): latency percentiles reported for every phase
+        """
+        self.path = path
+        self.window = window
+        self.percentiles = tuple(percentiles)
+        self._file = open(path, "a")
+        self._durations = defaultdict(list)
+        self._steps = 0
+        self._window_start = self.now()
+
+    def lap(self, phase: str, start: float) -> float:
+        """Records the duration of a phase which started at a given time
+
+        :param phase (str): name of the phase
+        :param start (float): time the phase started at (as given by now())
+        :return (float): current time, i.e. the start of the next phase
+        """
+        now = self.now()
+        self._durations[phase].append(now - start)
+        return now
+
+    def step(self, timestep: int, steps: int = 1):
+        """Counts executed timesteps and writes a record once the window is complete
+
+        :param timestep (int): current timestep of training
+        :param steps (int): number of timesteps executed since the last call
+        """
+        self._steps += steps
+        if self._steps >= self.window:
+            self.flush(timestep)
+
+    def summary(self, timestep: int) -> Dict:
+        """Aggregates the durations recorded in the current window
+
+        :param timestep (int): current timestep of training
+        :return (Dict): record of the window (see class description)
+        """
+        seconds = self.now() - self._window_start
+        record = {
+            "timestep": timestep,
+            "steps": self._steps,
+            "seconds": seconds,
+            "steps_per_sec": self._steps / seconds if seconds > 0 else 0.0,
+            "phases": {},
+        }
+        timed = 0.0
+        for phase, durations in self._durations.items():
+            durations = np.array(durations)
+            total = float(durations.sum())
+            timed += total
+            stats = {
+                "count": len(durations),
+                "seconds": total,
+                "percent": 100 * total / seconds if seconds > 0 else 0.0,
+            }
+            for q, value in zip(self.percentiles, np.percentile(durations, self.percentiles)):
+                stats[f"p{q:g}_ms"] = 1000 * float(value)
+            record["phases"][phase] = stats
+        record["other_percent"] = 100 * max(0.0, seconds - timed) / seconds if seconds > 0 else 0.0
+        return record
+
+    def flush(self, timestep: int):
+        """Writes the record of the current window (if it holds any steps) and starts a new one
+
+        :param timestep (int): current timestep of training
+        """
+        if self._steps > 0:
+            self._file.write(json.dumps(self.summary(timestep)) + "\n")
+            self._file.flush()
+        self._durations = defaultdict(list)
+        self._steps = 0
+        self._window_start = self.now()
+
+    def close(self, timestep: Optional[int] = None):
+        """Writes the record of the last (incomplete) window and closes the file
+
+        :param timestep (int, optional): timestep at the end of training (the record is dropped
+            if not given)
+        """
+        if timestep is not None:
+            self.flush(timestep)
+        self._file.close()
+
+
+class NullTelemetry:
+    """Telemetry which records nothing (used when telemetry is disabled)
+    """
+
+    def now(self) -> float:
+        return 0.0
+
+    def lap(self, phase: str, start: float) -> float:
+        return 0.0
+
+    def step(self, timestep: int, steps: int = 1):
+        pass
+
+    def flush(self, timestep: int):
+        pass
+
+    def close(self, timestep: Optional[int] = None):
+        pass
+
+
+NULL_TELEMETRY = NullTelemetry()
+
+
+def make_telemetry(config):
+    """Creates the telemetry of a training run
+
+    :param config: configuration dictionary mapping configuration keys to values
+    :return (Telemetry): telemetry writing to config["telemetry_file"] every
+        config["telemetry_window"] timesteps (NULL_TELEMETRY if no file is given)
+    """
+    if not config["telemetry_file"]:
+        return NULL_TELEMETRY
+    return Telemetry(config["telemetry_file"], window=config["telemetry_window"])
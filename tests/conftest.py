@@ -0,0 +1,15 @@
+"""
+Makes the repository importable as the rl2022 package when the tests are run from a checkout
+"""
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import rl2022  # noqa: F401
+except ImportError:
+    package = types.ModuleType("rl2022")
+    package.__path__ = [ROOT]
+    sys.modules["rl2022"] = package
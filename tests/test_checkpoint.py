@@ -0,0 +1,100 @@
+import random
+
+import gym
+import numpy as np
+import torch
+
+from rl2022 import rng
+from rl2022.exercise3.agents import DQN
+from rl2022.exercise3.checkpoint import (
+    Checkpointer,
+    has_run_state,
+    load_checkpoint,
+    load_run_state,
+    save_run_state,
+)
+from rl2022.exercise3.replay import ReplayBuffer
+
+CONFIG = {
+    "learning_rate": 1e-2,
+    "hidden_size": (16,),
+    "target_update_freq": 100,
+    "batch_size": 8,
+    "gamma": 0.99,
+}
+
+
+def _make(env, **config):
+    return DQN(
+        action_space=env.action_space,
+        observation_space=env.observation_space,
+        **dict(CONFIG, **config),
+    )
+
+
+def _fill(buffer, n):
+    for i in range(n):
+        buffer.push(
+            np.full(4, i, dtype=np.float32),
+            np.array([i % 2], dtype=np.float32),
+            np.full(4, i + 1, dtype=np.float32),
+            np.array([1.0], dtype=np.float32),
+            np.array([0.0], dtype=np.float32),
+        )
+
+
+def _draws(env):
+    return (
+        random.random(),
+        np.random.rand(),
+        torch.rand(1).item(),
+        rng.default_stream().uniform(),
+        env.unwrapped.np_random.random(),
+    )
+
+
+def test_run_state_round_trip(tmp_path):
+    directory = str(tmp_path / "run")
+    env = gym.make("CartPole-v1")
+    env.seed(0)
+    agent = _make(env)
+    agent.epsilon, agent.update_counter = 0.3, 42
+    buffer = ReplayBuffer(50)
+    _fill(buffer, 70)
+    assert not has_run_state(directory)
+    save_run_state(directory, agent, buffer, env, {"timesteps_elapsed": 70})
+    assert has_run_state(directory)
+    draws = _draws(env)
+
+    # the resumed run is configured with other hyperparameters, which have to be kept
+    resumed = _make(env, learning_rate=1e-3, batch_size=16)
+    resumed_buffer = ReplayBuffer(50)
+    progress = load_run_state(directory, resumed, resumed_buffer, env)
+
+    assert progress == {"timesteps_elapsed": 70}
+    assert (resumed.epsilon, resumed.update_counter) == (0.3, 42)
+    assert (resumed.learning_rate, resumed.batch_size) == (1e-3, 16)
+    for name, obj in agent.saveables.items():
+        if isinstance(obj, torch.nn.Module):
+            for expected, actual in zip(obj.parameters(), resumed.saveables[name].parameters()):
+                torch.testing.assert_close(actual, expected)
+    assert resumed_buffer.writes == 70 and len(resumed_buffer) == 50
+    for expected, actual in zip(buffer.memory, resumed_buffer.memory):
+        np.testing.assert_array_equal(actual, expected[:len(buffer)])
+    assert _draws(env) == draws
+
+
+def test_checkpointer_keeps_latest(tmp_path):
+    env = gym.make("CartPole-v1")
+    agent = _make(env)
+    checkpointer = Checkpointer(str(tmp_path), keep_last=2)
+    for timestep in (10, 20, 30):
+        checkpointer.save(agent, timestep)
+    checkpointer.close()
+
+    assert len(checkpointer.checkpoints()) == 2
+    state = load_checkpoint(checkpointer.latest())
+    restored = _make(env)
+    restored.critics_net.load_state_dict(state["critics_net"])
+    for expected, actual in zip(agent.critics_net.parameters(), restored.critics_net.parameters()):
+        torch.testing.assert_close(actual, expected)
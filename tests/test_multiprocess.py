@@ -0,0 +1,95 @@
+"""
+Smoke tests of training with several processes (run with the default fork start method)
+"""
+import gym
+import numpy as np
+import pytest
+import torch
+
+from rl2022.exercise2 import train_q_learning
+from rl2022.exercise2.agents import QLearningAgent
+from rl2022.exercise3 import train_dqn
+from rl2022.exercise3.agents import DQN
+from rl2022.exercise3.evaluator import AsyncEvaluator
+from rl2022.exercise3.off_policy import evaluate
+
+HOGWILD_CONFIG = dict(
+    train_q_learning.CONFIG, total_eps=200, num_workers=2, eval_freq=100, eval_episodes=5
+)
+DQN_CONFIG = dict(
+    train_dqn.CARTPOLE_CONFIG,
+    max_timesteps=1000,
+    eval_freq=500,
+    eval_episodes=2,
+    batch_size=16,
+    plot_loss=False,
+    save_filename=None,
+)
+
+
+def _fail(*args, **kwargs):
+    raise RuntimeError("failure injected by the test")
+
+
+def test_hogwild_training():
+    env = gym.make(HOGWILD_CONFIG["env"])
+    total_reward, means, _, q_table = train_q_learning.train_hogwild(
+        env, HOGWILD_CONFIG, output=False
+    )
+    assert len(means) == 2
+    assert np.isfinite(total_reward)
+    assert np.any(q_table != 0)
+
+
+def test_hogwild_reports_failed_workers(monkeypatch):
+    monkeypatch.setattr(QLearningAgent, "act", _fail)
+    env = gym.make(HOGWILD_CONFIG["env"])
+    with pytest.raises(RuntimeError, match="Hogwild worker"):
+        train_q_learning.train_hogwild(env, HOGWILD_CONFIG, output=False)
+
+
+def test_async_evaluation_keeps_learner_parameters():
+    env = gym.make(DQN_CONFIG["env"])
+    agent = DQN(action_space=env.action_space, observation_space=env.observation_space, **DQN_CONFIG)
+    obs = env.reset()
+    q_values = agent.critics_net.predict(obs).copy()
+    parameters = [p.detach().clone() for p in agent.critics_net.parameters()]
+    data_ptrs = [p.data_ptr() for p in agent.critics_net.parameters()]
+
+    evaluator = AsyncEvaluator(DQN, "critics_net", evaluate, DQN_CONFIG, seed=0)
+    evaluator.submit(0, agent)
+    with torch.no_grad():
+        for p in agent.critics_net.parameters():
+            p.add_(1.0)
+    evaluator.submit(1, agent)
+    results = evaluator.close()
+
+    assert [timestep for timestep, _, _ in results] == [0, 1]
+    # the learner's parameters stay in its own memory and predictions follow its updates
+    assert [p.data_ptr() for p in agent.critics_net.parameters()] == data_ptrs
+    for p, before in zip(agent.critics_net.parameters(), parameters):
+        torch.testing.assert_close(p.detach(), before + 1.0)
+    assert not np.allclose(agent.critics_net.predict(obs), q_values)
+
+
+def test_training_with_async_evaluation():
+    env = gym.make(DQN_CONFIG["env"])
+    eval_returns, _ = train_dqn.train(env, dict(DQN_CONFIG, async_eval=True), output=False)
+    assert len(eval_returns) == 2
+    assert np.all(np.isfinite(eval_returns))
+
+
+def test_actor_learner_training():
+    env = gym.make(DQN_CONFIG["env"])
+    config = dict(DQN_CONFIG, num_actors=2, max_actor_lead=200, async_eval=True)
+    eval_returns, _ = train_dqn.train_async(env, config, output=False)
+    assert len(eval_returns) >= 1
+    assert np.all(np.isfinite(eval_returns))
+
+
+def test_actor_learner_reports_failed_actors(monkeypatch):
+    monkeypatch.setattr(DQN, "act", _fail)
+    env = gym.make(DQN_CONFIG["env"])
+    config = dict(DQN_CONFIG, num_actors=2)
+    with pytest.raises(RuntimeError, match="Actor"):
+        train_dqn.train_async(env, config, output=False)
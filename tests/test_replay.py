@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+
+from rl2022.exercise3.replay import DedupReplayBuffer, MinTree, ReplayBuffer, SumTree
+
+
+def _transitions(n, offset=0):
+    """Gives n transitions whose components identify their index"""
+    index = np.arange(offset, offset + n, dtype=np.float32)
+    return (
+        np.stack([index, -index], axis=1),
+        index[:, None],
+        np.stack([index + 0.5, -index], axis=1),
+        index[:, None] * 2,
+        np.zeros((n, 1), dtype=np.float32),
+    )
+
+
+def test_sum_tree_update_and_reduce():
+    tree = SumTree(6)
+    values = np.array([1.0, 0.0, 3.0, 2.0, 0.5, 4.0])
+    tree.update(np.arange(6), values)
+    assert tree.size == 8
+    assert tree.reduce() == pytest.approx(values.sum())
+    np.testing.assert_array_equal(tree[np.arange(6)], values)
+
+    tree.update(np.array([2, 5]), np.array([0.25, 1.0]))
+    values[[2, 5]] = [0.25, 1.0]
+    assert tree.reduce() == pytest.approx(values.sum())
+    # every inner node holds the sum of its children
+    inner = np.arange(1, tree.size)
+    np.testing.assert_allclose(tree.tree[inner], tree.tree[2 * inner] + tree.tree[2 * inner + 1])
+
+
+def test_sum_tree_find_prefixsum():
+    tree = SumTree(4)
+    tree.update(np.arange(4), np.array([1.0, 0.0, 3.0, 2.0]))
+    prefixsums = np.array([0.0, 0.5, 0.999, 1.0, 3.999, 4.0, 5.999])
+    np.testing.assert_array_equal(tree.find_prefixsum(prefixsums), [0, 0, 0, 2, 2, 3, 3])
+
+
+def test_sum_tree_samples_proportionally():
+    values = np.array([1.0, 0.0, 3.0, 2.0, 4.0])
+    tree = SumTree(len(values))
+    tree.update(np.arange(len(values)), values)
+    random_state = np.random.RandomState(0)
+    leaves = tree.find_prefixsum(random_state.uniform(0, tree.reduce(), size=100000))
+    frequencies = np.bincount(leaves, minlength=len(values)) / len(leaves)
+    np.testing.assert_allclose(frequencies, values / values.sum(), atol=0.01)
+
+
+def test_min_tree_update_and_reduce():
+    tree = MinTree(5)
+    tree.update(np.arange(5), np.array([3.0, 2.0, 5.0, 4.0, 6.0]))
+    assert tree.reduce() == 2.0
+    tree.update(np.array([1]), np.array([7.0]))
+    assert tree.reduce() == 3.0
+
+
+@pytest.mark.parametrize("pushed, batch", [(3, 4), (0, 5), (2, 12)])
+def test_push_batch_wraps_around(pushed, batch):
+    capacity = 5
+    single = ReplayBuffer(capacity, initial_size=2)
+    batched = ReplayBuffer(capacity, initial_size=2)
+    for transition in zip(*_transitions(pushed)):
+        single.push(*transition)
+        batched.push(*transition)
+
+    transitions = _transitions(batch, offset=pushed)
+    for transition in zip(*transitions):
+        single.push(*transition)
+    positions = batched.push_batch(*transitions)
+
+    assert batched.writes == single.writes == pushed + batch
+    assert len(batched) == min(capacity, pushed + batch)
+    kept = min(batch, capacity)
+    np.testing.assert_array_equal(
+        positions, (pushed + batch - kept + np.arange(kept)) % capacity
+    )
+    for expected, actual in zip(single.memory, batched.memory):
+        np.testing.assert_array_equal(actual[:len(batched)], expected[:len(single)])
+
+
+def _push_episodes(buffer, lengths):
+    """Pushes episodes of given lengths and gives the next state of every pushed transition"""
+    next_states = []
+    action = 0
+    for episode, length in enumerate(lengths):
+        states = np.array([[episode, t] for t in range(length + 1)], dtype=np.float32)
+        for t in range(length):
+            buffer.push(
+                states[t],
+                np.array([action], dtype=np.float32),
+                states[t + 1],
+                np.array([1.0], dtype=np.float32),
+                np.array([t == length - 1], dtype=np.float32),
+            )
+            next_states.append(states[t + 1])
+            action += 1
+    return np.array(next_states)
+
+
+def _assert_next_states(buffer, next_states):
+    """Checks that sampled transitions (identified by their action) have the pushed next states"""
+    batch = buffer.sample(1000, random_state=np.random.RandomState(0))
+    actions = batch.actions.numpy()[:, 0].astype(np.int64)
+    assert len(np.unique(actions)) == len(buffer)
+    np.testing.assert_array_equal(batch.next_states.numpy(), next_states[actions])
+
+
+def test_dedup_episode_boundaries():
+    buffer = DedupReplayBuffer(100)
+    next_states = _push_episodes(buffer, [3, 1, 4])
+    # only the last transitions of episodes store their next states separately
+    np.testing.assert_array_equal(np.flatnonzero(buffer.boundaries), [2, 3, 7])
+    _assert_next_states(buffer, next_states)
+
+
+def test_dedup_wraps_around():
+    buffer = DedupReplayBuffer(5, initial_size=2)
+    next_states = _push_episodes(buffer, [3, 4, 2])
+    assert len(buffer) == 5
+    _assert_next_states(buffer, next_states)
+
+
+def test_dedup_save_and_load_state(tmp_path):
+    buffer = DedupReplayBuffer(8)
+    next_states = _push_episodes(buffer, [2, 3])
+    buffer.save_state(str(tmp_path))
+
+    restored = DedupReplayBuffer(8)
+    restored.load_state(str(tmp_path))
+    assert restored.writes == buffer.writes
+    _assert_next_states(restored, next_states)
+
+    # a transition pushed after resuming continues the episode of the latest saved transition
+    state, next_state = next_states[-1], np.array([1, 4], dtype=np.float32)
+    restored.push(
+        state,
+        np.array([len(next_states)], dtype=np.float32),
+        next_state,
+        np.array([1.0], dtype=np.float32),
+        np.array([0.0], dtype=np.float32),
+    )
+    np.testing.assert_array_equal(np.flatnonzero(restored.boundaries), [1, 5])
+    _assert_next_states(restored, np.concatenate([next_states, next_state[None]]))
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from rl2022.exercise2.agents import EPSILON_SCHEDULE_SPEC as EX2_SPEC
+from rl2022.exercise5.agents import EPSILON_SCHEDULE_SPEC as EX5_SPEC
+from rl2022.schedules import (
+    ExponentialSchedule,
+    LinearSchedule,
+    PiecewiseSchedule,
+    Schedule,
+    make_schedule,
+)
+
+MAX_TIMESTEPS = [1000, 12345, 200000]
+
+
+def _ex2_epsilon(timestep, max_timestep):
+    """Epsilon schedule formerly computed by the agents of exercise 2"""
+    max_deduct, decay = 0.95, 0.5
+    epsilon = 0.7 - (min(0.7, timestep / (decay * max_timestep))) * max_deduct
+    return min(epsilon, 1 - min(1, timestep / (0.75 * max_timestep)))
+
+
+def _ex4_epsilon(timestep, max_timesteps):
+    """Epsilon schedule formerly computed by DDPG in exercise 4"""
+    return 1.0 - (min(1.0, timestep / (0.06 * max_timesteps))) * 0.95
+
+
+def _ex5_epsilon(timestep, max_timestep):
+    """Epsilon schedule formerly computed by the agents of exercise 5"""
+    return 1.0 - (min(1.0, timestep / (0.08 * max_timestep))) * 0.95
+
+
+@pytest.mark.parametrize(
+    "schedule, formula",
+    [
+        (EX2_SPEC, _ex2_epsilon),
+        (LinearSchedule(1.0, 0.05, 0.06), _ex4_epsilon),
+        (EX5_SPEC, _ex5_epsilon),
+    ],
+)
+@pytest.mark.parametrize("max_timestep", MAX_TIMESTEPS)
+def test_schedules_match_former_formulas(schedule, formula, max_timestep):
+    schedule = make_schedule(schedule)
+    expected = [formula(t, max_timestep) for t in range(max_timestep + 1)]
+    np.testing.assert_allclose(schedule.precompute(max_timestep), expected, atol=1e-12)
+    # calls are served from cached chunks, including across chunk boundaries
+    for t in range(0, max_timestep + 1, 997):
+        assert schedule(t, max_timestep) == pytest.approx(expected[t], abs=1e-12)
+
+
+def test_calls_follow_changes_of_max_timestep():
+    schedule = LinearSchedule(1.0, 0.0, 1.0)
+    assert schedule(50, 100) == pytest.approx(0.5)
+    assert schedule(50, 200) == pytest.approx(0.75)
+
+
+def test_exponential_schedule():
+    schedule = ExponentialSchedule(1.0, 0.01, 0.5)
+    np.testing.assert_allclose(
+        schedule.values(np.array([0, 25, 50, 100]), 100), [1.0, 0.1, 0.01, 0.01]
+    )
+
+
+@pytest.mark.parametrize("cls", [LinearSchedule, ExponentialSchedule])
+@pytest.mark.parametrize("duration", [0, -0.1])
+def test_non_positive_durations_are_rejected(cls, duration):
+    with pytest.raises(ValueError):
+        cls(1.0, 0.05, duration)
+
+
+def test_piecewise_breakpoints_must_increase():
+    with pytest.raises(ValueError):
+        PiecewiseSchedule([(0.5, 1.0), (0.1, 0.0)])
+
+
+@pytest.mark.parametrize("config", [EX2_SPEC, EX5_SPEC, 0.0, 0.3])
+def test_make_schedule_round_trip(config):
+    schedule = make_schedule(config)
+    assert isinstance(schedule, Schedule)
+    restored = make_schedule(schedule.to_config())
+    np.testing.assert_array_equal(restored.precompute(1000), schedule.precompute(1000))